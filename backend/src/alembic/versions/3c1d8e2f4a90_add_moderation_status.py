@@ -0,0 +1,32 @@
+"""add moderation status
+
+Revision ID: 3c1d8e2f4a90
+Revises: af9eb54760b7
+Create Date: 2024-08-12 18:41:07.512204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1d8e2f4a90'
+down_revision: Union[str, None] = 'af9eb54760b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('post', sa.Column(
+        'moderation_status', sa.String(), server_default='done', nullable=False
+    ))
+    op.add_column('comment', sa.Column(
+        'moderation_status', sa.String(), server_default='done', nullable=False
+    ))
+
+
+def downgrade() -> None:
+    op.drop_column('comment', 'moderation_status')
+    op.drop_column('post', 'moderation_status')
@@ -0,0 +1,47 @@
+"""add comment counters
+
+Revision ID: 7b2f4c9d1e35
+Revises: 3c1d8e2f4a90
+Create Date: 2024-08-14 11:02:36.904118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2f4c9d1e35'
+down_revision: Union[str, None] = '3c1d8e2f4a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('comment_counter',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('friendly', sa.BigInteger(), nullable=False),
+    sa.Column('unfriendly', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # user_id 0 holds the totals of all users
+    op.execute("""
+        INSERT INTO comment_counter (user_id, friendly, unfriendly)
+        SELECT user_id,
+               count(*) FILTER (WHERE friendly),
+               count(*) FILTER (WHERE NOT friendly)
+        FROM comment
+        WHERE moderation_status = 'done' AND user_id IS NOT NULL
+        GROUP BY user_id
+        UNION ALL
+        SELECT 0,
+               count(*) FILTER (WHERE friendly),
+               count(*) FILTER (WHERE NOT friendly)
+        FROM comment
+        WHERE moderation_status = 'done'
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('comment_counter')
@@ -0,0 +1,44 @@
+"""add comment daily stats
+
+Revision ID: 9e4a6b0c2d17
+Revises: 7b2f4c9d1e35
+Create Date: 2024-08-15 09:27:51.338402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4a6b0c2d17'
+down_revision: Union[str, None] = '7b2f4c9d1e35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('comment_daily_stats',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('post_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('friendly', sa.BigInteger(), nullable=False),
+    sa.Column('unfriendly', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'post_id', 'user_id')
+    )
+    op.execute("""
+        INSERT INTO comment_daily_stats (day, post_id, user_id, friendly, unfriendly)
+        SELECT date(created_at),
+               coalesce(post_id, 0),
+               coalesce(user_id, 0),
+               count(*) FILTER (WHERE friendly),
+               count(*) FILTER (WHERE NOT friendly)
+        FROM comment
+        WHERE moderation_status = 'done' AND created_at IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('comment_daily_stats')
@@ -0,0 +1,28 @@
+"""add post comments version
+
+Revision ID: a4c9e1f7b250
+Revises: e6f1a9c4d2b8
+Create Date: 2024-08-28 14:22:41.903117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c9e1f7b250'
+down_revision: Union[str, None] = 'e6f1a9c4d2b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('post', sa.Column(
+        'comments_version', sa.Integer(), server_default='0', nullable=False
+    ))
+
+
+def downgrade() -> None:
+    op.drop_column('post', 'comments_version')
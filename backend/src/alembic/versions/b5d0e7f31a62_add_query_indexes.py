@@ -0,0 +1,49 @@
+"""add query indexes
+
+Revision ID: b5d0e7f31a62
+Revises: 9e4a6b0c2d17
+Create Date: 2024-08-16 16:48:12.074551
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d0e7f31a62'
+down_revision: Union[str, None] = '9e4a6b0c2d17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name, table, columns, options
+INDEXES = [
+    ('ix_comment_friendly_id', 'comment', ['id'],
+     {'postgresql_where': sa.text('friendly')}),
+    ('ix_comment_user_id_id', 'comment', ['user_id', 'id'], {}),
+    ('ix_comment_post_id_id_friendly', 'comment', ['post_id', 'id'],
+     {'postgresql_where': sa.text('friendly')}),
+    ('ix_comment_parent_id_id', 'comment', ['parent_id', 'id'], {}),
+    ('ix_comment_created_at', 'comment', ['created_at'],
+     {'postgresql_include': ['friendly', 'moderation_status', 'post_id', 'user_id']}),
+    ('ix_post_friendly_id', 'post', ['id'],
+     {'postgresql_where': sa.text('friendly')}),
+    ('ix_post_user_id_id', 'post', ['user_id', 'id'], {}),
+    ('ix_post_created_at', 'post', ['created_at'], {}),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            op.create_index(
+                name, table, columns, postgresql_concurrently=True, **options
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,40 @@
+"""add pending moderation indexes
+
+Revision ID: b7e3d9f05c21
+Revises: a4c9e1f7b250
+Create Date: 2024-09-02 10:37:54.218406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3d9f05c21'
+down_revision: Union[str, None] = 'a4c9e1f7b250'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name, table
+INDEXES = [
+    ('ix_comment_pending_updated_at', 'comment'),
+    ('ix_post_pending_updated_at', 'post'),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table in INDEXES:
+            op.create_index(
+                name, table, ['updated_at'], postgresql_concurrently=True,
+                postgresql_where=sa.text("moderation_status = 'pending'"),
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,27 @@
+"""add comment updated_at
+
+Revision ID: c8a1f5e92b47
+Revises: b5d0e7f31a62
+Create Date: 2024-08-19 11:26:53.310442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8a1f5e92b47'
+down_revision: Union[str, None] = 'b5d0e7f31a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('comment', sa.Column('updated_at', sa.TIMESTAMP(), nullable=True))
+    op.execute("UPDATE comment SET updated_at = created_at")
+
+
+def downgrade() -> None:
+    op.drop_column('comment', 'updated_at')
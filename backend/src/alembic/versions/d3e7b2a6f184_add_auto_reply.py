@@ -0,0 +1,37 @@
+"""add auto reply
+
+Revision ID: d3e7b2a6f184
+Revises: c8a1f5e92b47
+Create Date: 2024-08-20 15:02:41.887316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3e7b2a6f184'
+down_revision: Union[str, None] = 'c8a1f5e92b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('auto_reply',
+    sa.Column('comment_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('reply_id', sa.Integer(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+    sa.Column('updated_at', sa.TIMESTAMP(), nullable=True),
+    sa.ForeignKeyConstraint(['author_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['comment_id'], ['comment.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('comment_id', 'author_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('auto_reply')
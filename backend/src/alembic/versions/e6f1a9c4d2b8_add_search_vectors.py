@@ -0,0 +1,50 @@
+"""add search vectors
+
+Revision ID: e6f1a9c4d2b8
+Revises: d3e7b2a6f184
+Create Date: 2024-08-24 10:12:38.514207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6f1a9c4d2b8'
+down_revision: Union[str, None] = 'd3e7b2a6f184'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table, generated tsvector expression; titles weigh more than contents
+VECTORS = [
+    ('post', "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+             "setweight(to_tsvector('english', coalesce(content, '')), 'B')"),
+    ('comment', "to_tsvector('english', coalesce(content, ''))"),
+]
+
+
+def upgrade() -> None:
+    for table, expression in VECTORS:
+        op.add_column(table, sa.Column(
+            'search_vector', postgresql.TSVECTOR(),
+            sa.Computed(expression, persisted=True),
+        ))
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for table, _ in VECTORS:
+            op.create_index(
+                f'ix_{table}_search_vector', table, ['search_vector'],
+                postgresql_using='gin', postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table, _ in reversed(VECTORS):
+            op.drop_index(f'ix_{table}_search_vector', table_name=table,
+                          postgresql_concurrently=True)
+    for table, _ in reversed(VECTORS):
+        op.drop_column(table, 'search_vector')
@@ -1,10 +1,16 @@
+from typing import Optional
+
+from fastapi import Depends, HTTPException
 from fastapi_users import FastAPIUsers
 from fastapi_users.authentication import AuthenticationBackend, BearerTransport
 from fastapi_users.authentication import JWTStrategy
+from sqlalchemy.orm import sessionmaker
 
-from auth.manager import get_user_manager
+from auth.manager import UserManager, get_user_manager
 from auth.models import User
+from auth.utils import CachedUserDatabase
 from config import SECRET_AUTH
+from database import get_async_session_maker
 
 bearer_transport = BearerTransport(tokenUrl="auth/login")
 
@@ -25,3 +31,21 @@ fastapi_users = FastAPIUsers[User, int](
 )
 
 current_user = fastapi_users.current_user()
+
+
+async def current_streaming_user(
+        token: Optional[str] = Depends(bearer_transport.scheme),
+        session_maker: sessionmaker = Depends(get_async_session_maker),
+) -> User:
+    """
+    Same as current_user, for responses that outlive the request: the session
+    resolving the user is closed before the response starts, instead of being
+    held until the response ends.
+    """
+    async with session_maker() as session:
+        user = await get_jwt_strategy().read_token(
+            token, UserManager(CachedUserDatabase(session, User))
+        )
+    if user is None:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return user
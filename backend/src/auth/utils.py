@@ -1,10 +1,93 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
 from fastapi import Depends
+from fastapi_users.exceptions import UserNotExists
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession
 
+import config
 from auth.models import User
 from database import get_async_session
+from services.cache import TwoTierCache
+from services.logger import Logger
+
+logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger',
+                filename='auth.log').get_logger()
+
+# Columns kept in the cache; the password hash never leaves the database
+CACHED_COLUMNS = (
+    "id", "email", "username", "registered_at", "role_id",
+    "is_active", "is_superuser", "is_verified",
+)
+
+
+class UserCache(TwoTierCache):
+    """
+    Users by id, in the in-process LRU first and then in Redis (when configured).
+    """
+    prefix = "navi:user:"
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await super().get(str(user_id))
+
+    async def set(self, user: User) -> None:
+        data = {column: getattr(user, column) for column in CACHED_COLUMNS}
+        if data["registered_at"] is not None:
+            data["registered_at"] = data["registered_at"].isoformat()
+        await super().set(str(user.id), data)
+
+    async def delete(self, user_id: int) -> None:
+        await super().delete(str(user_id))
+
+
+user_cache = UserCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+
+
+class CachedUserDatabase(SQLAlchemyUserDatabase):
+    """
+    User database that resolves users by id through ``user_cache``.
+
+    Users served from the cache are detached copies without the password
+    hash, so updates and deletes reload the row before changing it and
+    then drop the cached entry.
+    """
+
+    async def get(self, id: int) -> Optional[User]:
+        data = await user_cache.get(id)
+        if data is not None:
+            registered_at = data["registered_at"]
+            if registered_at is not None:
+                registered_at = datetime.fromisoformat(registered_at)
+            return User(**{**data, "registered_at": registered_at})
+        user = await super().get(id)
+        if user is not None:
+            await user_cache.set(user)
+        return user
+
+    async def update(self, user: User, update_dict: Dict[str, Any]) -> User:
+        user_id = user.id
+        user = await super().get(user_id)
+        if user is None:
+            await user_cache.delete(user_id)
+            raise UserNotExists()
+        try:
+            return await super().update(user, update_dict)
+        finally:
+            await user_cache.delete(user_id)
+
+    async def delete(self, user: User) -> None:
+        user_id = user.id
+        user = await super().get(user_id)
+        if user is None:
+            await user_cache.delete(user_id)
+            raise UserNotExists()
+        try:
+            await super().delete(user)
+        finally:
+            await user_cache.delete(user_id)
 
 
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
-    yield SQLAlchemyUserDatabase(session, User)
+    yield CachedUserDatabase(session, User)
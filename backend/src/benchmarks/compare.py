@@ -0,0 +1,37 @@
+"""
+Compare two benchmark reports.
+
+    python -m benchmarks.compare before.json after.json --max-regression 0.1
+
+Prints the relative changes as JSON and exits with 1 when a p95 latency
+grew, or the total throughput dropped, by more than --max-regression.
+"""
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from benchmarks.report import compare
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--max-regression", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.base) as base, open(args.new) as new:
+        changes = compare(json.load(base), json.load(new))
+    sys.stdout.write(json.dumps(changes, indent=2) + "\n")
+
+    if args.max_regression is None:
+        return 0
+    regressed = changes["total"]["throughput_rps"] < -args.max_regression or any(
+        change["p95_ms"] > args.max_regression for change in changes.values()
+    )
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import math
+from typing import Dict, List, Optional, Sequence
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of ``values``, 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(
+        latencies: Dict[str, List[float]],
+        errors: Dict[str, int],
+        elapsed: float,
+        limited: Optional[Dict[str, int]] = None,
+) -> dict:
+    """
+    Throughput and latency percentiles, in milliseconds, of every endpoint
+    and of all of them together, from the latencies in seconds measured
+    during ``elapsed`` seconds. ``limited`` counts the answers 429.
+    """
+    limited = limited or {}
+
+    def stats(values: List[float], failed: int, rate_limited: int) -> dict:
+        entry = {
+            "requests": len(values),
+            "errors": failed,
+            "rate_limited": rate_limited,
+            "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "max_ms": round(max(values, default=0.0) * 1000, 3),
+        }
+        for q in PERCENTILES:
+            entry[f"p{q}_ms"] = round(percentile(values, q) * 1000, 3)
+        return entry
+
+    every = [value for values in latencies.values() for value in values]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "total": stats(every, sum(errors.values()), sum(limited.values())),
+        "endpoints": {
+            name: stats(values, errors.get(name, 0), limited.get(name, 0))
+            for name, values in sorted(latencies.items())
+        },
+    }
+
+
+def compare(base: dict, new: dict) -> dict:
+    """
+    Relative change of the throughput and percentiles of every endpoint of
+    two reports, e.g. 0.1 for 10% more; positive latency changes are slower.
+    """
+    def change(before: float, after: float) -> float:
+        return round((after - before) / before, 4) if before else 0.0
+
+    keys = ["throughput_rps"] + [f"p{q}_ms" for q in PERCENTILES]
+    endpoints = {"total": (base["total"], new["total"])}
+    for name, entry in new["endpoints"].items():
+        if name in base["endpoints"]:
+            endpoints[name] = (base["endpoints"][name], entry)
+    return {
+        name: {key: change(before[key], after[key]) for key in keys}
+        for name, (before, after) in endpoints.items()
+    }
@@ -0,0 +1,271 @@
+"""
+Load test of the API on a seeded dataset.
+
+    python -m benchmarks.run --posts 500 --comments 30 --requests 5000 \
+        --concurrency 50 --llm-latency-ms 300 --output before.json
+
+By default the app runs in this process on a SQLite file, with the
+moderation backend replaced by the stub. With --database-url pointing to a
+migrated PostgreSQL database the same runs go against PostgreSQL. With
+--base-url the requests go to a running server seeded through
+--database-url instead; start it with MODERATION_BACKEND=stub to keep the
+LLM out of the measurements, and without RATE_LIMITS, since answers 429 are
+reported apart from the errors.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from httpx import AsyncClient, TransportError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+import config
+from benchmarks.report import summarize
+from benchmarks.seed import WORDS, Dataset, seed, sentence
+from database import create_engine, get_async_session, get_async_session_maker, metadata
+from main import app
+from services.moderation import moderator
+from services.moderation_backends import StubBackend
+
+Request = Tuple[str, str, dict]
+
+
+@dataclass
+class Endpoint:
+    """A route of the API, how often it is called and how to build a call."""
+    name: str
+    weight: int
+    build: Callable[[random.Random, Dataset], Request]
+    write: bool = False
+
+
+ENDPOINTS = [
+    Endpoint("GET /auth/users/me", 2, lambda rng, data: (
+        "GET", "/auth/users/me", {})),
+    Endpoint("GET /posts/all_friendly", 6, lambda rng, data: (
+        "GET", "/posts/all_friendly", {"params": {"limit": 20}})),
+    Endpoint("GET /posts/user_friendly", 3, lambda rng, data: (
+        "GET", "/posts/user_friendly", {"params": {"limit": 20}})),
+    Endpoint("GET /posts/{post_id}", 10, lambda rng, data: (
+        "GET", f"/posts/{rng.choice(data.post_ids)}", {})),
+    Endpoint("GET /comments/all_friendly", 4, lambda rng, data: (
+        "GET", "/comments/all_friendly", {"params": {"limit": 20}})),
+    Endpoint("GET /comments/{post_id}", 10, lambda rng, data: (
+        "GET", f"/comments/{rng.choice(data.post_ids)}", {})),
+    Endpoint("GET /comments/{post_id}/thread", 8, lambda rng, data: (
+        "GET", f"/comments/{rng.choice(data.post_ids)}/thread", {})),
+    Endpoint("GET /comments/{comment_id}/status", 3, lambda rng, data: (
+        "GET", f"/comments/{rng.choice(data.comment_ids)}/status", {})),
+    Endpoint("GET /search/posts", 4, lambda rng, data: (
+        "GET", "/search/posts", {"params": {"q": rng.choice(WORDS)}})),
+    Endpoint("GET /search/comments", 4, lambda rng, data: (
+        "GET", "/search/comments",
+        {"params": {"q": " ".join(rng.sample(WORDS, 2))}})),
+    Endpoint("GET /management/analysis", 1, lambda rng, data: (
+        "GET", "/management/analysis", {"params": {
+            "date_from": (date.today() - timedelta(days=30)).isoformat(),
+            "date_to": date.today().isoformat(),
+        }})),
+    Endpoint("GET /management/user_activity", 1, lambda rng, data: (
+        "GET", "/management/user_activity",
+        {"params": {"user_id": rng.choice(data.user_ids)}})),
+    Endpoint("POST /posts/", 2, lambda rng, data: (
+        "POST", "/posts/", {"json": {
+            "title": sentence(rng, 3), "content": sentence(rng, 12),
+        }}), write=True),
+    Endpoint("POST /comments/", 5, lambda rng, data: (
+        "POST", "/comments/", {"json": {
+            "content": sentence(rng, 8), "post_id": rng.choice(data.post_ids),
+        }}), write=True),
+    Endpoint("POST /comments/reply", 3, lambda rng, data: (
+        "POST", "/comments/reply", {"json": {
+            "content": sentence(rng, 6), "parent_id": rng.choice(data.comment_ids),
+        }}), write=True),
+]
+
+
+def plan(
+        dataset: Dataset,
+        requests: int,
+        read_only: bool,
+        rng: random.Random,
+) -> List[Tuple[Endpoint, int, Request]]:
+    """The calls to make, with the index of the user making each of them."""
+    endpoints = [e for e in ENDPOINTS if not (read_only and e.write)]
+    weights = [e.weight for e in endpoints]
+    calls = []
+    for endpoint in rng.choices(endpoints, weights, k=requests):
+        calls.append((endpoint, rng.randrange(len(dataset.emails)),
+                      endpoint.build(rng, dataset)))
+    return calls
+
+
+def failed(response) -> bool:
+    """Errors are also reported as {"status": 500} bodies with a 200 status."""
+    if response.status_code >= 400:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    status = body.get("status") if isinstance(body, dict) else None
+    return isinstance(status, int) and status >= 400
+
+
+async def login(client: AsyncClient, dataset: Dataset) -> List[Dict[str, str]]:
+    headers = []
+    for email in dataset.emails:
+        response = await client.post("/auth/login", data={
+            "username": email, "password": dataset.password,
+        })
+        response.raise_for_status()
+        headers.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+    return headers
+
+
+async def drive(
+        client: AsyncClient,
+        calls: List[Tuple[Endpoint, int, Request]],
+        headers: List[Dict[str, str]],
+        concurrency: int,
+) -> Tuple[Dict[str, List[float]], Counter, Counter, float]:
+    """
+    Make the calls with ``concurrency`` clients, timing every one of them.
+    Calls failing to connect count as errors, answers 429 as rate limited.
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    limited: Counter = Counter()
+    pending = iter(calls)
+
+    async def user():
+        for endpoint, user_index, (method, path, kwargs) in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    method, path, headers=headers[user_index], **kwargs
+                )
+            except TransportError:
+                errors[endpoint.name] += 1
+                continue
+            latencies[endpoint.name].append(time.perf_counter() - started)
+            if response.status_code == 429:
+                limited[endpoint.name] += 1
+            elif failed(response):
+                errors[endpoint.name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, errors, limited, time.perf_counter() - started
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    engine = create_engine("benchmark", args.database_url, **(
+        {"poolclass": NullPool} if args.database_url.startswith("sqlite") else {}
+    ))
+    session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    if engine.dialect.name == "sqlite":
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+
+    dataset = await seed(session_maker, args.users, args.posts, args.comments,
+                         args.depth, seed=args.seed)
+    rng = random.Random(args.seed)
+    warmup = plan(dataset, args.warmup, args.read_only, rng)
+    calls = plan(dataset, args.requests, args.read_only, rng)
+
+    if args.base_url:
+        client = AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        async def get_session():
+            async with session_maker() as session:
+                yield session
+
+        app.dependency_overrides[get_async_session] = get_session
+        app.dependency_overrides[get_async_session_maker] = lambda: session_maker
+        moderator.backend = StubBackend(args.llm_latency_ms / 1000)
+        config.MODERATION_ASYNC = False
+        if not args.rate_limits:
+            config.RATE_LIMITS = {}
+        client = AsyncClient(app=app, base_url="http://benchmark", timeout=60)
+
+    try:
+        async with client:
+            headers = await login(client, dataset)
+            await drive(client, warmup, headers, args.concurrency)
+            latencies, errors, limited, elapsed = await drive(
+                client, calls, headers, args.concurrency
+            )
+    finally:
+        await engine.dispose()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "database": engine.dialect.name,
+            "target": args.base_url or "in-process",
+            "settings": {
+                key: value for key, value in vars(args).items()
+                if key not in ("database_url", "output")
+            },
+        },
+        **summarize(latencies, errors, elapsed, limited),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///./benchmark.db",
+                        help="database to seed, and to serve in-process runs from")
+    parser.add_argument("--base-url", help="drive a running server instead")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--comments", type=int, default=20, help="per post")
+    parser.add_argument("--depth", type=int, default=4, help="of comment threads")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=int, default=300,
+                        help="latency of the stub moderation backend")
+    parser.add_argument("--read-only", action="store_true")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep the rate limits of the write endpoints")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON report path, stdout by default")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import random
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Sequence
+
+from fastapi_users.password import PasswordHelper
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
+
+from auth.models import role, user
+from comments.models import Comment
+from management.utils import count_comments, refresh_daily_stats
+from posts.models import Post
+
+PASSWORD = "benchmark-password-1!"
+CHUNK_SIZE = 1000
+
+# Vocabulary of the generated texts, so that search has something to find
+WORDS = (
+    "garden", "river", "coffee", "python", "database", "mountain", "music",
+    "travel", "cooking", "science", "history", "football", "weather", "design",
+    "startup", "library", "camera", "bicycle", "ocean", "planet",
+)
+TOXIC_TEXTS = ("What a shit post", "Fuck this", "You are a bitch")
+
+
+@dataclass
+class Dataset:
+    """Ids of the seeded rows, used to build the benchmark requests."""
+    emails: List[str] = field(default_factory=list)
+    user_ids: List[int] = field(default_factory=list)
+    post_ids: List[int] = field(default_factory=list)
+    comment_ids: List[int] = field(default_factory=list)
+    password: str = PASSWORD
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+async def _insert(session, table, rows: Sequence[dict]) -> List[int]:
+    """Insert ``rows`` in chunks and return their ids in order."""
+    ids = []
+    for start in range(0, len(rows), CHUNK_SIZE):
+        result = await session.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True),
+            rows[start:start + CHUNK_SIZE],
+        )
+        ids.extend(result.scalars())
+    return ids
+
+
+async def seed(
+        session_maker: sessionmaker,
+        users: int,
+        posts: int,
+        comments: int,
+        depth: int,
+        toxic_share: float = 0.1,
+        seed: int = 0,
+) -> Dataset:
+    """
+    Add ``users`` users, ``posts`` posts spread over them and ``comments``
+    comments per post nested up to ``depth`` levels, a ``toxic_share`` of
+    the posts and comments being unfriendly. The same ``seed`` always builds
+    the same texts and threads. The comment counters and the daily rollup
+    include the seeded comments, as if they had been created through the API.
+    """
+    rng = random.Random(seed)
+    started = datetime.utcnow().date()
+    dataset = Dataset()
+    hashed_password = PasswordHelper().hash(PASSWORD)
+
+    async with session_maker() as session:
+        role_id = (await session.execute(select(role.c.id).limit(1))).scalar()
+        if role_id is None:
+            role_id = (await session.execute(insert(role).values(
+                name="member", permissions=None
+            ).returning(role.c.id))).scalar()
+
+        # Emails differ between runs, so that a database can be seeded again
+        tag = uuid.uuid4().hex[:8]
+        dataset.emails = [f"bench-{tag}-{number}@example.com"
+                          for number in range(users)]
+        dataset.user_ids = await _insert(session, user, [
+            {"email": email, "username": email, "hashed_password": hashed_password,
+             "role_id": role_id, "is_active": True, "is_superuser": False,
+             "is_verified": True}
+            for email in dataset.emails
+        ])
+
+        def friendly() -> bool:
+            return rng.random() >= toxic_share
+
+        post_rows = []
+        for _ in range(posts):
+            is_friendly = friendly()
+            post_rows.append({
+                "title": sentence(rng, 3),
+                "content": sentence(rng, 12) if is_friendly
+                else rng.choice(TOXIC_TEXTS),
+                "user_id": rng.choice(dataset.user_ids),
+                "friendly": is_friendly,
+                "auto_answer": False,
+            })
+        dataset.post_ids = await _insert(session, Post, post_rows)
+
+        # Plan every thread first: a comment answers the post or an earlier
+        # comment of the same post that isn't at the maximum depth yet
+        levels: List[List[dict]] = [[] for _ in range(max(depth, 1))]
+        for post_id in dataset.post_ids:
+            planned = []
+            for _ in range(comments):
+                parents = [c for c in planned if c["level"] + 1 < depth]
+                parent = rng.choice(parents) if parents and rng.random() < 0.7 else None
+                is_friendly = friendly()
+                comment = {
+                    "level": parent["level"] + 1 if parent else 0,
+                    "parent": parent,
+                    "row": {
+                        "content": sentence(rng, 8) if is_friendly
+                        else rng.choice(TOXIC_TEXTS),
+                        "user_id": rng.choice(dataset.user_ids),
+                        "post_id": post_id,
+                        "friendly": is_friendly,
+                    },
+                }
+                planned.append(comment)
+                levels[comment["level"]].append(comment)
+
+        # Insert level by level, so that every parent has its id already
+        for level in levels:
+            for comment in level:
+                parent = comment["parent"]
+                comment["row"]["parent_id"] = parent["id"] if parent else None
+            ids = await _insert(session, Comment, [c["row"] for c in level])
+            for comment, comment_id in zip(level, ids):
+                comment["id"] = comment_id
+            dataset.comment_ids.extend(ids)
+
+        friendly, unfriendly = Counter(), Counter()
+        for level in levels:
+            for comment in level:
+                row = comment["row"]
+                (friendly if row["friendly"] else unfriendly)[row["user_id"]] += 1
+        for user_id in dataset.user_ids:
+            await count_comments(
+                session, user_id, friendly[user_id], unfriendly[user_id]
+            )
+        await refresh_daily_stats(session, started, datetime.utcnow().date())
+
+        await session.commit()
+    return dataset
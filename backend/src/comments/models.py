@@ -5,11 +5,12 @@ from sqlalchemy import (
     Table, Column,
     Integer, String,
     TIMESTAMP, ForeignKey,
-    Boolean,
+    Boolean, Index, true,
 )
 
 from auth.models import User
 from posts.models import Post
+from services.moderation import MODERATION_DONE, MODERATION_PENDING
 
 
 Comment = Table(
@@ -18,8 +19,48 @@ Comment = Table(
     Column('id', Integer, primary_key=True),
     Column('content', String, nullable=False),
     Column('created_at', TIMESTAMP, default=datetime.utcnow),
+    Column('updated_at', TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow),
     Column('user_id', ForeignKey(User.id)),
     Column('post_id', ForeignKey(Post.c.id)),
     Column('parent_id', ForeignKey('comment.id'), nullable=True),
     Column('friendly', Boolean, default=False, nullable=False),
+    Column('moderation_status', String, default=MODERATION_DONE, nullable=False),
+)
+
+# Comments are listed by id per post, per user or all friendly ones, threads
+# walk the replies of a parent, and exports and the rollup scan by creation
+# date. SQLite only uses a partial index whose predicate the query repeats as
+# written, hence `friendly = 1`.
+Index('ix_comment_friendly_id', Comment.c.id,
+      postgresql_where=Comment.c.friendly, sqlite_where=Comment.c.friendly == true())
+Index('ix_comment_user_id_id', Comment.c.user_id, Comment.c.id)
+Index('ix_comment_post_id_id_friendly', Comment.c.post_id, Comment.c.id,
+      postgresql_where=Comment.c.friendly, sqlite_where=Comment.c.friendly == true())
+Index('ix_comment_parent_id_id', Comment.c.parent_id, Comment.c.id)
+# Rows left pending by a lost moderation task, oldest change first
+Index('ix_comment_pending_updated_at', Comment.c.updated_at,
+      postgresql_where=Comment.c.moderation_status == MODERATION_PENDING,
+      sqlite_where=Comment.c.moderation_status == MODERATION_PENDING)
+Index('ix_comment_created_at', Comment.c.created_at, postgresql_include=[
+    'friendly', 'moderation_status', 'post_id', 'user_id',
+])
+
+
+AUTO_REPLY_SCHEDULED = "scheduled"
+AUTO_REPLY_RUNNING = "running"
+AUTO_REPLY_DONE = "done"
+AUTO_REPLY_FAILED = "failed"
+
+# One auto-reply per comment and post author, whatever the number of tasks
+AutoReply = Table(
+    'auto_reply',
+    metadata,
+    Column('comment_id', ForeignKey('comment.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('author_id', ForeignKey(User.id), primary_key=True),
+    Column('status', String, default=AUTO_REPLY_SCHEDULED, nullable=False),
+    Column('reply_id', Integer, nullable=True),
+    Column('attempts', Integer, default=0, nullable=False),
+    Column('created_at', TIMESTAMP, default=datetime.utcnow),
+    Column('updated_at', TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow),
 )
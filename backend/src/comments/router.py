@@ -1,7 +1,14 @@
-from fastapi import APIRouter, Depends
+import asyncio
+import json
+from datetime import date
+from typing import AsyncIterator, List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from auth.base_config import current_user
-from database import get_async_session
+from sqlalchemy.orm import sessionmaker
+from auth.base_config import current_streaming_user, current_user
+from database import get_async_session, get_async_session_maker
 from sqlalchemy import insert, select, update, delete
 from comments.schemas import (
     CommentCreateRequest,
@@ -9,13 +16,25 @@ from comments.schemas import (
     CommentUpdateRequest,
 )
 
-from comments.models import Comment
+from comments.models import AutoReply, Comment
 from posts.models import Post
+from comments.utils import (
+    bump_comments_version, comment_namespaces, comment_stream, comment_thread,
+    comments_version,
+)
 from auth.models import User
 
-from worker import reply_to_comment
-
-from services.openai import OpenAI
+from worker import enqueue_moderation, schedule_auto_replies
+
+import config
+from management.utils import count_comment_change, count_new_comments, counted_verdict
+from services.cache import response_cache
+from services.events import comment_events
+from services.moderation import moderator, MODERATION_DONE, MODERATION_PENDING
+from services.etag import conditional, make_etag
+from services.export import export_response
+from services.rate_limit import RateLimit
+from services.pagination import NEXT_CURSOR_HEADER, Page, encode_cursor, paginate
 from services.logger import Logger
 import logging
 
@@ -27,15 +46,16 @@ router = APIRouter()
 
 @router.get("/all", status_code=200)
 async def get_all_comments(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get all comments
+    Get all comments, page by page
     """
     try:
-        posts = await session.execute(select(Comment).order_by(Comment.c.id))
-        return posts.mappings().all()
+        return await paginate(session, select(Comment), Comment.c.id, page, response)
     except Exception as e:
         logger.error(f"Error getting all comments: {e}")
         return {"status": 500, "description": f"{e}"}
@@ -43,17 +63,20 @@ async def get_all_comments(
 
 @router.get("/all_friendly", status_code=200)
 async def get_all_friendly_comments(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get all friendly comments
+    Get all friendly comments, page by page
     """
     try:
-        posts = await session.execute(select(Comment).where(
+        stmt = select(Comment).where(
             Comment.c.friendly
-        ).order_by(Comment.c.id))
-        return posts.mappings().all()
+        )
+        return await paginate(session, stmt, Comment.c.id, page, response,
+                              cache_as=("comments", "all_friendly"))
     except Exception as e:
         logger.error(f"Error getting all comments: {e}")
         return {"status": 500, "description": f"{e}"}
@@ -61,62 +84,205 @@ async def get_all_friendly_comments(
 
 @router.get("/user", status_code=200)
 async def get_user_comments(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get comments created by the user
+    Get comments created by the user, page by page
     """
     try:
-        posts = await session.execute(select(Comment).where(
+        stmt = select(Comment).where(
             Comment.c.user_id == user.id
-        ).order_by(Comment.c.id))
-        return posts.mappings().all()
+        )
+        return await paginate(session, stmt, Comment.c.id, page, response)
     except Exception as e:
         return {"status": 500, "description": f"{e}"}
 
 
 @router.get("/user_friendly", status_code=200)
 async def get_user_friendly_comments(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get all friendly comments created by the user
+    Get all friendly comments created by the user, page by page
     """
     try:
-        posts = await session.execute(select(Comment).where(
-            Post.c.user_id == user.id
+        stmt = select(Comment).where(
+            Comment.c.user_id == user.id
         ).where(
             Comment.c.friendly
-        ).order_by(Comment.c.id))
-        return posts.mappings().all()
+        )
+        return await paginate(session, stmt, Comment.c.id, page, response,
+                              cache_as=(f"comments:user:{user.id}", "user_friendly"))
     except Exception as e:
         return {"status": 500, "description": f"{e}"}
 
 
+@router.get("/export", status_code=200)
+async def export_comments(
+        format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson or csv"),
+        date_from: Optional[date] = Query(None, description="Start date, YYYY-MM-DD"),
+        date_to: Optional[date] = Query(None, description="End date, YYYY-MM-DD"),
+        friendly: Optional[bool] = Query(None, description="Friendly or not"),
+        user: User = Depends(current_user),
+        session_maker: sessionmaker = Depends(get_async_session_maker),
+):
+    """
+    Stream comments created between two dates as NDJSON or CSV
+    """
+    return export_response(session_maker, Comment, format, date_from, date_to, friendly)
+
+
 @router.get("/{post_id}", status_code=200)
 async def get_post_comments(
         post_id: int,
+        request: Request,
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get all comments related to a post
+    Get all comments related to a post, page by page.
+    Answers 304 when If-None-Match holds the ETag of the unchanged page
     """
     try:
-        post = await session.execute(select(Comment).where(
-            Post.c.id == post_id
+        version = await comments_version(session, post_id)
+        etag = make_etag("comments", post_id, version, page.key)
+        not_modified = conditional(request, response, etag)
+        if not_modified is not None:
+            return not_modified
+        stmt = select(Comment).where(
+            Comment.c.post_id == post_id
         ).where(
             Comment.c.friendly
-        ).order_by(Comment.c.id))
-        return post.mappings().all()
+        )
+        return await paginate(session, stmt, Comment.c.id, page, response,
+                              cache_as=(f"comments:post:{post_id}", f"{version}"))
     except Exception as e:
         logger.error(f"Error getting post by id: {e}")
         return {"status": 500, "description": f"{e}"}
 
 
-@router.post("/", status_code=201)
+@router.get("/{post_id}/thread", status_code=200)
+async def get_post_comment_thread(
+        post_id: int,
+        request: Request,
+        response: Response,
+        parent_id: Optional[int] = Query(
+            None, description="Return the replies to this comment instead of the roots"
+        ),
+        max_depth: int = Query(3, ge=1, le=config.THREAD_MAX_DEPTH,
+                               description="Number of reply levels"),
+        replies: int = Query(10, ge=1, le=config.PAGE_SIZE_MAX,
+                             description="Replies per comment below the top level"),
+        page: Page = Depends(),
+        user: User = Depends(current_user),
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get the friendly comments of a post as a nested thread, top level page by page.
+    Comments with "has_more_replies" set continue with their id as parent_id.
+    Answers 304 when If-None-Match holds the ETag of the unchanged thread
+    """
+    async def load():
+        tree, next_after = await comment_thread(
+            session, post_id, parent_id, page.after, page.limit, replies, max_depth
+        )
+        return {"tree": tree, "next": next_after}
+
+    try:
+        version = await comments_version(session, post_id)
+        etag = make_etag(
+            "thread", post_id, version, parent_id, max_depth, replies, page.key
+        )
+        not_modified = conditional(request, response, etag)
+        if not_modified is not None:
+            return not_modified
+        thread = await response_cache.get_or_load(
+            f"comments:post:{post_id}",
+            f"thread:{version}:{parent_id}:{max_depth}:{replies}:{page.key}",
+            load,
+        )
+        if thread["next"] is not None:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(thread["next"])
+        return thread["tree"]
+    except Exception as e:
+        logger.error(f"Error getting comment thread: {e}")
+        return {"status": 500, "description": f"{e}"}
+
+
+@router.get("/{post_id}/stream", status_code=200)
+async def stream_post_comments(
+        post_id: int,
+        request: Request,
+        last_event_id: Optional[int] = Header(
+            None, description="Id of the last comment received before reconnecting"
+        ),
+        user: User = Depends(current_streaming_user),
+        session_maker: sessionmaker = Depends(get_async_session_maker),
+):
+    """
+    Stream new friendly comments of a post as server-sent events, instead of
+    polling the comments of the post. Reconnecting with Last-Event-ID sends
+    the comments missed meanwhile first
+    """
+    return StreamingResponse(
+        comment_stream(session_maker, post_id, last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{comment_id}/status", status_code=200)
+async def get_comment_moderation_status(
+        comment_id: int,
+        user: User = Depends(current_user),
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get moderation status of a comment: pending, done or failed
+    """
+    try:
+        comment = await session.execute(select(
+            Comment.c.id, Comment.c.moderation_status, Comment.c.friendly
+        ).where(
+            Comment.c.id == comment_id
+        ))
+        return {"status": 200, "description": "Success",
+                "data": comment.mappings().one()}
+    except Exception as e:
+        logger.error(f"Error getting comment moderation status: {e}")
+        return {"status": 500, "description": f"{e}"}
+
+
+@router.get("/{comment_id}/auto_reply", status_code=200)
+async def get_comment_auto_reply(
+        comment_id: int,
+        user: User = Depends(current_user),
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get the auto-reply to a comment: scheduled, running, done or failed
+    """
+    try:
+        auto_reply = await session.execute(select(AutoReply).where(
+            AutoReply.c.comment_id == comment_id
+        ))
+        return {"status": 200, "description": "Success",
+                "data": auto_reply.mappings().all()}
+    except Exception as e:
+        logger.error(f"Error getting comment auto-reply: {e}")
+        return {"status": 500, "description": f"{e}"}
+
+
+@router.post("/", status_code=201,
+             dependencies=[Depends(RateLimit("comments:create"))])
 async def create_comment(
         request: CommentCreateRequest,
         user: User = Depends(current_user),
@@ -126,41 +292,44 @@ async def create_comment(
     Create comment for a post
     """
     try:
-        ai = OpenAI()
-        result = await ai.check_text(text=request.content)
+        pending = config.MODERATION_ASYNC
+        result = False if pending else await moderator.check_text(text=request.content)
         logger.info(f"Creating comment for user_id: {user.id}")
         comment = await session.execute(insert(Comment).values(
             content=request.content,
             user_id=user.id,
             post_id=request.post_id,
-            friendly=result
-        ).returning(Comment.c.id))
-        comment_id = comment.scalar()
+            friendly=result,
+            moderation_status=MODERATION_PENDING if pending else MODERATION_DONE,
+        ).returning(*Comment.c))
+        comment = comment.fetchone()
+        comment_id = comment.id
+        await count_comment_change(session, comment, None, None if pending else result)
+        if result:
+            await bump_comments_version(session, [comment.post_id])
 
         await session.commit()
+        if result:
+            await response_cache.invalidate(*comment_namespaces([comment]))
 
         logger.info(
             f"Comment created for post id: {request.post_id} by user: {user.username}"
         )
 
-        post_result = await session.execute(select(Post).where(
-            Post.c.id == request.post_id
-        ))
-        post = post_result.fetchone()
-
+        if pending:
+            await session.close()
+            await enqueue_moderation("comment", comment_id, auto_reply=True)
+            return {
+                "status": 201,
+                "description": "Comment was created and is awaiting moderation",
+                "id": comment_id,
+            }
+
+        if result:
+            await comment_events.publish([comment])
+            await schedule_auto_replies(session, [comment])
         await session.close()
 
-        if post.auto_answer and result:
-            reply_to_comment.apply_async(
-                (
-                    comment_id,
-                    request.post_id,
-                    post.user_id,
-                    post.content,
-                    request.content
-                ),
-                countdown=post.delay_answer)
-
         return {
             "status": 201,
             "description": "Comment created successfully" if result
@@ -173,7 +342,201 @@ async def create_comment(
         return {"status": 500, "description": f"{e}"}
 
 
-@router.post("/reply", status_code=201)
+async def _read_bulk_items(request: Request) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Yield the numbered items of a JSON array body, or of an NDJSON body line
+    by line as it arrives. Lines that are not valid JSON are yielded as None.
+    """
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        index, buffer = 0, b""
+        async for data in request.stream():
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, _parse_line(line)
+                    index += 1
+        if buffer.strip():
+            yield index, _parse_line(buffer)
+        return
+
+    items = await request.json()
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of comments")
+    if len(items) > config.BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {config.BULK_MAX_ITEMS} comments per request",
+        )
+    for index, item in enumerate(items):
+        yield index, item
+
+
+def _parse_line(line: bytes) -> object:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+async def _moderate_bulk(texts: List[str]) -> List[bool]:
+    """Moderate texts in LLM batches, a bounded number of them at a time."""
+    semaphore = asyncio.Semaphore(config.BULK_MODERATION_CONCURRENCY)
+    size = max(config.MODERATION_BATCH_SIZE, 1)
+
+    async def check(batch):
+        async with semaphore:
+            return await moderator.check_texts(batch)
+
+    batches = await asyncio.gather(
+        *(check(texts[i:i + size]) for i in range(0, len(texts), size))
+    )
+    return [verdict for batch in batches for verdict in batch]
+
+
+async def _create_comment_chunk(
+        session: AsyncSession,
+        user: User,
+        chunk: List[Tuple[int, object]],
+) -> List[dict]:
+    """Validate, moderate and insert a chunk of bulk items in one statement."""
+    results, valid = {}, []
+    for index, item in chunk:
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "status": 422,
+                              "description": "Expected a JSON object"}
+            continue
+        try:
+            valid.append((index, CommentCreateRequest(**item)))
+        except ValueError as e:
+            results[index] = {"index": index, "status": 422, "description": f"{e}"}
+
+    posts = await session.execute(select(Post.c.id).where(
+        Post.c.id.in_({comment.post_id for _, comment in valid})
+    ))
+    posts = set(posts.scalars())
+    for index, comment in valid:
+        if comment.post_id not in posts:
+            results[index] = {"index": index, "status": 404,
+                              "description": "Post not found"}
+    valid = [(index, comment) for index, comment in valid if index not in results]
+
+    if valid:
+        pending = config.MODERATION_ASYNC
+        if pending:
+            verdicts = [False] * len(valid)
+        else:
+            verdicts = await _moderate_bulk([comment.content for _, comment in valid])
+        created = await session.execute(insert(Comment).returning(
+            *Comment.c, sort_by_parameter_order=True,
+        ), [
+            {
+                "content": comment.content,
+                "user_id": user.id,
+                "post_id": comment.post_id,
+                "friendly": friendly,
+                "moderation_status": MODERATION_PENDING if pending else MODERATION_DONE,
+            }
+            for (_, comment), friendly in zip(valid, verdicts)
+        ])
+        created = created.fetchall()
+        if not pending:
+            await count_new_comments(session, user.id, created)
+            await bump_comments_version(
+                session, [row.post_id for row in created if row.friendly]
+            )
+        await session.commit()
+        await response_cache.invalidate(
+            *comment_namespaces([row for row in created if row.friendly])
+        )
+
+        if pending:
+            await enqueue_moderation(
+                "comment", *(row.id for row in created), auto_reply=True
+            )
+        else:
+            await comment_events.publish([r for r in created if r.friendly])
+            await schedule_auto_replies(session, [r for r in created if r.friendly])
+
+        for (index, _), row in zip(valid, created):
+            results[index] = {
+                "index": index,
+                "status": 201,
+                "id": row.id,
+                "friendly": None if pending else row.friendly,
+            }
+    return [results[index] for index in sorted(results)]
+
+
+bulk_limit = RateLimit("comments:bulk")
+
+
+@router.post("/bulk", status_code=201)
+async def create_comments_bulk(
+        request: Request,
+        user: User = Depends(current_user),
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Create many comments at once from a JSON array or an NDJSON stream
+    (Content-Type: application/x-ndjson) of {"content", "post_id"} objects.
+    Every item counts against the comments:bulk rate limit; once it is
+    exceeded, or past BULK_MAX_ITEMS, the remaining items are not created.
+    Returns a result per item, in the order of the items
+    """
+    results, limited = [], None
+
+    async def create_chunk(chunk):
+        nonlocal limited
+        if limited is None:
+            try:
+                await bulk_limit.take(user, len(chunk))
+                return await _create_comment_chunk(session, user, chunk)
+            except HTTPException as e:
+                if e.status_code != 429 or not results:
+                    raise
+                limited = e
+        return [{"index": index, "status": 429, "description": limited.detail}
+                for index, _ in chunk]
+
+    # A chunk costing more than the burst of the limit would never be allowed
+    chunk_size = min(config.BULK_CHUNK_SIZE, bulk_limit.burst or config.BULK_CHUNK_SIZE)
+    try:
+        chunk, dropped = [], None
+        async for index, item in _read_bulk_items(request):
+            if index >= config.BULK_MAX_ITEMS:
+                dropped = index
+                break
+            chunk.append((index, item))
+            if len(chunk) >= chunk_size:
+                results += await create_chunk(chunk)
+                chunk = []
+        if chunk:
+            results += await create_chunk(chunk)
+        if dropped is not None:
+            results.append({
+                "index": dropped,
+                "status": 413,
+                "description": f"At most {config.BULK_MAX_ITEMS} comments per request",
+            })
+    except HTTPException:
+        raise
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Error creating comments in bulk: {e}")
+        return {"status": 500, "description": f"{e}", "data": results}
+
+    created = sum(result["status"] == 201 for result in results)
+    logger.info(f"{created} comments created in bulk by user: {user.username}")
+    return {
+        "status": 201,
+        "description": f"{created} of {len(results)} comments created",
+        "data": results,
+    }
+
+
+@router.post("/reply", status_code=201,
+             dependencies=[Depends(RateLimit("comments:reply"))])
 async def reply_comment(
         request: CommentReplyRequest,
         user: User = Depends(current_user),
@@ -183,23 +546,39 @@ async def reply_comment(
     Reply comment for a comment
     """
     try:
-        ai = OpenAI()
-        result = await ai.check_text(request.content)
+        pending = config.MODERATION_ASYNC
+        result = False if pending else await moderator.check_text(request.content)
         parent_comment = await session.execute(select(Comment).where(
             Comment.c.id == request.parent_id
         ))
         parent = parent_comment.fetchone()
 
-        await session.execute(insert(Comment).values(
+        comment = await session.execute(insert(Comment).values(
             content=request.content,
             user_id=user.id,
             parent_id=request.parent_id,
             post_id=parent.post_id,
-            friendly=result
-        ))
+            friendly=result,
+            moderation_status=MODERATION_PENDING if pending else MODERATION_DONE,
+        ).returning(*Comment.c))
+        comment = comment.fetchone()
+        comment_id = comment.id
+        await count_comment_change(session, comment, None, None if pending else result)
+        if result:
+            await bump_comments_version(session, [comment.post_id])
         await session.commit()
         await session.close()
+        if result:
+            await response_cache.invalidate(*comment_namespaces([comment]))
+            await comment_events.publish([comment])
         logger.info(f"Reply to comment created by user: {user.username}")
+        if pending:
+            await enqueue_moderation("comment", comment_id)
+            return {
+                "status": 201,
+                "description": "Reply was created and is awaiting moderation",
+                "id": comment_id,
+            }
         return {
             "status": 201,
             "description": "Reply created successfully" if result
@@ -212,7 +591,8 @@ async def reply_comment(
         return {"status": 500, "description": f"{e}"}
 
 
-@router.patch("/{comment_id}", status_code=200)
+@router.patch("/{comment_id}", status_code=200,
+              dependencies=[Depends(RateLimit("comments:update"))])
 async def update_comment(
         comment_id: int,
         request: CommentUpdateRequest,
@@ -223,14 +603,39 @@ async def update_comment(
     Update comment
     """
     try:
-        ai = OpenAI()
-        result = await ai.check_text(request.content)
+        pending = config.MODERATION_ASYNC
+        result = False if pending else await moderator.check_text(request.content)
+        current = await session.execute(select(
+            Comment.c.user_id, Comment.c.post_id, Comment.c.created_at,
+            Comment.c.friendly, Comment.c.moderation_status,
+        ).where(Comment.c.id == comment_id).with_for_update())
+        before = current.fetchone()
+        changed = before is not None and bool(before.friendly or result)
         await session.execute(update(Comment).where(Comment.c.id == comment_id).values(
             content=request.content,
-            friendly=result
+            friendly=result,
+            moderation_status=MODERATION_PENDING if pending else MODERATION_DONE,
         ))
+        if before is not None:
+            await count_comment_change(
+                session,
+                before,
+                counted_verdict(before.friendly, before.moderation_status),
+                None if pending else result,
+            )
+            if changed:
+                await bump_comments_version(session, [before.post_id])
         await session.commit()
+        if changed:
+            await response_cache.invalidate(*comment_namespaces([before]))
         logger.info(f"Comment id: {comment_id} updated by user: {user.username}")
+        if pending:
+            await enqueue_moderation("comment", comment_id)
+            return {
+                "status": 200,
+                "description": "Comment was updated and is awaiting moderation",
+                "id": comment_id,
+            }
         return {
             "status": 200,
             "description": "Comment updated successfully" if result
@@ -252,10 +657,25 @@ async def delete_comment(
     Delete comment
     """
     try:
-        await session.execute(delete(Comment).where(
+        deleted = await session.execute(delete(Comment).where(
             Comment.c.id == comment_id
+        ).returning(
+            Comment.c.user_id, Comment.c.post_id, Comment.c.created_at,
+            Comment.c.friendly, Comment.c.moderation_status,
         ))
+        comment = deleted.fetchone()
+        if comment is not None:
+            await count_comment_change(
+                session,
+                comment,
+                counted_verdict(comment.friendly, comment.moderation_status),
+                None,
+            )
+            if comment.friendly:
+                await bump_comments_version(session, [comment.post_id])
         await session.commit()
+        if comment is not None and comment.friendly:
+            await response_cache.invalidate(*comment_namespaces([comment]))
         logger.info(f"Comment id: {comment_id} deleted by user: {user.username}")
         return {"status": 200, "description": "Comment deleted successfully"}
     except Exception as e:
@@ -1,9 +1,23 @@
+import asyncio
+from typing import (
+    AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple,
+)
+
 from fastapi import Depends
-from sqlalchemy import insert
+from sqlalchemy import (
+    BigInteger, case, cast, func, insert, literal_column, or_, select, update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 from database import get_async_session
 
-from comments.models import Comment
+import config
+
+from comments.models import AUTO_REPLY_DONE, AUTO_REPLY_RUNNING, AutoReply, Comment
+from management.utils import count_comment_change
+from posts.models import Post
+from services.cache import response_cache
+from services.events import comment_event, comment_events
 
 
 async def create_comment(
@@ -12,9 +26,11 @@ async def create_comment(
         author_id: int,
         answer: str,
         session: AsyncSession = Depends(get_async_session),
-) -> None:
+) -> Optional[int]:
     """
-    the function implements the creation of a comment in the database
+    the function implements the creation of an auto-reply comment in the database,
+    marking the running auto-reply as done in the same transaction. Nothing is
+    inserted and None is returned when the auto-reply was completed meanwhile
     """
     try:
         result = await session.execute(
@@ -24,11 +40,211 @@ async def create_comment(
                 post_id=post_id,
                 friendly=True,
                 parent_id=comment_id
-            ).returning(Comment.c.id)
+            ).returning(*Comment.c)
         )
-        new_comment_id = result.scalar()
+        new_comment = result.fetchone()
+        new_comment_id = new_comment.id
+        completed = await session.execute(update(AutoReply).where(
+            AutoReply.c.comment_id == comment_id
+        ).where(
+            AutoReply.c.author_id == author_id
+        ).where(
+            AutoReply.c.status == AUTO_REPLY_RUNNING
+        ).values(
+            status=AUTO_REPLY_DONE,
+            reply_id=new_comment_id,
+        ).returning(AutoReply.c.comment_id))
+        if completed.first() is None:
+            await session.rollback()
+            return None
+        await count_comment_change(session, new_comment, None, True)
+        await bump_comments_version(session, [post_id])
         await session.commit()
+        await response_cache.invalidate(*comment_namespaces([new_comment]))
+        await comment_events.publish([new_comment])
         return new_comment_id
     except Exception as e:
         await session.rollback()
         raise e
+
+
+def comment_namespaces(comments) -> List[str]:
+    """
+    Response cache namespaces of the lists holding the friendly ``comments``:
+    the list of all friendly comments and the lists of their authors. The
+    lists of a post are tagged with its comments_version instead.
+    """
+    authors = {f"comments:user:{comment.user_id}" for comment in comments}
+    return ["comments", *authors] if authors else []
+
+
+async def comments_version(session: AsyncSession, post_id: int) -> Optional[int]:
+    """Version of the friendly comments of a post, None for unknown posts."""
+    result = await session.execute(select(Post.c.comments_version).where(
+        Post.c.id == post_id
+    ))
+    return result.scalar()
+
+
+async def bump_comments_version(session: AsyncSession, post_ids: Iterable) -> None:
+    """
+    Mark the friendly comments of posts as changed, in the transaction of the
+    change itself. Reads of them are cached and tagged by this version instead
+    of being counted on every request. The post's own updated_at is kept.
+    """
+    post_ids = {post_id for post_id in post_ids if post_id is not None}
+    if not post_ids:
+        return
+    await session.execute(update(Post).where(Post.c.id.in_(post_ids)).values(
+        comments_version=Post.c.comments_version + 1,
+        updated_at=Post.c.updated_at,
+    ))
+
+
+async def comment_thread(
+        session: AsyncSession,
+        post_id: int,
+        parent_id: Optional[int],
+        after: Optional[int],
+        limit: int,
+        replies: int,
+        max_depth: int,
+) -> Tuple[List[Dict], Optional[int]]:
+    """
+    Fetch friendly comments of a post as a tree with one recursive query.
+
+    The top level holds the replies to ``parent_id`` (or the root comments)
+    after the ``after`` id, at most ``limit`` of them. Below it come at most
+    ``max_depth`` levels of replies, every comment keeping its first
+    ``replies`` replies; ``has_more_replies`` marks comments with replies
+    left out. Returns the tree and the id to continue the top level after,
+    if any.
+    """
+    columns = list(Comment.c)
+
+    def nth_reply(comment, offset):
+        """
+        Id of the reply of ``comment`` after ``offset`` others, read through
+        the (parent_id, id) index, so only replies of comments in the tree
+        are looked at.
+        """
+        reply = Comment.alias("reply")
+        return select(reply.c.id).where(
+            reply.c.parent_id == comment.c.id
+        ).where(
+            reply.c.friendly
+        ).order_by(reply.c.id).limit(1).offset(offset).scalar_subquery()
+
+    top = select(*columns, func.row_number().over(
+        order_by=Comment.c.id
+    ).label("rn")).where(
+        Comment.c.post_id == post_id
+    ).where(
+        Comment.c.friendly
+    ).where(
+        Comment.c.parent_id == parent_id if parent_id is not None
+        else Comment.c.parent_id.is_(None)
+    )
+    if after is not None:
+        top = top.where(Comment.c.id > after)
+    top = top.order_by(Comment.c.id).limit(limit + 1).subquery()
+
+    thread = select(
+        *top.c,
+        literal_column("0").label("depth"),
+        nth_reply(top, replies).label("more_after"),
+    ).cte("thread", recursive=True)
+    # more_after is the first reply left out of the tree: the one after the
+    # first `replies` ones, or the first one on the last level. The extra top
+    # level row only tells whether another page follows
+    thread = thread.union_all(select(
+        *columns,
+        cast(literal_column("0"), BigInteger).label("rn"),
+        (thread.c.depth + 1).label("depth"),
+        case(
+            (thread.c.depth + 1 >= max_depth, nth_reply(Comment, 0)),
+            else_=nth_reply(Comment, replies),
+        ).label("more_after"),
+    ).join(
+        thread, Comment.c.parent_id == thread.c.id
+    ).where(
+        Comment.c.friendly
+    ).where(
+        thread.c.depth < max_depth
+    ).where(
+        or_(thread.c.depth > 0, thread.c.rn <= limit)
+    ).where(
+        or_(thread.c.more_after.is_(None), Comment.c.id < thread.c.more_after)
+    ))
+
+    result = await session.execute(
+        select(thread).order_by(thread.c.depth, thread.c.id)
+    )
+
+    # Rows come level by level, so every parent is placed before its replies
+    nodes, tree, next_after = {}, [], None
+    for row in result.mappings():
+        if row["depth"] == 0:
+            if row["rn"] > limit:
+                next_after = tree[-1]["id"]
+                continue
+            siblings = tree
+        else:
+            parent = nodes.get(row["parent_id"])
+            if parent is None:
+                continue
+            siblings = parent["replies"]
+        node = {column.name: row[column.name] for column in columns}
+        node["replies"] = []
+        node["has_more_replies"] = row["more_after"] is not None
+        siblings.append(node)
+        nodes[node["id"]] = node
+    return tree, next_after
+
+
+def sse_event(comment_id: int, data: str) -> str:
+    return f"id: {comment_id}\nevent: comment\ndata: {data}\n\n"
+
+
+async def comment_stream(
+        session_maker: sessionmaker,
+        post_id: int,
+        last_event_id: Optional[int],
+        is_disconnected: Callable[[], Awaitable[bool]],
+) -> AsyncIterator[str]:
+    """
+    Server-sent events of the friendly comments of a post committed from now on.
+
+    With ``last_event_id`` set, the comments after it are sent first, up to
+    STREAM_REPLAY_LIMIT of them. The stream ends when the client disconnects
+    or falls too far behind, clients then reconnect with the id of the last
+    event they got.
+    """
+    async with comment_events.subscribe(post_id) as queue:
+        yield f"retry: {config.STREAM_RETRY_MS}\n\n"
+
+        replayed = set()
+        if last_event_id is not None:
+            async with session_maker() as session:
+                result = await session.execute(select(Comment).where(
+                    Comment.c.post_id == post_id
+                ).where(
+                    Comment.c.friendly
+                ).where(
+                    Comment.c.id > last_event_id
+                ).order_by(Comment.c.id).limit(config.STREAM_REPLAY_LIMIT))
+                for row in result.fetchall():
+                    replayed.add(row.id)
+                    yield sse_event(row.id, comment_event(row))
+
+        while not await is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), config.STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            comment_id, data = event
+            if comment_id not in replayed:
+                yield sse_event(comment_id, data)
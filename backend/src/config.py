@@ -7,9 +7,113 @@ dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
+
+def _parse_rate_limits(value: str) -> dict:
+    """Parse "scope=requests/seconds,..." into {scope: (requests, seconds)}."""
+    limits = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        scope, limit = item.split("=")
+        requests, seconds = limit.split("/")
+        limits[scope.strip()] = (int(requests), int(seconds))
+    return limits
+
+
 SECRET_AUTH = os.environ.get("SECRET_AUTH")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1")
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 10))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", 20))
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+PAGE_SIZE_DEFAULT = int(os.environ.get("PAGE_SIZE_DEFAULT", 100))
+PAGE_SIZE_MAX = int(os.environ.get("PAGE_SIZE_MAX", 1000))
+
+# Deepest reply level returned by the comment thread endpoint
+THREAD_MAX_DEPTH = int(os.environ.get("THREAD_MAX_DEPTH", 10))
+
+# Bulk comment import inserts N comments per statement and moderates them with
+# at most BULK_MODERATION_CONCURRENCY LLM batches in flight per request; a
+# request holds at most BULK_MAX_ITEMS comments
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", 500))
+BULK_MODERATION_CONCURRENCY = int(os.environ.get("BULK_MODERATION_CONCURRENCY", 4))
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 5000))
+
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 1000))
+
+# Seconds between refreshes of the daily comment rollup and the days it rebuilds
+ROLLUP_INTERVAL = int(os.environ.get("ROLLUP_INTERVAL", 300))
+ROLLUP_LOOKBACK_DAYS = int(os.environ.get("ROLLUP_LOOKBACK_DAYS", 2))
+
+# Seconds after which a running auto-reply, e.g. of a crashed worker, is taken over
+AUTO_REPLY_STALE_AFTER = int(os.environ.get("AUTO_REPLY_STALE_AFTER", 300))
 
+# Token buckets of the write endpoints per user, "scope=requests/seconds,...";
+# a user may burst up to `requests` and gets them back over `seconds`.
+# comments:bulk counts the items of bulk requests
+RATE_LIMITS = _parse_rate_limits(os.environ.get(
+    "RATE_LIMITS",
+    "comments:create=30/60,comments:reply=30/60,comments:update=30/60,"
+    "comments:bulk=1000/3600,posts:create=10/60,posts:update=20/60",
+))
+RATE_LIMIT_EXEMPT_SUPERUSERS = (
+    os.environ.get("RATE_LIMIT_EXEMPT_SUPERUSERS", "true").lower() == "true"
+)
+
+# Users resolved from JWTs are cached for a short while, so deactivating a user
+# reaches the other processes within USER_CACHE_TTL seconds
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 60))
+
+# Read-through cache of post and comment reads, kept in Redis when configured
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1000))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+
+# Server-sent event streams of new comments: events buffered per client,
+# seconds between keep-alive comments, comments replayed on reconnection and
+# the reconnection delay suggested to clients
+STREAM_QUEUE_SIZE = int(os.environ.get("STREAM_QUEUE_SIZE", 100))
+STREAM_KEEPALIVE = float(os.environ.get("STREAM_KEEPALIVE", 15))
+STREAM_REPLAY_LIMIT = int(os.environ.get("STREAM_REPLAY_LIMIT", 100))
+STREAM_RETRY_MS = int(os.environ.get("STREAM_RETRY_MS", 3000))
+# Seconds a new stream waits for the Redis subscription to be confirmed
+STREAM_SUBSCRIBE_TIMEOUT = float(os.environ.get("STREAM_SUBSCRIBE_TIMEOUT", 5))
+
+# Local pre-filter deciding obvious texts without the LLM; PREFILTER_WORDLIST
+# points to extra blocked words, one per line
+PREFILTER_ENABLED = os.environ.get("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_WORDLIST = os.environ.get("PREFILTER_WORDLIST")
+PREFILTER_MAX_LINKS = int(os.environ.get("PREFILTER_MAX_LINKS", 3))
+
+# Moderation classifier: "openai", "local" (a joblib model at
+# MODERATION_MODEL_PATH) or "stub"; MODERATION_FALLBACK serves the calls the
+# main backend fails
+MODERATION_BACKEND = os.environ.get("MODERATION_BACKEND", "openai")
+MODERATION_FALLBACK = os.environ.get("MODERATION_FALLBACK", "")
+MODERATION_MODEL_PATH = os.environ.get("MODERATION_MODEL_PATH")
+MODERATION_STUB_LATENCY_MS = int(os.environ.get("MODERATION_STUB_LATENCY_MS", 0))
+
+MODERATION_CACHE_SIZE = int(os.environ.get("MODERATION_CACHE_SIZE", 10000))
+MODERATION_CACHE_TTL = int(os.environ.get("MODERATION_CACHE_TTL", 24 * 60 * 60))
+# Persist posts and comments as pending and classify them in the Celery worker
+MODERATION_ASYNC = os.environ.get("MODERATION_ASYNC", "false").lower() == "true"
+# Background moderation classifies up to N texts per LLM call, waiting at most T ms
+MODERATION_BATCH_SIZE = int(os.environ.get("MODERATION_BATCH_SIZE", 20))
+MODERATION_BATCH_WINDOW_MS = int(os.environ.get("MODERATION_BATCH_WINDOW_MS", 500))
+# Rows still pending N seconds after their last change are queued again, up to
+# MODERATION_REQUEUE_LIMIT of each table every MODERATION_REQUEUE_INTERVAL seconds
+MODERATION_REQUEUE_AFTER = int(os.environ.get("MODERATION_REQUEUE_AFTER", 300))
+MODERATION_REQUEUE_INTERVAL = int(os.environ.get("MODERATION_REQUEUE_INTERVAL", 60))
+MODERATION_REQUEUE_LIMIT = int(os.environ.get("MODERATION_REQUEUE_LIMIT", 1000))
+
+
+# Log records are written as JSON lines, or "text" for the former format
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+# Directory shared by the API and worker processes to aggregate their metrics
+# on /metrics; read by prometheus_client itself, unset keeps them per process
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
 
 DB_HOST = os.environ.get("DB_HOST")
 DB_PORT = os.environ.get("DB_PORT")
@@ -17,5 +121,20 @@ DB_NAME = os.environ.get("DB_NAME")
 DB_USER = os.environ.get("DB_USER")
 DB_PASS = os.environ.get("DB_PASS")
 
+# Connection pool of every engine; DB_POOL_CLASS=null opens a connection per
+# checkout, e.g. behind PgBouncer in transaction mode
+DB_POOL_CLASS = os.environ.get("DB_POOL_CLASS", "queue")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+# asyncpg statement cache and SQLAlchemy's prepared statement cache,
+# both must be 0 behind PgBouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(
+    os.environ.get("DB_PREPARED_STATEMENT_CACHE_SIZE", 100)
+)
+
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
@@ -1,11 +1,16 @@
+import time
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import MetaData
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from sqlalchemy import MetaData, Table, event
 
+import config
 from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+from services.metrics import DB_POOL_WAIT, observe_query, pool_collector
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
@@ -14,10 +19,88 @@ Base = declarative_base()
 
 metadata = MetaData()
 
-engine = create_async_engine(DATABASE_URL)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long every checkout waits for a connection."""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_WAIT.labels(self.logging_name).observe(
+                time.perf_counter() - started
+            )
+
+
+def instrument_engine(name: str, engine: AsyncEngine) -> None:
+    """Time every query of ``engine`` and count it for the current request."""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        started = conn.info["query_started"].pop()
+        observe_query(name, statement, time.perf_counter() - started)
+
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(sync_engine, "handle_error", handle_error)
+
+
+def create_engine(name: str, url: str = DATABASE_URL, **kwargs) -> AsyncEngine:
+    """
+    Create an engine tuned by the DB_* settings, shared by the API and the worker.
+
+    ``name`` labels the pool and query metrics of the engine; ``kwargs`` override the
+    settings, e.g. ``poolclass=NullPool``.
+    """
+    options = {"pool_pre_ping": config.DB_POOL_PRE_PING}
+    if config.DB_POOL_CLASS == "null":
+        options["poolclass"] = NullPool
+    options.update(kwargs)
+    if options.get("poolclass") is not NullPool:
+        options = {
+            "poolclass": TimedQueuePool,
+            "pool_size": config.DB_POOL_SIZE,
+            "max_overflow": config.DB_MAX_OVERFLOW,
+            "pool_timeout": config.DB_POOL_TIMEOUT,
+            "pool_recycle": config.DB_POOL_RECYCLE,
+            "pool_logging_name": name,
+            **options,
+        }
+    if url.startswith("postgresql+asyncpg"):
+        options.setdefault("connect_args", {
+            "statement_cache_size": config.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": config.DB_PREPARED_STATEMENT_CACHE_SIZE,
+        })
+    engine = create_async_engine(url, **options)
+    pool_collector.register(name, engine)
+    instrument_engine(name, engine)
+    return engine
+
+
+engine = create_engine("api")
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
+
+
+def get_async_session_maker() -> sessionmaker:
+    """Session factory for responses that outlive the request, e.g. streams."""
+    return async_session_maker
+
+
+def dialect_insert(session: AsyncSession, table: Table):
+    """INSERT supporting ON CONFLICT clauses on both PostgreSQL and SQLite."""
+    if session.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
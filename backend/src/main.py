@@ -6,6 +6,14 @@ from auth.router import router as router_auth
 from posts.router import router as router_posts
 from comments.router import router as router_comments
 from management.router import router as router_management
+from search.router import router as router_search
+from database import engine
+from services.logger import REQUEST_ID_HEADER, RequestIdMiddleware
+from services.events import comment_events
+from services.metrics import MetricsMiddleware, metrics_response
+from services.openai import OpenAI
+from services.pagination import NEXT_CURSOR_HEADER
+from services.redis import close_redis
 
 
 app = FastAPI(
@@ -43,6 +51,13 @@ app.include_router(
     tags=["Management"],
 )
 
+# Search
+app.include_router(
+    router_search,
+    prefix="/search",
+    tags=["Search"],
+)
+
 origins = [
     'http://localhost:3000',
 ]
@@ -54,4 +69,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS", "DELETE", "PATCH", "PUT"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", REQUEST_ID_HEADER],
 )
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics of this process"""
+    return metrics_response()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await OpenAI.close()
+    await comment_events.close()
+    await close_redis()
+    await engine.dispose()
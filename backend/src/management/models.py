@@ -0,0 +1,29 @@
+from database import metadata
+
+from sqlalchemy import (
+    Table, Column,
+    Integer, BigInteger,
+    Date,
+)
+
+# Row of the counters that covers the comments of all users
+ALL_USERS = 0
+
+CommentCounter = Table(
+    'comment_counter',
+    metadata,
+    Column('user_id', Integer, primary_key=True, autoincrement=False),
+    Column('friendly', BigInteger, default=0, nullable=False),
+    Column('unfriendly', BigInteger, default=0, nullable=False),
+)
+
+# Comments per day, post and author; NULL post or author ids are stored as 0
+CommentDailyStats = Table(
+    'comment_daily_stats',
+    metadata,
+    Column('day', Date, primary_key=True),
+    Column('post_id', Integer, primary_key=True, autoincrement=False),
+    Column('user_id', Integer, primary_key=True, autoincrement=False),
+    Column('friendly', BigInteger, default=0, nullable=False),
+    Column('unfriendly', BigInteger, default=0, nullable=False),
+)
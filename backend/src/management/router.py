@@ -1,12 +1,17 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.base_config import current_user
 from database import get_async_session
-from sqlalchemy import select, func
+from sqlalchemy import select
 from datetime import datetime
 
 from auth.models import User
-from comments.models import Comment
+from management.models import ALL_USERS, CommentCounter
+from management.utils import daily_stats
+from services.cache import response_cache
+from services.moderation import moderator
 
 from services.logger import Logger
 import logging
@@ -21,6 +26,8 @@ router = APIRouter()
 async def get_full_analysis_for_a_period(
         date_from: str = Query(..., description="Start date in YYYY-MM-DD format"),
         date_to: str = Query(..., description="End date in YYYY-MM-DD format"),
+        post_id: Optional[int] = Query(None, description="Only comments of this post"),
+        user_id: Optional[int] = Query(None, description="Only comments of this user"),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
@@ -28,33 +35,16 @@ async def get_full_analysis_for_a_period(
     Get daily breakdown of comment counts between two dates in YYYY-MM-DD format.
     """
     try:
-        start_date = datetime.strptime(date_from, "%Y-%m-%d")
-        end_date = datetime.strptime(date_to, "%Y-%m-%d")
-
-        friendly = await session.execute(
-            select(func.count()).where(
-                Comment.c.created_at >= start_date
-            ).where(
-                Comment.c.created_at <= end_date
-            ).where(
-                Comment.c.friendly
-            )
-        )
-        unfriendly = await session.execute(
-            select(func.count()).where(
-                Comment.c.created_at >= start_date
-            ).where(
-                Comment.c.created_at <= end_date
-            ).where(
-                ~Comment.c.friendly
-            )
-        )
+        start_date = datetime.strptime(date_from, "%Y-%m-%d").date()
+        end_date = datetime.strptime(date_to, "%Y-%m-%d").date()
 
-        friendly_count = friendly.scalar()
-        unfriendly_count = unfriendly.scalar()
+        daily = await daily_stats(session, start_date, end_date, post_id, user_id)
+        friendly_count = sum(day["friendly"] for day in daily)
+        unfriendly_count = sum(day["unfriendly"] for day in daily)
 
         return {"status": 200, "description": "Success",
-                "data": {"friendly": friendly_count, "unfriendly": unfriendly_count}}
+                "data": {"friendly": friendly_count, "unfriendly": unfriendly_count,
+                         "daily": daily}}
     except Exception as e:
         logger.error(f"Error: {e}")
         return {"status": 500, "description": f"{e}"}
@@ -69,9 +59,11 @@ async def get_most_toxic_user(
     Get user with the most unfriendly comments
     """
     try:
-        stmt = select(Comment.c.user_id).where(
-            ~Comment.c.friendly
-        ).group_by(Comment.c.user_id).order_by(func.count().desc()).limit(1)
+        stmt = select(CommentCounter.c.user_id).where(
+            CommentCounter.c.user_id != ALL_USERS
+        ).where(
+            CommentCounter.c.unfriendly > 0
+        ).order_by(CommentCounter.c.unfriendly.desc()).limit(1)
         result = await session.execute(stmt)
         user_id = result.scalar()
 
@@ -90,11 +82,11 @@ async def get_friendly_comments_count(
     Get count of friendly comments
     """
     try:
-        stmt = select(func.count()).where(
-            Comment.c.friendly
+        stmt = select(CommentCounter.c.friendly).where(
+            CommentCounter.c.user_id == ALL_USERS
         )
         result = await session.execute(stmt)
-        count = result.scalar()
+        count = result.scalar() or 0
 
         return {"status": 200, "description": "Success", "count": count}
 
@@ -112,11 +104,11 @@ async def get_unfriendly_comments_count(
     Get count of unfriendly comments
     """
     try:
-        stmt = select(func.count()).where(
-            Comment.c.friendly
+        stmt = select(CommentCounter.c.unfriendly).where(
+            CommentCounter.c.user_id == ALL_USERS
         )
         result = await session.execute(stmt)
-        count = result.scalar()
+        count = result.scalar() or 0
 
         return {"status": 200, "description": "Success", "count": count}
 
@@ -134,25 +126,47 @@ async def get_user_activity(
     Get user activity by user ID: count of friendly and unfriendly comments
     """
     try:
-        stmt_friendly = select(func.count()).where(
-            Comment.c.user_id == user_id
+        stmt = select(
+            CommentCounter.c.friendly, CommentCounter.c.unfriendly
         ).where(
-            Comment.c.friendly
+            CommentCounter.c.user_id == user_id
         )
-        stmt_unfriendly = select(func.count()).where(
-            Comment.c.user_id == user_id
-        ).where(
-            Comment.c.friendly
-        )
-
-        result_friendly = await session.execute(stmt_friendly)
-        result_unfriendly = await session.execute(stmt_unfriendly)
-
-        count_friendly = result_friendly.scalar()
-        count_unfriendly = result_unfriendly.scalar()
+        result = await session.execute(stmt)
+        count_friendly, count_unfriendly = result.one_or_none() or (0, 0)
 
         return {"status": 200, "description": "Success",
                 "data": {"friendly": count_friendly, "unfriendly": count_unfriendly}}
     except Exception as e:
         logger.error(f"Error: {e}")
         return {"status": 500, "description": f"{e}"}
+
+
+@router.get("/moderation_cache")
+async def get_moderation_cache_stats(
+        user: User = Depends(current_user),
+):
+    """
+    Get hit/miss counters of the moderation verdict cache
+    """
+    return {"status": 200, "description": "Success", "data": moderator.cache.stats()}
+
+
+@router.get("/moderation_sources")
+async def get_moderation_sources(
+        user: User = Depends(current_user),
+):
+    """
+    Get how many texts the pre-filter, the verdict cache and every moderation
+    backend decided
+    """
+    return {"status": 200, "description": "Success", "data": moderator.stats()}
+
+
+@router.get("/response_cache")
+async def get_response_cache_stats(
+        user: User = Depends(current_user),
+):
+    """
+    Get hit/miss counters of the post and comment response cache
+    """
+    return {"status": 200, "description": "Success", "data": response_cache.stats()}
@@ -0,0 +1,216 @@
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from comments.models import Comment
+from database import dialect_insert
+from management.models import ALL_USERS, CommentCounter, CommentDailyStats
+from services.moderation import MODERATION_DONE
+
+
+def counted_verdict(friendly: bool, moderation_status: str) -> Optional[bool]:
+    """Verdict a comment is counted with, None until its moderation is done."""
+    return friendly if moderation_status == MODERATION_DONE else None
+
+
+async def count_comment_change(
+        session: AsyncSession,
+        comment,
+        before: Optional[bool],
+        after: Optional[bool],
+) -> None:
+    """
+    Move a comment between the friendly and unfriendly counters and the
+    daily rollup.
+
+    ``comment`` is the row of the comment, with its user_id, post_id and
+    created_at. ``before`` and ``after`` are the counted verdicts of the
+    comment, None when it is not counted (not existing yet, deleted or still
+    pending). Everything is updated in the session's transaction, so it
+    commits or rolls back together with the comment itself.
+    """
+    friendly = int(after is True) - int(before is True)
+    unfriendly = int(after is False) - int(before is False)
+    await count_comments(session, comment.user_id, friendly, unfriendly)
+    await count_daily_comments(session, {_rollup_key(comment): (friendly, unfriendly)})
+
+
+async def count_new_comments(session: AsyncSession, user_id: Optional[int],
+                             comments) -> None:
+    """Count comments of a user that were just created with a verdict."""
+    friendly = sum(comment.friendly for comment in comments)
+    await count_comments(session, user_id, friendly, len(comments) - friendly)
+    daily: Dict[Tuple, Tuple[int, int]] = {}
+    for comment in comments:
+        day_friendly, day_unfriendly = daily.get(_rollup_key(comment), (0, 0))
+        daily[_rollup_key(comment)] = (
+            day_friendly + comment.friendly, day_unfriendly + (not comment.friendly)
+        )
+    await count_daily_comments(session, daily)
+
+
+async def count_comments(
+        session: AsyncSession,
+        user_id: Optional[int],
+        friendly: int,
+        unfriendly: int,
+) -> None:
+    """Add to the friendly and unfriendly counters of a user and of all users."""
+    if not friendly and not unfriendly:
+        return
+
+    scopes = [ALL_USERS] if user_id is None else [ALL_USERS, user_id]
+    stmt = dialect_insert(session, CommentCounter).values([
+        {"user_id": scope, "friendly": friendly, "unfriendly": unfriendly}
+        for scope in scopes
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CommentCounter.c.user_id],
+        set_={
+            "friendly": CommentCounter.c.friendly + stmt.excluded.friendly,
+            "unfriendly": CommentCounter.c.unfriendly + stmt.excluded.unfriendly,
+        },
+    )
+    await session.execute(stmt)
+
+
+def _rollup_key(comment) -> Tuple[date, int, int]:
+    """Rollup row of a comment; NULL post or author ids are stored as 0."""
+    created_at = comment.created_at or datetime.utcnow()
+    return created_at.date(), comment.post_id or 0, comment.user_id or 0
+
+
+async def count_daily_comments(
+        session: AsyncSession,
+        counts: Dict[Tuple[date, int, int], Tuple[int, int]],
+) -> None:
+    """
+    Add friendly and unfriendly counts to the rollup rows of
+    ``(day, post_id, user_id)`` keys, so edits, deletes and late verdicts of
+    comments of any day reach the rollup with the change itself.
+    """
+    rows = [
+        {"day": day, "post_id": post_id, "user_id": user_id,
+         "friendly": friendly, "unfriendly": unfriendly}
+        for (day, post_id, user_id), (friendly, unfriendly) in counts.items()
+        if friendly or unfriendly
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(session, CommentDailyStats).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            CommentDailyStats.c.day,
+            CommentDailyStats.c.post_id,
+            CommentDailyStats.c.user_id,
+        ],
+        set_={
+            "friendly": CommentDailyStats.c.friendly + stmt.excluded.friendly,
+            "unfriendly": CommentDailyStats.c.unfriendly + stmt.excluded.unfriendly,
+        },
+    )
+    await session.execute(stmt)
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+
+def _comments_per_day(date_from: date, date_to: date):
+    """Friendly and unfriendly comments per day, post and author, from raw rows."""
+    return select(
+        func.date(Comment.c.created_at).label("day"),
+        func.coalesce(Comment.c.post_id, 0).label("post_id"),
+        func.coalesce(Comment.c.user_id, 0).label("user_id"),
+        func.count().filter(Comment.c.friendly).label("friendly"),
+        func.count().filter(~Comment.c.friendly).label("unfriendly"),
+    ).where(
+        Comment.c.created_at >= _day_start(date_from)
+    ).where(
+        Comment.c.created_at < _day_start(date_to + timedelta(days=1))
+    ).where(
+        Comment.c.moderation_status == MODERATION_DONE
+    ).group_by("day", "post_id", "user_id")
+
+
+async def refresh_daily_stats(session: AsyncSession, date_from: date, date_to: date
+                              ) -> None:
+    """Rebuild the daily rollup for the days between two dates (inclusive)."""
+    await session.execute(delete(CommentDailyStats).where(
+        CommentDailyStats.c.day >= date_from
+    ).where(
+        CommentDailyStats.c.day <= date_to
+    ))
+    # Comment writes may upsert the rows of these days meanwhile, the recount wins
+    stmt = dialect_insert(session, CommentDailyStats).from_select(
+        ["day", "post_id", "user_id", "friendly", "unfriendly"],
+        _comments_per_day(date_from, date_to),
+    )
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[
+            CommentDailyStats.c.day,
+            CommentDailyStats.c.post_id,
+            CommentDailyStats.c.user_id,
+        ],
+        set_={
+            "friendly": stmt.excluded.friendly,
+            "unfriendly": stmt.excluded.unfriendly,
+        },
+    ))
+
+
+async def daily_stats(
+        session: AsyncSession,
+        date_from: date,
+        date_to: date,
+        post_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+) -> List[dict]:
+    """
+    Friendly and unfriendly comment counts for every day between two dates.
+
+    Past days are read from the rollup. Today is still changing, so it is
+    counted from the comments themselves, which is a short range scan.
+    """
+    today = datetime.utcnow().date()
+    counts = {}
+
+    if date_from < today:
+        stmt = select(
+            CommentDailyStats.c.day,
+            func.sum(CommentDailyStats.c.friendly),
+            func.sum(CommentDailyStats.c.unfriendly),
+        ).where(
+            CommentDailyStats.c.day >= date_from
+        ).where(
+            CommentDailyStats.c.day <= min(date_to, today - timedelta(days=1))
+        ).group_by(CommentDailyStats.c.day)
+        if post_id is not None:
+            stmt = stmt.where(CommentDailyStats.c.post_id == post_id)
+        if user_id is not None:
+            stmt = stmt.where(CommentDailyStats.c.user_id == user_id)
+        for day, friendly, unfriendly in (await session.execute(stmt)).all():
+            counts[day] = (friendly, unfriendly)
+
+    if date_from <= today <= date_to:
+        live = _comments_per_day(today, today).subquery()
+        stmt = select(func.sum(live.c.friendly), func.sum(live.c.unfriendly))
+        if post_id is not None:
+            stmt = stmt.where(live.c.post_id == post_id)
+        if user_id is not None:
+            stmt = stmt.where(live.c.user_id == user_id)
+        friendly, unfriendly = (await session.execute(stmt)).one()
+        counts[today] = (friendly or 0, unfriendly or 0)
+
+    days = (date_to - date_from).days + 1
+    series = []
+    for day in (date_from + timedelta(days=n) for n in range(max(days, 0))):
+        friendly, unfriendly = counts.get(day, (0, 0))
+        series.append({
+            "date": day.isoformat(),
+            "friendly": int(friendly),
+            "unfriendly": int(unfriendly),
+        })
+    return series
@@ -5,10 +5,11 @@ from sqlalchemy import (
     Table, Column,
     Integer, String,
     TIMESTAMP, ForeignKey,
-    Boolean,
+    Boolean, Index, true,
 )
 
 from auth.models import User
+from services.moderation import MODERATION_DONE, MODERATION_PENDING
 
 Post = Table(
     'post',
@@ -17,9 +18,23 @@ Post = Table(
     Column('title', String, nullable=False),
     Column('content', String, nullable=False),
     Column('created_at', TIMESTAMP, default=datetime.utcnow),
-    Column('updated_at', TIMESTAMP, default=datetime.utcnow),
+    Column('updated_at', TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow),
     Column('user_id', ForeignKey(User.id)),
     Column('friendly', Boolean, default=False, nullable=False),
+    Column('moderation_status', String, default=MODERATION_DONE, nullable=False),
     Column('auto_answer', Boolean, default=False, nullable=False),
     Column('delay_answer', Integer, default=30, nullable=True),
+    # Bumped with every change of the friendly comments of the post
+    Column('comments_version', Integer, default=0, nullable=False),
 )
+
+# Posts are listed by id, all friendly ones or those of a user, and exported
+# by creation date; the friendly lists of a user use the (user_id, id) index
+Index('ix_post_friendly_id', Post.c.id,
+      postgresql_where=Post.c.friendly, sqlite_where=Post.c.friendly == true())
+Index('ix_post_user_id_id', Post.c.user_id, Post.c.id)
+# Rows left pending by a lost moderation task, oldest change first
+Index('ix_post_pending_updated_at', Post.c.updated_at,
+      postgresql_where=Post.c.moderation_status == MODERATION_PENDING,
+      sqlite_where=Post.c.moderation_status == MODERATION_PENDING)
+Index('ix_post_created_at', Post.c.created_at)
@@ -1,14 +1,26 @@
-from fastapi import APIRouter, Depends
+from datetime import date
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 from auth.base_config import current_user
-from database import get_async_session
+from database import get_async_session, get_async_session_maker
 from sqlalchemy import insert, select, update, delete
 
 from auth.models import User
 from posts.models import Post
 from posts.schemas import PostCreateRequest, PostUpdateRequest
 
-from services.openai import OpenAI
+from worker import enqueue_moderation
+
+import config
+from services.cache import response_cache
+from services.moderation import moderator, MODERATION_DONE, MODERATION_PENDING
+from services.etag import conditional, make_etag
+from services.export import export_response
+from services.rate_limit import RateLimit
+from services.pagination import Page, paginate
 from services.logger import Logger
 import logging
 
@@ -20,16 +32,16 @@ router = APIRouter()
 
 @router.get("/all", status_code=200)
 async def get_all_posts(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get all posts
+    Get all posts, page by page
     """
     try:
-        posts = await session.execute(select(Post).order_by(Post.c.id))
-
-        return posts.mappings().all()
+        return await paginate(session, select(Post), Post.c.id, page, response)
     except Exception as e:
         logger.error(f"Error getting all posts: {e}")
         return {"status": 500, "description": f"{e}"}
@@ -37,18 +49,20 @@ async def get_all_posts(
 
 @router.get("/all_friendly", status_code=200)
 async def get_all_friendly_posts(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get all only friendly posts
+    Get all only friendly posts, page by page
     """
     try:
-        posts = await session.execute(select(Post).where(
+        stmt = select(Post).where(
             Post.c.friendly
-        ).order_by(Post.c.id))
-
-        return posts.mappings().all()
+        )
+        return await paginate(session, stmt, Post.c.id, page, response,
+                              cache_as=("posts", "all_friendly"))
     except Exception as e:
         logger.error(f"Error getting all posts: {e}")
         return {"status": 500, "description": f"{e}"}
@@ -56,17 +70,19 @@ async def get_all_friendly_posts(
 
 @router.get("/user", status_code=200)
 async def get_posts_by_user(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get post by user
+    Get post by user, page by page
     """
     try:
-        posts = await session.execute(select(Post).where(
+        stmt = select(Post).where(
             Post.c.user_id == user.id
-        ).order_by(Post.c.id))
-        return posts.mappings().all()
+        )
+        return await paginate(session, stmt, Post.c.id, page, response)
     except Exception as e:
         logger.error(f"Error getting posts by user: {e}")
         return {"status": 500, "description": f"{e}"}
@@ -74,44 +90,102 @@ async def get_posts_by_user(
 
 @router.get("/user_friendly", status_code=200)
 async def get_friendly_posts_by_user(
+        response: Response,
+        page: Page = Depends(),
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get all only friendly posts by user
+    Get all only friendly posts by user, page by page
     """
     try:
-        posts = await session.execute(select(Post).where(
+        stmt = select(Post).where(
             Post.c.user_id == user.id
         ).where(
             Post.c.friendly
-        ).order_by(Post.c.id))
-        return posts.mappings().all()
+        )
+        return await paginate(session, stmt, Post.c.id, page, response,
+                              cache_as=("posts", f"user_friendly:{user.id}"))
     except Exception as e:
         logger.error(f"Error getting posts by user: {e}")
         return {"status": 500, "description": f"{e}"}
 
 
+@router.get("/export", status_code=200)
+async def export_posts(
+        format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson or csv"),
+        date_from: Optional[date] = Query(None, description="Start date, YYYY-MM-DD"),
+        date_to: Optional[date] = Query(None, description="End date, YYYY-MM-DD"),
+        friendly: Optional[bool] = Query(None, description="Friendly or not"),
+        user: User = Depends(current_user),
+        session_maker: sessionmaker = Depends(get_async_session_maker),
+):
+    """
+    Stream posts created between two dates as NDJSON or CSV
+    """
+    return export_response(session_maker, Post, format, date_from, date_to, friendly)
+
+
 @router.get("/{post_id}", status_code=200)
 async def get_post_by_id(
         post_id: int,
+        request: Request,
+        response: Response,
         user: User = Depends(current_user),
         session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Get post by id
+    Get post by id.
+    Answers 304 when If-None-Match holds the ETag of the unchanged post
     """
-    try:
+    async def load():
         post = await session.execute(select(Post).where(
             Post.c.id == post_id
         ).order_by(Post.c.id))
-        return post.mappings().all()[0]
+        return post.mappings().first()
+
+    try:
+        version = await session.execute(select(Post.c.updated_at).where(
+            Post.c.id == post_id
+        ))
+        updated_at = version.first()
+        if updated_at is None:
+            response.status_code = 404
+            return {"status": 404, "description": "Post not found"}
+        etag = make_etag("post", post_id, updated_at[0])
+        not_modified = conditional(request, response, etag)
+        if not_modified is not None:
+            return not_modified
+        return await response_cache.get_or_load("posts", f"post:{post_id}", load)
     except Exception as e:
         logger.error(f"Error getting post by id: {e}")
         return {"status": 500, "description": f"{e}"}
 
 
-@router.post("/", status_code=201)
+@router.get("/{post_id}/status", status_code=200)
+async def get_post_moderation_status(
+        post_id: int,
+        user: User = Depends(current_user),
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get moderation status of a post: pending, done or failed
+    """
+    try:
+        post = await session.execute(select(
+            Post.c.id, Post.c.moderation_status, Post.c.friendly
+        ).where(
+            Post.c.id == post_id
+        ))
+        return {"status": 200, "description": "Success",
+                "data": post.mappings().one()}
+    except Exception as e:
+        logger.error(f"Error getting post moderation status: {e}")
+        return {"status": 500, "description": f"{e}"}
+
+
+@router.post("/", status_code=201,
+             dependencies=[Depends(RateLimit("posts:create"))])
 async def create_post(
         post_request: PostCreateRequest,
         user: User = Depends(current_user),
@@ -121,19 +195,29 @@ async def create_post(
     Create post
     """
     try:
-        ai = OpenAI()
-        result = await ai.check_text(post_request.content)
-        await session.execute(insert(Post).values(
+        pending = config.MODERATION_ASYNC
+        result = False if pending else await moderator.check_text(post_request.content)
+        post = await session.execute(insert(Post).values(
             title=post_request.title,
             content=post_request.content,
             user_id=user.id,
             auto_answer=post_request.auto_answer,
             delay_answer=post_request.delay_answer,
-            friendly=result
-        ))
+            friendly=result,
+            moderation_status=MODERATION_PENDING if pending else MODERATION_DONE,
+        ).returning(Post.c.id))
+        post_id = post.scalar()
         await session.commit()
         await session.close()
+        await response_cache.invalidate("posts")
         logger.info(f"Post created by user: {user.username}")
+        if pending:
+            await enqueue_moderation("post", post_id)
+            return {
+                "status": 201,
+                "description": "Post was created and is awaiting moderation",
+                "id": post_id,
+            }
         return {
             "status": 201,
             "description": "Post created successfully" if result
@@ -145,7 +229,8 @@ async def create_post(
         return {"status": 500, "description": f"{e}"}
 
 
-@router.patch("/{post_id}", status_code=200)
+@router.patch("/{post_id}", status_code=200,
+              dependencies=[Depends(RateLimit("posts:update"))])
 async def update_post(
         post_id: int,
         post_update: PostUpdateRequest,
@@ -156,17 +241,26 @@ async def update_post(
     Update post
     """
     try:
-        ai = OpenAI()
-        result = await ai.check_text(post_update.content)
+        pending = config.MODERATION_ASYNC
+        result = False if pending else await moderator.check_text(post_update.content)
         await session.execute(update(Post).where(Post.c.id == post_id).values(
             title=post_update.title,
             content=post_update.content,
             auto_answer=post_update.auto_answer,
             delay_answer=post_update.delay_answer,
-            friendly=result
+            friendly=result,
+            moderation_status=MODERATION_PENDING if pending else MODERATION_DONE,
         ))
         await session.commit()
+        await response_cache.invalidate("posts")
         logger.info(f"Post updated by user: {user.username}")
+        if pending:
+            await enqueue_moderation("post", post_id)
+            return {
+                "status": 200,
+                "description": "Post was updated and is awaiting moderation",
+                "id": post_id,
+            }
         return {
             "status": 200,
             "description": "Post changed successfully" if result
@@ -190,6 +284,7 @@ async def delete_post(
     try:
         await session.execute(delete(Post).where(Post.c.id == post_id))
         await session.commit()
+        await response_cache.invalidate("posts", "comments", f"comments:post:{post_id}")
         logger.info(f"Post deleted by user: {user.username}")
         return {"status": 200, "description": "Post deleted successfully"}
     except Exception as e:
@@ -0,0 +1,74 @@
+from numbers import Real
+from typing import Any, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth.base_config import current_user
+from auth.models import User
+from database import get_async_session
+from search.utils import search
+from services.logger import Logger
+from services.pagination import NEXT_CURSOR_HEADER, Page, encode_cursor
+import logging
+
+logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger',
+                filename='search.log').get_logger()
+
+router = APIRouter()
+
+
+class SearchPage(Page):
+    """Page whose cursor is the (rank, id) of the last result sent."""
+
+    @staticmethod
+    def parse(after: Any) -> Tuple[float, int]:
+        if (
+                not isinstance(after, list) or len(after) != 2
+                or isinstance(after[0], bool) or not isinstance(after[0], Real)
+                or isinstance(after[1], bool) or not isinstance(after[1], int)
+        ):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return tuple(after)
+
+
+@router.get("/posts", status_code=200)
+async def search_posts(
+        response: Response,
+        q: str = Query(..., min_length=1, max_length=200, description="Search words"),
+        page: SearchPage = Depends(),
+        user: User = Depends(current_user),
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Search friendly posts by title and content, best matches first, page by page
+    """
+    try:
+        rows, after = await search(session, "post", q, page.after, page.limit)
+        if after is not None:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(after)
+        return rows
+    except Exception as e:
+        logger.error(f"Error searching posts: {e}")
+        return {"status": 500, "description": f"{e}"}
+
+
+@router.get("/comments", status_code=200)
+async def search_comments(
+        response: Response,
+        q: str = Query(..., min_length=1, max_length=200, description="Search words"),
+        page: SearchPage = Depends(),
+        user: User = Depends(current_user),
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Search friendly comments by content, best matches first, page by page
+    """
+    try:
+        rows, after = await search(session, "comment", q, page.after, page.limit)
+        if after is not None:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(after)
+        return rows
+    except Exception as e:
+        logger.error(f"Error searching comments: {e}")
+        return {"status": 500, "description": f"{e}"}
@@ -0,0 +1,83 @@
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    Column, ColumnElement, Float, and_, func, literal, literal_column, or_, select,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from posts.models import Post
+from comments.models import Comment
+
+# Text search configuration the generated tsvector columns are built with
+SEARCH_CONFIG = "english"
+
+# Generated columns of the add_search_vectors migration. They exist on
+# PostgreSQL only, so they are not part of the table models.
+POST_SEARCH_VECTOR = literal_column("post.search_vector", TSVECTOR)
+COMMENT_SEARCH_VECTOR = literal_column("comment.search_vector", TSVECTOR)
+
+SEARCHABLE = {
+    "post": (Post, POST_SEARCH_VECTOR, (Post.c.title, Post.c.content)),
+    "comment": (Comment, COMMENT_SEARCH_VECTOR, (Comment.c.content,)),
+}
+
+
+def _like_match(columns: Sequence[Column], q: str) -> ColumnElement:
+    """Every word of ``q`` in one of ``columns``, ignoring case."""
+    return and_(*(
+        or_(*(func.lower(column).contains(word, autoescape=True) for column in columns))
+        for word in q.casefold().split()
+    ))
+
+
+def search_query(
+        dialect: str,
+        kind: str,
+        q: str,
+        after: Optional[Tuple[float, int]],
+        limit: int,
+) -> Select:
+    """
+    Friendly rows matching ``q``, best ranked first and by id among equals.
+
+    PostgreSQL matches the GIN-indexed tsvector column with ts_rank ordering.
+    Other databases fall back to a LIKE scan where every row ranks the same.
+    Pages continue after the ``(rank, id)`` of the last row already sent.
+    """
+    table, vector, columns = SEARCHABLE[kind]
+    if dialect == "postgresql":
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        match = vector.op("@@")(query)
+        rank = func.ts_rank(vector, query)
+    else:
+        match = _like_match(columns, q)
+        rank = literal(0.0, Float)
+
+    ranked = select(table, rank.label("rank")).where(
+        table.c.friendly
+    ).where(
+        match
+    ).subquery()
+    stmt = select(ranked)
+    if after is not None:
+        stmt = stmt.where(tuple_(ranked.c.rank, ranked.c.id) < tuple_(*after))
+    return stmt.order_by(ranked.c.rank.desc(), ranked.c.id.desc()).limit(limit)
+
+
+async def search(
+        session: AsyncSession,
+        kind: str,
+        q: str,
+        after: Optional[Tuple[float, int]],
+        limit: int,
+) -> Tuple[List, Optional[list]]:
+    """Fetch one page of search results and the sort key to continue after."""
+    stmt = search_query(session.get_bind().dialect.name, kind, q, after, limit + 1)
+    rows = (await session.execute(stmt)).mappings().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, [rows[-1]["rank"], rows[-1]["id"]]
+    return rows, None
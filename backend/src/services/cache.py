@@ -0,0 +1,293 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+import config
+from services.logger import Logger
+from services.redis import get_redis, get_sync_redis
+
+logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger',
+                filename='cache.log').get_logger()
+
+
+class LocalCache:
+    """In-process LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TwoTierCache:
+    """
+    JSON values by key, in the in-process LRU first and then in Redis (when
+    configured), which is shared by every uvicorn and Celery worker. Redis
+    errors are logged and treated as misses.
+    """
+    prefix = "navi:"
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.ttl = ttl
+        self.local = LocalCache(maxsize, ttl)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                data = await redis.get(self.prefix + key)
+            except Exception as e:
+                logger.warning(f"{type(self).__name__} Redis lookup failed: {e}")
+                data = None
+            if data is not None:
+                value = json.loads(data)
+                self.local.set(key, value)
+                self.redis_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        self.local.set(key, value)
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"{type(self).__name__} Redis store failed: {e}")
+
+    async def delete(self, key: str) -> None:
+        self.local.delete(key)
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.delete(self.prefix + key)
+            except Exception as e:
+                logger.error(f"{type(self).__name__} Redis delete failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self.local),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+
+# Delete a lock only while it still holds the token of its owner
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ResponseCache:
+    """
+    Read-through cache of endpoint results, shared through Redis.
+
+    Keys live in namespaces ("posts", "comments") whose version is part of
+    every key, so a write invalidates a whole namespace by bumping its
+    version and the stale entries simply expire. Concurrent misses of one key
+    are loaded once per process, and once across processes while the
+    loading one holds its Redis lock. Without Redis an in-process LRU is
+    used and only this process sees the invalidations.
+    """
+    prefix = "navi:response:"
+    lock_timeout = 5.0
+    lock_poll_interval = 0.05
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.ttl = ttl
+        self.local = LocalCache(maxsize, ttl)
+        self.versions: Dict[str, int] = {}
+        self._flights: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def _version(self, namespace: str) -> int:
+        redis = get_redis()
+        if redis is not None:
+            try:
+                return int(await redis.get(f"{self.prefix}{namespace}:version") or 0)
+            except Exception as e:
+                logger.warning(f"Response cache Redis version lookup failed: {e}")
+        return self.versions.get(namespace, 0)
+
+    async def _get(self, key: str) -> Any:
+        redis = get_redis()
+        if redis is None:
+            return self.local.get(key)
+        try:
+            value = await redis.get(key)
+        except Exception as e:
+            logger.warning(f"Response cache Redis lookup failed: {e}")
+            return None
+        return None if value is None else json.loads(value)
+
+    async def _set(self, key: str, value: Any) -> None:
+        redis = get_redis()
+        if redis is None:
+            self.local.set(key, value)
+            return
+        try:
+            await redis.set(key, json.dumps(value), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Response cache Redis store failed: {e}")
+
+    async def _wait_for_other_loader(self, key: str, token: str) -> Tuple[Any, bool]:
+        """
+        Take the Redis loading lock of ``key`` with ``token``, or wait for the
+        process that holds it to store the value. Returns the value, or None
+        to load it, and whether the lock was taken.
+        """
+        redis = get_redis()
+        if redis is None:
+            return None, False
+        try:
+            if await redis.set(f"{key}:lock", token, nx=True,
+                               px=int(self.lock_timeout * 1000)):
+                return None, True
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.lock_poll_interval)
+                value = await self._get(key)
+                if value is not None:
+                    return value, False
+                if not await redis.exists(f"{key}:lock"):
+                    # The holder failed to load it, load it here
+                    return None, False
+        except Exception as e:
+            logger.warning(f"Response cache Redis lock failed: {e}")
+        return None, False
+
+    async def _release_lock(self, key: str, token: str) -> None:
+        """Drop the loading lock of ``key`` unless it expired and was taken over."""
+        redis = get_redis()
+        try:
+            await redis.eval(RELEASE_LOCK_SCRIPT, 1, f"{key}:lock", token)
+        except Exception as e:
+            logger.warning(f"Response cache Redis unlock failed: {e}")
+
+    async def get_or_load(
+            self,
+            namespace: str,
+            key: str,
+            loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Return the cached value of ``key`` or store the result of ``loader``."""
+        key = f"{self.prefix}{namespace}:{await self._version(namespace)}:{key}"
+        value = await self._get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(flight)
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        token, locked = uuid.uuid4().hex, False
+        try:
+            value, locked = await self._wait_for_other_loader(key, token)
+            if value is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                value = jsonable_encoder(await loader())
+                await self._set(key, value)
+            flight.set_result(value)
+            return value
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()
+            raise
+        finally:
+            del self._flights[key]
+            if locked:
+                await self._release_lock(key, token)
+
+    async def invalidate(self, *namespaces: str) -> None:
+        """Drop every cached entry of the namespaces."""
+        for namespace in namespaces:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+        redis = get_redis()
+        if redis is not None:
+            try:
+                for namespace in namespaces:
+                    await redis.incr(f"{self.prefix}{namespace}:version")
+            except Exception as e:
+                logger.error(f"Response cache invalidation failed: {e}")
+
+    def invalidate_sync(self, *namespaces: str) -> None:
+        """``invalidate`` for code running outside of the event loop."""
+        for namespace in namespaces:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+        redis = get_sync_redis()
+        if redis is not None:
+            try:
+                for namespace in namespaces:
+                    redis.incr(f"{self.prefix}{namespace}:version")
+            except Exception as e:
+                logger.error(f"Response cache invalidation failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self.local),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_TTL)
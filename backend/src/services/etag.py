@@ -0,0 +1,34 @@
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+
+def make_etag(*version: Any) -> str:
+    """Build a strong ETag from the values identifying a resource version."""
+    digest = hashlib.sha1(json.dumps(version, default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Tell whether the client's If-None-Match already names ``etag``."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    return "*" in tags or etag in (tag.removeprefix("W/") for tag in tags)
+
+
+def conditional(
+        request: Request, response: Response, etag: str
+) -> Optional[Response]:
+    """
+    Set the ETag of the response and return a bodiless 304 when the client
+    already holds this version, None otherwise.
+    """
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
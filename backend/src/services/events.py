@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+import config
+from services.logger import Logger
+from services.redis import get_redis
+
+logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger',
+                filename='events.log').get_logger()
+
+# Columns of a comment sent to the streams
+EVENT_COLUMNS = ("id", "post_id", "parent_id", "user_id", "content", "created_at")
+
+Event = Tuple[int, str]
+
+
+def comment_event(comment) -> str:
+    """Serialize the streamed columns of a comment row."""
+    return json.dumps(jsonable_encoder(
+        {column: getattr(comment, column) for column in EVENT_COLUMNS}
+    ))
+
+
+class CommentEvents:
+    """
+    Fan-out of committed friendly comments to the streams of their post.
+
+    Publishers of every process, API and worker alike, send comments to the
+    Redis channel of the post. Every API process listens to all of them with
+    one pattern subscription while it has subscribers, and hands them to its
+    own subscriber queues. Without Redis, only subscribers of the publishing
+    process get the comments.
+
+    A subscriber whose queue is full gets None and should disconnect, so
+    that its client reconnects and catches up from the database.
+    """
+    prefix = "navi:comments:"
+
+    def __init__(self, queue_size: int, subscribe_timeout: float = 5):
+        self.queue_size = queue_size
+        self.subscribe_timeout = subscribe_timeout
+        self.subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self.listener: Optional[asyncio.Task] = None
+        self.listening: Optional[asyncio.Event] = None
+
+    async def publish(self, comments: Iterable) -> None:
+        events = [(comment.post_id, comment_event(comment)) for comment in comments]
+        if not events:
+            return
+        redis = get_redis()
+        if redis is not None:
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for post_id, data in events:
+                        pipe.publish(f"{self.prefix}{post_id}", data)
+                    await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning(f"Comment events Redis publish failed: {e}")
+        for post_id, data in events:
+            self._deliver(post_id, data)
+
+    def _deliver(self, post_id: int, data: str) -> None:
+        queues = self.subscribers.get(post_id)
+        if not queues:
+            return
+        event = (json.loads(data)["id"], data)
+        for queue in queues:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping a slow subscriber of post {post_id}")
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _listen(self, listening: asyncio.Event) -> None:
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.psubscribe(f"{self.prefix}*")
+                async for message in pubsub.listen():
+                    if message["type"] == "psubscribe":
+                        listening.set()
+                    if message["type"] != "pmessage":
+                        continue
+                    post_id = int(message["channel"].decode().rsplit(":", 1)[1])
+                    self._deliver(post_id, message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Comment events listener failed: {e}")
+                await asyncio.sleep(1)
+            finally:
+                listening.clear()
+                await pubsub.reset()
+
+    @asynccontextmanager
+    async def subscribe(self, post_id: int) -> AsyncIterator[asyncio.Queue]:
+        """
+        Queue of the (id, data) events of the new comments of a post, handed
+        out once Redis confirmed the subscription, so no comment committed
+        afterwards is missed.
+        """
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(post_id, set()).add(queue)
+        try:
+            if get_redis() is not None:
+                if self.listener is None or self.listener.done():
+                    self.listening = asyncio.Event()
+                    self.listener = asyncio.ensure_future(self._listen(self.listening))
+                try:
+                    await asyncio.wait_for(
+                        self.listening.wait(), self.subscribe_timeout
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning("Comment events subscription is not confirmed yet")
+            yield queue
+        finally:
+            queues = self.subscribers.get(post_id, set())
+            queues.discard(queue)
+            if not queues:
+                self.subscribers.pop(post_id, None)
+            if not self.subscribers and self.listener is not None:
+                self.listener.cancel()
+                self.listener = None
+
+    async def close(self) -> None:
+        """Stop listening to Redis."""
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.cancel()
+            try:
+                await listener
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+comment_events = CommentEvents(
+    config.STREAM_QUEUE_SIZE, config.STREAM_SUBSCRIBE_TIMEOUT
+)
@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Optional
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Table, select
+from sqlalchemy.orm import sessionmaker
+
+import config
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _serialize(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+async def _stream_rows(session_maker: sessionmaker, stmt, columns, fmt: str
+                       ) -> AsyncIterator[str]:
+    """Read rows through a server-side cursor and yield them chunk by chunk."""
+    async with session_maker() as session:
+        result = await session.stream(
+            stmt.execution_options(yield_per=config.EXPORT_CHUNK_SIZE)
+        )
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()
+
+        async for rows in result.partitions():
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows([_serialize(value) for value in row] for row in rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(dict(zip(columns, map(_serialize, row)))) + "\n"
+                    for row in rows
+                )
+
+
+def export_response(
+        session_maker: sessionmaker,
+        table: Table,
+        fmt: str,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        friendly: Optional[bool] = None,
+) -> StreamingResponse:
+    """
+    Stream every row of ``table`` created between two dates (inclusive)
+    as NDJSON or CSV, keeping memory flat regardless of the table size.
+    """
+    stmt = select(table).order_by(table.c.id)
+    if date_from is not None:
+        stmt = stmt.where(table.c.created_at >= datetime.combine(date_from, time.min))
+    if date_to is not None:
+        stmt = stmt.where(
+            table.c.created_at < datetime.combine(date_to + timedelta(days=1), time.min)
+        )
+    if friendly is not None:
+        stmt = stmt.where(table.c.friendly == friendly)
+
+    return StreamingResponse(
+        _stream_rows(session_maker, stmt, table.c.keys(), fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={
+            "Content-Disposition": f'attachment; filename="{table.name}s.{fmt}"'
+        },
+    )
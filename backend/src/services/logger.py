@@ -1,6 +1,150 @@
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Dict, Optional
+
+import config
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Id of the request or Celery task being handled, attached to every record
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+_TRACEBACKS = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _formatter() -> logging.Formatter:
+    if config.LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+class _Dispatcher(logging.Handler):
+    """
+    Handler of the listener thread: writes every record to the console and
+    to the file of the logger that made it.
+    """
+
+    def __init__(self, files: Dict[str, RotatingFileHandler],
+                 routes: Dict[str, str]):
+        super().__init__()
+        self.console = logging.StreamHandler()
+        self.console.setFormatter(_formatter())
+        self.files = files
+        self.routes = routes
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.console.handle(record)
+        path = self.routes.get(record.name)
+        if path is not None:
+            self.files[path].handle(record)
+
+
+class LogPipeline:
+    """
+    Queue between the loggers and the handlers doing the actual I/O.
+
+    Logging calls only put the record on a queue; one listener thread per
+    process formats it and writes it to the console and the rotating files,
+    so neither file I/O nor rotation runs on the event loop. The listener
+    starts with the first record of a process, forked workers included.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, RotatingFileHandler] = {}
+        self.routes: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.queue: Optional[queue.SimpleQueue] = None
+        self.listener: Optional[QueueListener] = None
+        self.pid: Optional[int] = None
+
+    def add_file(self, name: str, path: Path) -> None:
+        """Send the records of the logger ``name`` to the file at ``path``."""
+        key = str(path.resolve())
+        with self.lock:
+            if key not in self.files:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                handler = RotatingFileHandler(
+                    path, maxBytes=5 * 1024 * 1024, backupCount=5, delay=True
+                )
+                handler.setFormatter(_formatter())
+                self.files[key] = handler
+            self.routes[name] = key
+
+    def start(self) -> None:
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # A forked child inherits the queue but not the listener thread
+            self.queue = queue.SimpleQueue()
+            self.listener = QueueListener(
+                self.queue, _Dispatcher(self.files, self.routes)
+            )
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def stop(self) -> None:
+        """Write the queued records and stop the listener of this process."""
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.listener.stop()
+            self.pid = None
+        for handler in self.files.values():
+            handler.close()
+
+    def put_nowait(self, record: logging.LogRecord) -> None:
+        if self.pid != os.getpid():
+            self.start()
+        self.queue.put_nowait(record)
+
+
+pipeline = LogPipeline()
+atexit.register(pipeline.stop)
+
+
+class RequestIdHandler(QueueHandler):
+    """Queue handler stamping records with the current request id."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve everything tied to the calling thread before queueing,
+        # but keep the message and the traceback apart for the JSON output
+        record = copy.copy(record)
+        record.request_id = request_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _TRACEBACKS.formatException(record.exc_info)
+        record.exc_info = None
+        return record
 
 
 class Logger:
@@ -8,30 +152,53 @@ class Logger:
                  log_to_file: bool = False, log_dir: str = 'logs',
                  filename: str = 'app.log'):
         """
-        :param name:
-        :param level:
-        :param log_to_file:
+        :param name: logger name, usually the module name
+        :param level: minimum level of the records kept
+        :param log_to_file: also write the records to ``log_dir/filename``
         :param log_dir:
         :param filename:
+
+        Creating a Logger twice for one name doesn't add handlers again.
         """
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
-        self.formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(self.formatter)
-        self.logger.addHandler(console_handler)
 
+        if not any(isinstance(h, RequestIdHandler) for h in self.logger.handlers):
+            self.logger.addHandler(RequestIdHandler(pipeline))
         if log_to_file:
-            Path(log_dir).mkdir(parents=True, exist_ok=True)
-            file_path = Path(log_dir) / filename
-            file_handler = RotatingFileHandler(
-                file_path, maxBytes=5 * 1024 * 1024, backupCount=5
-            )
-            file_handler.setFormatter(self.formatter)
-            self.logger.addHandler(file_handler)
+            pipeline.add_file(name, Path(log_dir) / filename)
 
     def get_logger(self):
         return self.logger
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware binding the X-Request-ID header, or a new id, to the
+    records logged while handling the request and echoing it in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        value = dict(scope["headers"]).get(header, b"").decode("latin-1")[:64]
+        current = value or uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (header, current.encode("latin-1"))
+                ]
+            await send(message)
+
+        token = request_id.set(current)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
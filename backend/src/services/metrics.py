@@ -0,0 +1,245 @@
+import functools
+import os
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import QueuePool
+from starlette.routing import Mount
+
+import config
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request, by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being handled",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["engine"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing a query, by statement type",
+    ["engine", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "Queries executed while handling a request, by route template",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "Time spent waiting for the LLM API, by call and outcome",
+    ["operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+CELERY_TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Time spent running a task, by task name and final state",
+    ["task", "state"],
+    buckets=LATENCY_BUCKETS,
+)
+CELERY_TASK_QUEUE_LAG = Histogram(
+    "celery_task_queue_lag_seconds",
+    "Time a task waited in the queue after it was due",
+    ["task"],
+    buckets=LATENCY_BUCKETS,
+)
+CELERY_TASKS = Counter(
+    "celery_tasks",
+    "Tasks finished, by task name and final state",
+    ["task", "state"],
+)
+
+SQL_OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# Queries executed by the request being handled, None outside of requests
+_request_queries: ContextVar[Optional[list]] = ContextVar(
+    "request_queries", default=None
+)
+
+
+def observe_query(engine: str, statement: str, seconds: float) -> None:
+    """Record one query and count it for the current request."""
+    words = statement.lstrip().split(None, 1)
+    operation = words[0].upper() if words else ""
+    if operation not in SQL_OPERATIONS:
+        operation = "OTHER"
+    DB_QUERY_DURATION.labels(engine, operation).observe(seconds)
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+def timed_llm_call(operation: str):
+    """Decorate a coroutine calling the LLM API to record its duration."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                LLM_REQUEST_DURATION.labels(operation, outcome).observe(
+                    time.perf_counter() - started
+                )
+        return wrapper
+    return decorator
+
+
+# Path templates of the endpoints seen so far
+_templates: Dict[Callable, str] = {}
+
+
+def _route_templates(routes, prefix: str = ""):
+    """Yield the endpoint and the full path template of every route."""
+    for route in routes:
+        if isinstance(route, Mount):
+            yield route.app, prefix + route.path_format
+            yield from _route_templates(route.routes, prefix + route.path)
+        elif hasattr(route, "original_router"):
+            # Newer FastAPI keeps included routers instead of copying their routes
+            yield from _route_templates(
+                route.original_router.routes,
+                prefix + route.include_context.prefix,
+            )
+        elif getattr(route, "endpoint", None) is not None:
+            yield route.endpoint, prefix + route.path_format
+
+
+def route_template(scope) -> str:
+    """
+    The path template of the route that handled a request, or "unmatched"
+    when no route handled it.
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if endpoint not in _templates:
+        routes = getattr(scope.get("app"), "routes", ())
+        for route_endpoint, template in _route_templates(routes):
+            _templates.setdefault(route_endpoint, template)
+    return _templates.get(endpoint, "unmatched")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, in-progress count and number of
+    queries of every HTTP request, labelled by route template rather than
+    path so that ids don't multiply the series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        queries = [0]
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = _request_queries.set(queries)
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            _request_queries.reset(token)
+            route = route_template(scope)
+            HTTP_REQUEST_DURATION.labels(method, route, str(status)).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(queries[0])
+
+
+class PoolCollector:
+    """Reports the state of the connection pools of the registered engines."""
+
+    def __init__(self):
+        self.engines: Dict[str, AsyncEngine] = {}
+
+    def register(self, name: str, engine: AsyncEngine) -> None:
+        self.engines[name] = engine
+
+    def collect(self):
+        size = GaugeMetricFamily(
+            "db_pool_size", "Connections the pool keeps open", labels=["engine"]
+        )
+        checked_out = GaugeMetricFamily(
+            "db_pool_checked_out", "Connections in use", labels=["engine"]
+        )
+        overflow = GaugeMetricFamily(
+            "db_pool_overflow", "Connections open beyond the pool size",
+            labels=["engine"],
+        )
+        for name, engine in self.engines.items():
+            # The pool is looked up every time, engine.dispose() replaces it
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            overflow.add_metric([name], max(pool.overflow(), 0))
+        yield size
+        yield checked_out
+        yield overflow
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+def mark_process_dead() -> None:
+    """Drop the live gauges of an exiting process in multiprocess mode."""
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def metrics_response() -> Response:
+    """
+    Render the metrics in the Prometheus text format.
+
+    With PROMETHEUS_MULTIPROC_DIR set, every uvicorn and Celery process
+    sharing the directory writes its metrics there and they are aggregated
+    here, next to the pools of this process.
+    """
+    registry = REGISTRY
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(pool_collector)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,130 @@
+import hashlib
+import logging
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import config
+from services.cache import TwoTierCache
+from services.logger import Logger
+from services.moderation_backends import (
+    ModerationBackend, OpenAIBackend, create_moderation_backend,
+)
+from services.prefilter import Prefilter, create_prefilter
+
+MODERATION_PENDING = "pending"
+MODERATION_DONE = "done"
+MODERATION_FAILED = "failed"
+
+logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger',
+                filename='moderation.log').get_logger()
+
+
+def normalize_text(text: str) -> str:
+    """Fold case and collapse whitespace so trivially different texts match."""
+    return " ".join(text.casefold().split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode()).hexdigest()
+
+
+class VerdictCache(TwoTierCache):
+    """
+    Moderation verdicts keyed by the backend and the hash of the normalized text.
+    """
+    prefix = "navi:verdict:"
+
+    async def get(self, backend: str, text: str) -> Optional[bool]:
+        return await super().get(f"{backend}:{text_hash(text)}")
+
+    async def set(self, backend: str, text: str, verdict: bool) -> None:
+        await super().set(f"{backend}:{text_hash(text)}", verdict)
+
+
+class Moderator:
+    """
+    Moderation pipeline shared by the routers and the worker.
+
+    Texts go through the local pre-filter first, then the verdict cache, and
+    only what neither can decide is sent to the moderation backend, the LLM by
+    default. ``decisions`` counts the texts decided by every stage and
+    ``backend_decisions`` those of every backend. Only verdicts of the primary
+    backend are cached, so an outage does not leave fallback verdicts behind.
+    """
+
+    def __init__(self, cache: VerdictCache, prefilter: Optional[Prefilter] = None,
+                 backend: Optional[ModerationBackend] = None):
+        self.cache = cache
+        self.prefilter = prefilter
+        self.backend = backend or OpenAIBackend()
+        self.decisions = Counter()
+        self.backend_decisions = Counter()
+
+    def _prefiltered(self, text: str) -> Optional[bool]:
+        if self.prefilter is None:
+            return None
+        verdict = self.prefilter.classify(text)
+        if verdict is not None:
+            self.decisions["prefilter_friendly" if verdict else "prefilter_toxic"] += 1
+        return verdict
+
+    async def _cached(self, text: str) -> Optional[bool]:
+        verdict = self._prefiltered(text)
+        if verdict is None:
+            verdict = await self.cache.get(self.backend.primary_name, text)
+            if verdict is not None:
+                self.decisions["cache"] += 1
+        return verdict
+
+    async def _moderate(self, texts: List[str]) -> Tuple[str, List[bool]]:
+        backend, verdicts = await self.backend.moderate(texts)
+        if backend == self.backend.primary_name:
+            for text, verdict in zip(texts, verdicts):
+                await self.cache.set(backend, text, verdict)
+        return backend, verdicts
+
+    async def check_text(self, text: str) -> bool:
+        """Check if the text is friendly, asking the backend only as a last resort."""
+        verdict = await self._cached(text)
+        if verdict is None:
+            backend, [verdict] = await self._moderate([text])
+            self.backend_decisions[backend] += 1
+        return verdict
+
+    async def check_texts(self, texts: List[str]) -> List[bool]:
+        """Check several texts, sending the undecided ones to the backend at once."""
+        verdicts = [await self._cached(text) for text in texts]
+        missing = {}
+        for text, verdict in zip(texts, verdicts):
+            if verdict is None:
+                missing.setdefault(text_hash(text), text)
+        if missing:
+            backend, results = await self._moderate(list(missing.values()))
+            checked = dict(zip(missing, results))
+            self.backend_decisions[backend] += verdicts.count(None)
+            verdicts = [
+                checked[text_hash(text)] if verdict is None else verdict
+                for text, verdict in zip(texts, verdicts)
+            ]
+        return verdicts
+
+    def stats(self) -> dict:
+        decisions = {
+            source: self.decisions[source]
+            for source in ("prefilter_friendly", "prefilter_toxic", "cache")
+        }
+        checked = sum(self.backend_decisions.values())
+        total = sum(decisions.values()) + checked
+        return {
+            "backend": self.backend.name,
+            **decisions,
+            "backends": dict(self.backend_decisions),
+            "backend_saved_rate": (total - checked) / total if total else 0.0,
+        }
+
+
+moderator = Moderator(
+    VerdictCache(config.MODERATION_CACHE_SIZE, config.MODERATION_CACHE_TTL),
+    create_prefilter(),
+    create_moderation_backend(),
+)
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+import config
+from services.logger import Logger
+from services.openai import OpenAI
+from services.prefilter import BLOCKED_WORDS, WordMatcher
+
+logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger',
+                filename='moderation.log').get_logger()
+
+
+class ModerationBackend(ABC):
+    """Classifier telling whether texts are friendly (True) or not (False)."""
+    name = "base"
+
+    @abstractmethod
+    async def check_text(self, text: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def check_texts(self, texts: List[str]) -> List[bool]:
+        ...
+
+    @property
+    def primary_name(self) -> str:
+        """The backend giving the verdicts when nothing fails."""
+        return self.name
+
+    async def moderate(self, texts: List[str]) -> Tuple[str, List[bool]]:
+        """Check texts; returns the name of the backend that gave the verdicts too."""
+        if len(texts) == 1:
+            return self.name, [await self.check_text(texts[0])]
+        return self.name, await self.check_texts(texts)
+
+
+class OpenAIBackend(ModerationBackend):
+    """Remote LLM moderation through the chat completions API."""
+    name = "openai"
+
+    async def check_text(self, text: str) -> bool:
+        return await OpenAI().check_text(text)
+
+    async def check_texts(self, texts: List[str]) -> List[bool]:
+        return await OpenAI().check_texts(texts)
+
+
+class LocalModelBackend(ModerationBackend):
+    """
+    CPU-only classifier loaded once per process, e.g. a scikit-learn pipeline
+    of a vectorizer and a linear model saved with joblib. The model must
+    predict 1 for friendly and 0 for toxic texts.
+    """
+    name = "local"
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def load(cls, path: Optional[str]) -> "LocalModelBackend":
+        if not path:
+            raise RuntimeError("MODERATION_MODEL_PATH is required by the local backend")
+        try:
+            import joblib
+        except ImportError:
+            raise RuntimeError("The local moderation backend requires joblib "
+                               "and scikit-learn to be installed")
+        return cls(joblib.load(path))
+
+    async def check_text(self, text: str) -> bool:
+        return (await self.check_texts([text]))[0]
+
+    async def check_texts(self, texts: List[str]) -> List[bool]:
+        # Inference is CPU-bound, keep it off the event loop
+        labels = await asyncio.to_thread(self.model.predict, texts)
+        return [str(label) == "1" for label in labels]
+
+
+class StubBackend(ModerationBackend):
+    """
+    Deterministic backend for tests and load testing: texts with a blocked
+    word are toxic, every call takes ``latency`` seconds.
+    """
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.matcher = WordMatcher(BLOCKED_WORDS)
+
+    async def check_text(self, text: str) -> bool:
+        return (await self.check_texts([text]))[0]
+
+    async def check_texts(self, texts: List[str]) -> List[bool]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [not self.matcher.search(text.casefold()) for text in texts]
+
+
+class FallbackBackend(ModerationBackend):
+    """Use ``primary`` and switch to ``fallback`` for calls where it fails."""
+
+    def __init__(self, primary: ModerationBackend, fallback: ModerationBackend):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+        self.fallbacks = 0
+
+    @property
+    def primary_name(self) -> str:
+        return self.primary.primary_name
+
+    async def check_text(self, text: str) -> bool:
+        return (await self.moderate([text]))[1][0]
+
+    async def check_texts(self, texts: List[str]) -> List[bool]:
+        return (await self.moderate(texts))[1]
+
+    async def moderate(self, texts: List[str]) -> Tuple[str, List[bool]]:
+        try:
+            return await self.primary.moderate(texts)
+        except Exception as e:
+            self.fallbacks += 1
+            logger.warning(f"{self.primary.name} moderation failed, "
+                           f"using {self.fallback.name}: {e!r}")
+            return await self.fallback.moderate(texts)
+
+
+def create_backend(name: str) -> ModerationBackend:
+    if name == "openai":
+        return OpenAIBackend()
+    if name == "local":
+        return LocalModelBackend.load(config.MODERATION_MODEL_PATH)
+    if name == "stub":
+        return StubBackend(config.MODERATION_STUB_LATENCY_MS / 1000)
+    raise ValueError(f"Unknown moderation backend: {name}")
+
+
+def create_moderation_backend() -> ModerationBackend:
+    """The backend chosen by MODERATION_BACKEND, behind MODERATION_FALLBACK if set."""
+    backend = create_backend(config.MODERATION_BACKEND)
+    if config.MODERATION_FALLBACK:
+        backend = FallbackBackend(backend, create_backend(config.MODERATION_FALLBACK))
+    return backend
@@ -1,47 +1,138 @@
-import openai
+import asyncio
+import json
+import re
+from typing import List, Optional
+
+import aiohttp
+
 import config
+from services.metrics import timed_llm_call
 
 
 class OpenAI:
+    """
+    Asynchronous client for the OpenAI chat completions API.
+
+    Every instance shares one pooled HTTP session per event loop, so creating
+    an ``OpenAI()`` per request is cheap. The number of in-flight requests is
+    bounded by ``OPENAI_MAX_CONCURRENCY`` and every call has its own timeout.
+    """
+    _session: Optional[aiohttp.ClientSession] = None
+    _semaphore: Optional[asyncio.Semaphore] = None
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+
     def __init__(self):
         self.api_token = config.OPENAI_API_KEY
-        openai.api_key = self.api_token
+        self.api_base = config.OPENAI_API_BASE.rstrip("/")
+        self.model = config.OPENAI_MODEL
+
+    @classmethod
+    def _get_session(cls) -> aiohttp.ClientSession:
+        """Return the shared session, creating it for the running loop if needed."""
+        loop = asyncio.get_running_loop()
+        if cls._session is None or cls._session.closed or cls._loop is not loop:
+            cls._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=config.OPENAI_MAX_CONCURRENCY,
+                    keepalive_timeout=60,
+                ),
+            )
+            cls._semaphore = asyncio.Semaphore(config.OPENAI_MAX_CONCURRENCY)
+            cls._loop = loop
+        return cls._session
+
+    @classmethod
+    async def close(cls) -> None:
+        """Close the shared session of the running loop."""
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+        cls._semaphore = None
+        cls._loop = None
+
+    async def _complete(self, prompt: str, max_tokens: int,
+                        timeout: Optional[float] = None) -> str:
+        """Send a single-message chat completion and return the reply text."""
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.post(
+                f"{self.api_base}/chat/completions",
+                json={
+                    "model": self.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "max_tokens": max_tokens,
+                },
+                headers={"Authorization": f"Bearer {self.api_token}"},
+                timeout=aiohttp.ClientTimeout(total=timeout or config.OPENAI_TIMEOUT),
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+        return data['choices'][0]['message']['content']
 
+    @timed_llm_call("check_text")
     async def check_text(self, text: str) -> bool:
         """Check if the text is friendly or not."""
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""
-                            If this text can offend, hurt or contains at least one swear word or a spam, then return 0, 
+        result = await self._complete(
+            f"""
+                            If this text can offend, hurt or contains at least one swear word or a spam, then return 0,
                             if the text is friendly, then return 1.
                             The text : "{text}"
-                        """  # noqa
-                },
-            ],
-            max_tokens=5
+                        """,  # noqa
+            max_tokens=5,
         )
-        result = response['choices'][0]['message']['content']
-        if result == "1":
+        if result.strip() == "1":
             return True
         return False
 
+    @timed_llm_call("check_texts")
+    async def check_texts(self, texts: List[str]) -> List[bool]:
+        """
+        Check several texts with a single request.
+
+        Falls back to one ``check_text`` call per text when the answer
+        can't be mapped back to the texts.
+        """
+        if len(texts) <= 1:
+            return [await self.check_text(text) for text in texts]
+
+        numbered = "\n".join(
+            f"{number}. {json.dumps(text)}" for number, text in enumerate(texts, 1)
+        )
+        result = await self._complete(
+            f"""
+                            For every numbered text below return 0 if it can offend, hurt or contains at least one swear word or a spam, or 1 if it is friendly.
+                            Answer only with a JSON array of {len(texts)} numbers in the same order.
+{numbered}
+                        """,  # noqa
+            max_tokens=4 * len(texts) + 10,
+        )
+        verdicts = self._parse_verdicts(result, len(texts))
+        if verdicts is None:
+            return list(await asyncio.gather(*(self.check_text(t) for t in texts)))
+        return verdicts
+
+    @staticmethod
+    def _parse_verdicts(result: str, count: int) -> Optional[List[bool]]:
+        """Map a batch answer to verdicts, or return None if it is malformed."""
+        match = re.search(r"\[[^\[\]]*\]", result)
+        if match is None:
+            return None
+        try:
+            values = json.loads(match.group(0))
+        except ValueError:
+            return None
+        if len(values) != count or any(str(v) not in ("0", "1") for v in values):
+            return None
+        return [str(v) == "1" for v in values]
+
+    @timed_llm_call("reply_to_comment")
     async def reply_to_comment(self, content: str, comment: str) -> str:
         """Reply to a comment by AI."""
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""
-                                            This is a post: "{content}", this is a user comment: "{comment}". 
+        result = await self._complete(
+            f"""
+                                            This is a post: "{content}", this is a user comment: "{comment}".
                                             You have to reply as a author of the post to the comment with a friendly message. Maximum 15 words.
-                                        """  # noqa
-                },
-            ],
-            max_tokens=120
+                                        """,  # noqa
+            max_tokens=120,
         )
-        result = response['choices'][0]['message']['content']
         return result
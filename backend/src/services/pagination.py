@@ -0,0 +1,100 @@
+import base64
+import binascii
+import json
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import Column
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+import config
+from services.cache import response_cache
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(value: Any) -> str:
+    """Encode the last seen sort key as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class Page:
+    """
+    Keyset pagination parameters.
+
+    The cursor holds the id of the last row sent; subclasses paginating on
+    another sort key override ``parse``. Cursors that don't hold a valid key
+    are rejected with 400. The page size is capped at PAGE_SIZE_MAX no matter
+    what the client asks for.
+    """
+
+    def __init__(
+            self,
+            cursor: Optional[str] = Query(
+                None, description="X-Next-Cursor header of the previous page"
+            ),
+            limit: int = Query(
+                config.PAGE_SIZE_DEFAULT, ge=1, description="Number of items per page"
+            ),
+    ):
+        self.after = self.parse(decode_cursor(cursor)) if cursor else None
+        self.limit = min(limit, config.PAGE_SIZE_MAX)
+
+    @staticmethod
+    def parse(after: Any) -> Any:
+        """Check the decoded sort key of a cursor."""
+        if isinstance(after, bool) or not isinstance(after, int) or after < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return after
+
+    @property
+    def key(self) -> str:
+        """Identify the page in cache keys."""
+        return f"{self.after}:{self.limit}"
+
+
+async def paginate(
+        session: AsyncSession,
+        stmt: Select,
+        column: Column,
+        page: Page,
+        response: Response,
+        cache_as: Optional[Tuple[str, str]] = None,
+) -> List:
+    """
+    Fetch one page of ``stmt`` ordered by the unique ``column``.
+
+    Only the rows after the cursor are read, so every page costs the same.
+    When more rows follow, their cursor is sent in the X-Next-Cursor header.
+    With ``cache_as`` set to a ``(namespace, key)`` pair, the page is served
+    through the response cache.
+    """
+    async def fetch():
+        query = stmt
+        if page.after is not None:
+            query = query.where(column > page.after)
+        result = await session.execute(query.order_by(column).limit(page.limit + 1))
+        rows = result.mappings().all()
+        if len(rows) > page.limit:
+            rows = rows[:page.limit]
+            return {"rows": rows, "next": encode_cursor(rows[-1][column.name])}
+        return {"rows": rows, "next": None}
+
+    if cache_as is None:
+        fetched = await fetch()
+    else:
+        namespace, key = cache_as
+        fetched = await response_cache.get_or_load(
+            namespace, f"{key}:{page.key}", fetch
+        )
+    if fetched["next"] is not None:
+        response.headers[NEXT_CURSOR_HEADER] = fetched["next"]
+    return fetched["rows"]
@@ -0,0 +1,125 @@
+import re
+from collections import deque
+from typing import Iterable, List, Optional, Tuple
+
+import config
+
+# Words and phrases that make a text unfriendly; a trailing * also matches
+# every word starting with the entry, e.g. "fuck*" matches "fucking"
+BLOCKED_WORDS = (
+    "fuck*", "motherfuck*", "shit*", "bullshit*", "bitch*", "asshole*", "cunt*",
+    "dickhead*", "bastard*", "whore*", "slut*", "retard*", "faggot*", "nigger*",
+    "kill yourself", "kys",
+)
+
+# Texts that are fine whatever their context, compared without punctuation
+ALLOWED_TEXTS = frozenset((
+    "thanks", "thank you", "thanks a lot", "thank you very much", "thx", "ty",
+    "nice", "nice post", "great", "great post", "cool", "awesome", "amazing",
+    "love it", "well done", "agreed", "i agree", "+1", "ok", "okay", "yes", "no",
+    "good job", "congrats", "congratulations", "interesting",
+))
+
+URL_RE = re.compile(r"(?:https?://|www\.)\S+")
+
+
+class WordMatcher:
+    """
+    Aho-Corasick automaton finding any listed word or phrase in one pass over
+    the text. Matches must start and, unless the entry ends with *, end on a
+    word boundary, so "ass" would not match "class".
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output: List[List[Tuple[int, bool]]] = [[]]
+        for word in words:
+            prefix = word.endswith("*")
+            word = word.rstrip("*").casefold()
+            state = 0
+            for char in word:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = self.goto[state][char]
+            self.output[state].append((len(word), prefix))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text: str) -> bool:
+        """Tell whether the casefolded ``text`` contains a listed word."""
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, prefix in self.output[state]:
+                start = end - length
+                if start and text[start - 1].isalnum():
+                    continue
+                if prefix or end == len(text) or not text[end].isalnum():
+                    return True
+        return False
+
+
+class Prefilter:
+    """
+    Local moderation of the obvious cases: listed swear words and link spam
+    are unfriendly, trivial and emoji-only texts are friendly. Everything
+    else is left to the LLM.
+    """
+
+    def __init__(self, words: Iterable[str], allowed: Iterable[str], max_links: int):
+        self.matcher = WordMatcher(words)
+        self.allowed = frozenset(allowed)
+        self.max_links = max_links
+
+    def classify(self, text: str) -> Optional[bool]:
+        """Return the verdict when it is certain, None to ask the LLM."""
+        text = " ".join(text.casefold().split())
+        if self.matcher.search(text):
+            return False
+
+        links = URL_RE.findall(text)
+        if links:
+            if len(links) >= self.max_links or len(set(links)) < len(links):
+                return False
+            return None
+
+        words = "".join(char for char in text if char.isalnum() or char in " +")
+        if " ".join(words.split()) in self.allowed:
+            return True
+        # Only emoji, punctuation or nothing at all
+        if not any(char.isalnum() for char in text):
+            return True
+        return None
+
+
+def load_words(path: Optional[str]) -> Tuple[str, ...]:
+    """Built-in blocked words plus the ones listed one per line in ``path``."""
+    if not path:
+        return BLOCKED_WORDS
+    with open(path, encoding="utf-8") as wordlist:
+        extra = (line.strip() for line in wordlist)
+        return BLOCKED_WORDS + tuple(word for word in extra if word)
+
+
+def create_prefilter() -> Optional[Prefilter]:
+    if not config.PREFILTER_ENABLED:
+        return None
+    return Prefilter(
+        load_words(config.PREFILTER_WORDLIST), ALLOWED_TEXTS, config.PREFILTER_MAX_LINKS
+    )
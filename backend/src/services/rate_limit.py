@@ -0,0 +1,127 @@
+import logging
+import math
+import time
+from typing import Optional, Tuple
+
+from fastapi import Depends, HTTPException
+
+import config
+from auth.base_config import current_user
+from auth.models import User
+from services.cache import LocalCache
+from services.logger import Logger
+from services.redis import get_redis
+
+logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger',
+                filename='rate_limit.log').get_logger()
+
+# Refills the bucket, takes `cost` tokens if there are enough and returns
+# {allowed, seconds until enough tokens} in a single round-trip
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(retry_after)}
+"""
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets kept in Redis, shared by every worker, or in this process
+    when Redis is not configured or not reachable.
+    """
+    prefix = "navi:rate:"
+
+    def __init__(self, maxsize: int = 100000):
+        self.local = LocalCache(maxsize, ttl=60)
+        self._script = None
+        self._script_client = None
+
+    def _take_local(self, key: str, rate: float, burst: int,
+                    cost: int) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated_at = self.local.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self.local.set(key, (tokens, now), ttl=burst / rate)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    async def take(self, key: str, rate: float, burst: int,
+                   cost: int = 1) -> Tuple[bool, float]:
+        """
+        Take ``cost`` tokens from the bucket refilled with ``rate`` tokens per
+        second up to ``burst``. Returns whether it was allowed and, if not,
+        the seconds until it would be.
+        """
+        redis = get_redis()
+        if redis is None:
+            return self._take_local(key, rate, burst, cost)
+        if self._script_client is not redis:
+            self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+            self._script_client = redis
+        try:
+            allowed, retry_after = await self._script(
+                keys=[self.prefix + key], args=[rate, burst, cost]
+            )
+        except Exception as e:
+            logger.warning(f"Rate limit Redis call failed: {e}")
+            return self._take_local(key, rate, burst, cost)
+        return bool(allowed), float(retry_after)
+
+
+limiter = TokenBucketLimiter()
+
+
+class RateLimit:
+    """
+    Dependency limiting how often a user may call the endpoints of ``scope``,
+    as configured in RATE_LIMITS. Answers 429 with Retry-After when exceeded.
+    """
+
+    def __init__(self, scope: str, cost: int = 1):
+        self.scope = scope
+        self.cost = cost
+
+    @property
+    def burst(self) -> Optional[int]:
+        """Most requests the scope allows at once, None when it is not limited."""
+        limit = config.RATE_LIMITS.get(self.scope)
+        return limit[0] if limit else None
+
+    async def __call__(self, user: User = Depends(current_user)) -> None:
+        await self.take(user, self.cost)
+
+    async def take(self, user: User, cost: int) -> None:
+        """Charge ``cost`` requests of the scope to ``user``, raising 429 if denied."""
+        limit = config.RATE_LIMITS.get(self.scope)
+        if limit is None or (user.is_superuser and config.RATE_LIMIT_EXEMPT_SUPERUSERS):
+            return
+        burst, period = limit
+        allowed, retry_after = await limiter.take(
+            f"{self.scope}:{user.id}", burst / period, burst, cost
+        )
+        if not allowed:
+            logger.info(f"Rate limit of {self.scope} exceeded by user {user.id}")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Optional
+
+import redis
+from redis import asyncio as aioredis
+
+import config
+
+_client: Optional[aioredis.Redis] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> Optional[aioredis.Redis]:
+    """
+    Return the Redis client bound to the running event loop,
+    or None when REDIS_URL is not configured.
+    """
+    global _client, _loop
+    if not config.REDIS_URL:
+        return None
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop:
+        _client = aioredis.from_url(config.REDIS_URL)
+        _loop = loop
+    return _client
+
+
+async def close_redis() -> None:
+    """Close the Redis client of the running event loop."""
+    global _client, _loop
+    if _client is not None:
+        await _client.close()
+    _client = None
+    _loop = None
+
+
+def get_sync_redis() -> Optional[redis.Redis]:
+    """
+    Return the blocking Redis client used outside of the event loop,
+    or None when REDIS_URL is not configured.
+    """
+    global _sync_client
+    if not config.REDIS_URL:
+        return None
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(config.REDIS_URL)
+    return _sync_client
@@ -1,21 +1,36 @@
 import asyncio
-from typing import AsyncGenerator
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncGenerator, Awaitable, Callable
 
 import pytest
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 
-from database import get_async_session, metadata
+import config
+from comments.models import AutoReply, Comment
+from database import (
+    create_engine,
+    get_async_session,
+    get_async_session_maker,
+    metadata,
+)
 from config import TEST_DATABASE_URL
 from main import app
+from posts.models import Post
+from services.cache import response_cache
 
 # DATABASE
 DATABASE_URL_TEST = TEST_DATABASE_URL
 
-engine_test = create_async_engine(DATABASE_URL_TEST, poolclass=NullPool)
+engine_test = create_engine("test", DATABASE_URL_TEST, poolclass=NullPool)
 async_session_maker = sessionmaker(
     engine_test, class_=AsyncSession, expire_on_commit=False
 )
@@ -28,6 +43,7 @@ async def override_get_async_session() -> AsyncGenerator[AsyncSession, None]:
 
 
 app.dependency_overrides[get_async_session] = override_get_async_session
+app.dependency_overrides[get_async_session_maker] = lambda: async_session_maker
 
 
 @pytest.fixture(autouse=True, scope='session')
@@ -40,6 +56,85 @@ async def prepare_database():
         await conn.run_sync(metadata.drop_all)
 
 
+# LLM
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Chat completions endpoint that judges texts by a tiny swear word list."""
+    swear_words = ("fuck", "shit", "bitch")
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            prompt = body["messages"][-1]["content"]
+            answer = server.reply
+            match = re.search(r'The text : "(.*)"', prompt, re.S)
+            batch = re.findall(r'^\d+\. (".*")$', prompt, re.M)
+            if match:
+                answer = self.judge(match.group(1))
+            elif batch:
+                server.batches += 1
+                answer = server.batch_reply or json.dumps(
+                    [int(self.judge(json.loads(text))) for text in batch]
+                )
+            payload = json.dumps(
+                {"choices": [{"message": {"role": "assistant", "content": answer}}]}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def judge(self, text: str) -> str:
+        return "0" if any(w in text.lower() for w in self.swear_words) else "1"
+
+    def log_message(self, *args):
+        pass
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubLLMHandler)
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def reset(self):
+        self.delay = 0.0
+        self.reply = "Thank you for your comment!"
+        self.batch_reply = None
+        self.batches = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+@pytest.fixture(autouse=True, scope='session')
+def llm_stub():
+    """Serve the LLM API locally so the tests never call OpenAI."""
+    server = StubLLMServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    api_base = config.OPENAI_API_BASE
+    config.OPENAI_API_BASE = server.url
+    yield server
+    config.OPENAI_API_BASE = api_base
+    server.shutdown()
+
+
 # SETUP
 @pytest.fixture(scope='session')
 def event_loop(request):
@@ -71,3 +166,39 @@ async def ac() -> AsyncGenerator[AsyncClient, None]:
 async def ac_fake() -> AsyncGenerator[AsyncClient, None]:
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
+
+
+# POSTS
+@pytest.fixture
+async def create_post() -> AsyncGenerator[Callable[..., Awaitable[int]], None]:
+    """Insert posts of user 1; they are removed with their comments afterwards."""
+    post_ids = []
+
+    async def create(**values) -> int:
+        values = {"title": "Test", "content": "Test post", "user_id": 1,
+                  "friendly": True, **values}
+        async with async_session_maker() as session:
+            post = await session.execute(insert(Post).values(**values)
+                                         .returning(Post.c.id))
+            post_id = post.scalar()
+            await session.commit()
+        post_ids.append(post_id)
+        return post_id
+
+    yield create
+    async with async_session_maker() as session:
+        comment_ids = select(Comment.c.id).where(Comment.c.post_id.in_(post_ids))
+        await session.execute(delete(AutoReply).where(
+            AutoReply.c.comment_id.in_(comment_ids)
+        ))
+        await session.execute(delete(Comment).where(Comment.c.post_id.in_(post_ids)))
+        await session.execute(delete(Post).where(Post.c.id.in_(post_ids)))
+        await session.commit()
+    await response_cache.invalidate(
+        "posts", "comments", *(f"comments:post:{post_id}" for post_id in post_ids)
+    )
+
+
+@pytest.fixture
+async def post_id(create_post) -> int:
+    return await create_post()
@@ -1,7 +1,11 @@
-from sqlalchemy import insert, select
+import pytest
+from fastapi_users.exceptions import UserNotExists
+from httpx import AsyncClient
+from sqlalchemy import event, insert, select
 
-from auth.models import role
-from tests.conftest import client, async_session_maker
+from auth.models import User, role
+from auth.utils import CachedUserDatabase, user_cache
+from tests.conftest import client, async_session_maker, engine_test
 
 
 async def test_add_role():
@@ -61,3 +65,50 @@ def test_login_user():
     client.headers.update(
         {"Authorization": f"Bearer {response.json()['access_token']}"}
     )
+
+
+async def test_current_user_is_cached(ac: AsyncClient):
+    """Authenticated requests should not load the user once it is cached."""
+    await ac.get("/auth/users/me")
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine_test.sync_engine, "before_cursor_execute", record)
+    try:
+        response = await ac.get("/auth/users/me")
+    finally:
+        event.remove(engine_test.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert response.json()["username"] == "test@testc.com"
+    assert not [s for s in statements if 'FROM "user"' in s]
+    assert user_cache.stats()["hits"] >= 1
+
+
+async def test_updated_user_is_not_served_from_cache(ac: AsyncClient):
+    """Updating a user should drop it from the cache."""
+    await ac.get("/auth/users/me")
+
+    async def set_username(username):
+        async with async_session_maker() as session:
+            user_db = CachedUserDatabase(session, User)
+            user = await user_db.get_by_email("test@testc.com")
+            await user_db.update(user, {"username": username})
+
+    await set_username("renamed")
+    try:
+        response = await ac.get("/auth/users/me")
+        assert response.json()["username"] == "renamed"
+    finally:
+        await set_username("test@testc.com")
+    response = await ac.get("/auth/users/me")
+    assert response.json()["username"] == "test@testc.com"
+
+
+async def test_update_of_missing_user_raises():
+    """Updating a user that is no longer in the database should raise."""
+    async with async_session_maker() as session:
+        user_db = CachedUserDatabase(session, User)
+        with pytest.raises(UserNotExists):
+            await user_db.update(User(id=100000), {"username": "ghost"})
@@ -0,0 +1,115 @@
+import random
+
+import httpx
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from benchmarks.report import compare, percentile, summarize
+from benchmarks.run import ENDPOINTS, drive, plan
+from benchmarks.seed import seed
+from comments.models import Comment
+from database import create_engine, metadata
+from management.models import ALL_USERS, CommentCounter, CommentDailyStats
+from posts.models import Post
+
+
+def test_percentile_nearest_rank():
+    values = [0.1 * n for n in range(1, 101)]
+    assert percentile(values, 50) == pytest.approx(5.0)
+    assert percentile(values, 99) == pytest.approx(9.9)
+    assert percentile([0.2], 95) == 0.2
+    assert percentile([], 95) == 0.0
+
+
+def test_summarize_and_compare():
+    base = summarize({"GET /a": [0.01] * 9 + [0.1], "GET /b": [0.02]},
+                     {"GET /b": 1}, elapsed=2.0)
+    assert base["total"]["requests"] == 11
+    assert base["total"]["errors"] == 1
+    assert base["total"]["rate_limited"] == 0
+    assert base["endpoints"]["GET /a"]["throughput_rps"] == 5.0
+    assert base["endpoints"]["GET /a"]["p50_ms"] == 10.0
+    assert base["endpoints"]["GET /a"]["p99_ms"] == 100.0
+
+    new = summarize({"GET /a": [0.02] * 10}, {}, elapsed=2.0)
+    changes = compare(base, new)
+    assert set(changes) == {"total", "GET /a"}
+    assert changes["GET /a"]["p50_ms"] == 1.0
+    assert changes["GET /a"]["throughput_rps"] == 0.0
+
+
+@pytest.fixture
+async def session_maker(tmp_path):
+    engine = create_engine("benchmark-test", f"sqlite+aiosqlite:///{tmp_path}/b.db",
+                           poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    yield sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+
+async def test_seed_builds_nested_threads(session_maker):
+    dataset = await seed(session_maker, users=3, posts=4, comments=15, depth=3)
+    assert len(dataset.user_ids) == 3
+    assert len(dataset.post_ids) == 4
+    assert len(dataset.comment_ids) == 60
+
+    async with session_maker() as session:
+        comments = (await session.execute(select(Comment))).fetchall()
+        posts = (await session.execute(select(func.count()).select_from(Post))).scalar()
+    assert posts == 4
+    by_id = {comment.id: comment for comment in comments}
+
+    def depth(comment):
+        return 0 if comment.parent_id is None else 1 + depth(by_id[comment.parent_id])
+
+    assert max(depth(comment) for comment in comments) <= 2
+    assert any(comment.parent_id is not None for comment in comments)
+    assert all(
+        by_id[c.parent_id].post_id == c.post_id for c in comments if c.parent_id
+    )
+
+    async with session_maker() as session:
+        counters = (await session.execute(select(CommentCounter))).fetchall()
+        daily = (await session.execute(select(
+            func.sum(CommentDailyStats.c.friendly + CommentDailyStats.c.unfriendly)
+        ))).scalar()
+    counters = {row.user_id: row.friendly + row.unfriendly for row in counters}
+    assert counters[ALL_USERS] == 60
+    assert sum(counters[user_id] for user_id in dataset.user_ids) == 60
+    assert daily == 60
+
+
+async def test_plan_is_reproducible(session_maker):
+    dataset = await seed(session_maker, users=2, posts=3, comments=2, depth=2)
+    first = plan(dataset, 50, read_only=False, rng=random.Random(1))
+    second = plan(dataset, 50, read_only=False, rng=random.Random(1))
+    assert [(e.name, user, call) for e, user, call in first] == [
+        (e.name, user, call) for e, user, call in second
+    ]
+    read_only = plan(dataset, 200, read_only=True, rng=random.Random(1))
+    assert not any(endpoint.write for endpoint, _, _ in read_only)
+
+
+async def test_drive_counts_rate_limits_and_transport_errors():
+    def handle(request):
+        if request.url.path == "/down":
+            raise httpx.ConnectError("Connection refused", request=request)
+        if request.url.path == "/limited":
+            return httpx.Response(429)
+        return httpx.Response(200, json={"status": 200})
+
+    calls = [
+        (endpoint, 0, ("GET", path, {}))
+        for endpoint, path in zip(ENDPOINTS, ["/ok", "/limited", "/down", "/ok"])
+    ]
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handle),
+                                 base_url="http://benchmark") as client:
+        latencies, errors, limited, _ = await drive(client, calls, [{}], 2)
+    names = [endpoint.name for endpoint in ENDPOINTS]
+    assert sorted(latencies) == sorted([names[0], names[1], names[3]])
+    assert errors == {names[2]: 1}
+    assert limited == {names[1]: 1}
@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from services.cache import ResponseCache, response_cache
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(maxsize=100, ttl=60)
+
+
+async def test_value_is_loaded_once(cache):
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return {"rows": [1, 2]}
+
+    assert await cache.get_or_load("posts", "all", loader) == {"rows": [1, 2]}
+    assert await cache.get_or_load("posts", "all", loader) == {"rows": [1, 2]}
+    assert len(loads) == 1
+    assert cache.stats()["hits"] == 1
+
+
+async def test_invalidate_drops_only_its_namespace(cache):
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return len(loads)
+
+    await cache.get_or_load("posts", "all", loader)
+    await cache.get_or_load("comments", "all", loader)
+    await cache.invalidate("posts")
+    assert await cache.get_or_load("posts", "all", loader) == 3
+    assert await cache.get_or_load("comments", "all", loader) == 2
+
+
+async def test_concurrent_misses_are_loaded_once(cache):
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    results = await asyncio.gather(
+        *(cache.get_or_load("posts", "all", loader) for _ in range(5))
+    )
+    assert results == ["value"] * 5
+    assert len(loads) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+async def test_failed_load_is_not_cached(cache):
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database is down")
+
+    async def loader():
+        return "value"
+
+    results = await asyncio.gather(
+        *(cache.get_or_load("posts", "all", failing) for _ in range(2)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert await cache.get_or_load("posts", "all", loader) == "value"
+
+
+class LockingRedis:
+    """The Redis commands of the response cache, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+
+    async def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token.encode():
+            del self.data[key]
+
+
+async def test_failed_load_does_not_stall_the_next_one(cache, monkeypatch):
+    redis = LockingRedis()
+    monkeypatch.setattr("services.cache.get_redis", lambda: redis)
+
+    async def failing():
+        raise RuntimeError("database is down")
+
+    async def loader():
+        return "value"
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("posts", "all", failing)
+    assert not any(key.endswith(":lock") for key in redis.data)
+
+    started = time.monotonic()
+    assert await cache.get_or_load("posts", "all", loader) == "value"
+    assert time.monotonic() - started < cache.lock_timeout / 2
+    assert not any(key.endswith(":lock") for key in redis.data)
+
+
+async def test_lock_taken_over_is_kept(cache, monkeypatch):
+    redis = LockingRedis()
+    monkeypatch.setattr("services.cache.get_redis", lambda: redis)
+    await redis.set("navi:response:posts:0:all:lock", "other")
+    monkeypatch.setattr(cache, "lock_timeout", 0.1)
+
+    async def loader():
+        return "value"
+
+    assert await cache.get_or_load("posts", "all", loader) == "value"
+    assert redis.data["navi:response:posts:0:all:lock"] == b"other"
+
+
+async def test_missing_post_is_not_found(ac: AsyncClient):
+    response = await ac.get("/posts/100000")
+    assert response.status_code == 404
+    assert response.json()["status"] == 404
+
+
+async def test_listing_is_invalidated_by_writes(ac: AsyncClient):
+    response = await ac.get("/comments/all_friendly")
+    before = response.json()
+    response = await ac.get("/comments/all_friendly")
+    assert response.json() == before
+
+    response = await ac.post("/comments/", json={
+        "content": "Fresh comment",
+        "post_id": 2,
+    })
+    assert response.status_code == 201
+    response = await ac.get("/comments/all_friendly")
+    assert "Fresh comment" in [c["content"] for c in response.json()]
+
+    response = await ac.get("/management/response_cache")
+    assert response.json()["data"]["hits"] >= 1
+
+
+@pytest.fixture
+async def post_ids(create_post):
+    return [await create_post(), await create_post()]
+
+
+async def test_comment_writes_keep_other_cached_lists(ac: AsyncClient, post_ids):
+    cached, other = post_ids
+    await ac.get(f"/comments/{cached}")
+
+    await ac.post("/comments/", json={"content": "Other post", "post_id": other})
+    await ac.post("/comments/", json={"content": "Ignored shit", "post_id": cached})
+    hits = response_cache.hits
+    await ac.get(f"/comments/{cached}")
+    assert response_cache.hits == hits + 1
+
+    await ac.post("/comments/", json={"content": "Same post", "post_id": cached})
+    response = await ac.get(f"/comments/{cached}")
+    assert [c["content"] for c in response.json()] == ["Same post"]
+    assert response_cache.hits == hits + 1
@@ -1,4 +1,22 @@
+import asyncio
+import csv
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
 from httpx import AsyncClient
+from sqlalchemy import event, insert
+
+import config
+from auth.base_config import current_streaming_user
+from comments.models import Comment
+from comments.utils import comment_stream
+from services.cache import response_cache
+from services.events import CommentEvents
+from services.pagination import NEXT_CURSOR_HEADER
+from tests.conftest import async_session_maker, engine_test
 
 
 class TestPublicUser:
@@ -43,6 +61,10 @@ class TestPublicUser:
         response = await ac_fake.delete("/comments/1")
         assert response.status_code == 401
 
+    async def test_export_comments(self, ac_fake: AsyncClient):
+        response = await ac_fake.get("/comments/export")
+        assert response.status_code == 401
+
 
 class TestAuthenticatedUser:
     async def test_get_all_comments(self, ac: AsyncClient):
@@ -76,3 +98,284 @@ class TestAuthenticatedUser:
         assert response.status_code == 200
         response = await ac.get("/comments/2")
         assert response.status_code == 200
+
+    async def test_export_comments_as_ndjson(self, ac: AsyncClient):
+        response = await ac.get("/comments/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert rows
+        assert [row["id"] for row in rows] == sorted(row["id"] for row in rows)
+
+    async def test_export_friendly_comments_as_csv(self, ac: AsyncClient):
+        response = await ac.get("/comments/export", params={
+            "format": "csv",
+            "friendly": True,
+            "date_from": datetime.utcnow().date().isoformat(),
+            "date_to": datetime.utcnow().date().isoformat(),
+        })
+        assert response.status_code == 200
+        rows = list(csv.DictReader(response.text.splitlines()))
+        assert rows
+        assert all(row["friendly"] == "True" for row in rows)
+
+
+class TestCommentThread:
+
+    @pytest.fixture
+    async def thread(self, create_post):
+        """A post with two friendly root comments and one toxic one."""
+        post_id = await create_post(title="Thread", content="Thread post")
+        async with async_session_maker() as session:
+
+            async def add(content, parent_id=None, friendly=True):
+                comment = await session.execute(insert(Comment).values(
+                    content=content, user_id=1, post_id=post_id,
+                    parent_id=parent_id, friendly=friendly,
+                ).returning(Comment.c.id))
+                return comment.scalar()
+
+            root = await add("root")
+            first = await add("first", root)
+            await add("second", root)
+            await add("third", root)
+            nested = await add("nested", first)
+            await add("deepest", nested)
+            await add("toxic", root, friendly=False)
+            await add("other root")
+            await add("toxic root", friendly=False)
+            await session.commit()
+        await response_cache.invalidate("posts", "comments", f"comments:post:{post_id}")
+        return post_id, first
+
+    async def test_thread_is_nested(self, ac: AsyncClient, thread):
+        post_id, _ = thread
+        response = await ac.get(f"/comments/{post_id}/thread", params={
+            "limit": 1, "replies": 2, "max_depth": 1,
+        })
+        assert response.status_code == 200
+        [root] = response.json()
+        assert root["content"] == "root"
+        assert root["has_more_replies"]
+        assert [r["content"] for r in root["replies"]] == ["first", "second"]
+        first, second = root["replies"]
+        assert first["replies"] == [] and first["has_more_replies"]
+        assert second["replies"] == [] and not second["has_more_replies"]
+
+        response = await ac.get(f"/comments/{post_id}/thread", params={
+            "limit": 1, "replies": 2, "max_depth": 2,
+        })
+        first = response.json()[0]["replies"][0]
+        [nested] = first["replies"]
+        assert nested["content"] == "nested"
+        assert nested["replies"] == [] and nested["has_more_replies"]
+        assert not first["has_more_replies"]
+
+        response = await ac.get(f"/comments/{post_id}/thread", params={
+            "limit": 1, "cursor": response.headers[NEXT_CURSOR_HEADER],
+        })
+        assert [c["content"] for c in response.json()] == ["other root"]
+        assert NEXT_CURSOR_HEADER not in response.headers
+
+    async def test_unchanged_comments_are_not_sent_again(
+            self, ac: AsyncClient, thread
+    ):
+        post_id, first = thread
+        for path in (f"/comments/{post_id}", f"/comments/{post_id}/thread"):
+            response = await ac.get(path)
+            etag = response.headers["ETag"]
+            response = await ac.get(path, headers={"If-None-Match": etag})
+            assert response.status_code == 304
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine_test.sync_engine, "before_cursor_execute", record)
+        try:
+            response = await ac.get(f"/comments/{post_id}/thread",
+                                    headers={"If-None-Match": etag})
+        finally:
+            event.remove(engine_test.sync_engine, "before_cursor_execute", record)
+        assert response.status_code == 304
+        assert not [s for s in statements if "FROM comment" in s]
+
+        await ac.patch(f"/comments/{first}", json={"content": "edited"})
+        response = await ac.get(f"/comments/{post_id}/thread",
+                                headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()[0]["replies"][0]["content"] == "edited"
+
+    async def test_thread_of_a_reply(self, ac: AsyncClient, thread):
+        post_id, first = thread
+        response = await ac.get(f"/comments/{post_id}/thread", params={
+            "parent_id": first,
+        })
+        [nested] = response.json()
+        assert nested["content"] == "nested"
+        assert [c["content"] for c in nested["replies"]] == ["deepest"]
+
+
+class TestBulkComments:
+
+    async def test_bulk_comments_from_json_array(
+            self, ac: AsyncClient, llm_stub, post_id
+    ):
+        llm_stub.reset()
+        response = await ac.post("/comments/bulk", json=[
+            {"content": "Bulk nice one", "post_id": post_id},
+            {"content": "Bulk shit", "post_id": post_id},
+            {"post_id": post_id},
+            {"content": "Bulk lost", "post_id": post_id + 1000},
+            {"content": "Bulk nice two", "post_id": post_id},
+        ])
+        assert response.status_code == 201
+        data = response.json()["data"]
+        assert [item["status"] for item in data] == [201, 201, 422, 404, 201]
+        assert [item.get("friendly") for item in data] == [
+            True, False, None, None, True
+        ]
+        assert llm_stub.batches == 1
+
+        response = await ac.get(f"/comments/{data[0]['id']}/status")
+        assert response.json()["data"]["friendly"]
+
+    async def test_bulk_comments_from_ndjson(
+            self, ac: AsyncClient, post_id, monkeypatch
+    ):
+        monkeypatch.setattr(config, "BULK_CHUNK_SIZE", 2)
+        lines = [
+            json.dumps({"content": f"Bulk line {i}", "post_id": post_id})
+            for i in range(3)
+        ]
+        response = await ac.post(
+            "/comments/bulk",
+            content="\n".join(lines[:2] + ["not json"] + lines[2:]) + "\n",
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        data = response.json()["data"]
+        assert [item["index"] for item in data] == [0, 1, 2, 3]
+        assert [item["status"] for item in data] == [201, 201, 422, 201]
+        ids = [item["id"] for item in data if item["status"] == 201]
+        assert ids == sorted(ids)
+
+
+class TestCommentStream:
+
+    @staticmethod
+    async def connected():
+        return False
+
+    @staticmethod
+    async def next_event(stream) -> dict:
+        chunk = await asyncio.wait_for(stream.__anext__(), timeout=2)
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        fields["data"] = json.loads(fields["data"])
+        return fields
+
+    async def test_stream_requires_auth(self, ac_fake: AsyncClient):
+        response = await ac_fake.get("/comments/1/stream")
+        assert response.status_code == 401
+
+    async def test_stream_user_session_closes_before_streaming(self, ac: AsyncClient):
+        closed = []
+
+        @asynccontextmanager
+        async def session_maker():
+            async with async_session_maker() as session:
+                yield session
+            closed.append(session)
+
+        token = ac.headers["Authorization"].split(" ", 1)[1]
+        user = await current_streaming_user(token, session_maker)
+        assert user.id == 1
+        assert len(closed) == 1
+        with pytest.raises(HTTPException):
+            await current_streaming_user("invalid", session_maker)
+
+    async def test_subscription_waits_for_redis(self, monkeypatch):
+        confirmed = asyncio.Event()
+
+        class PubSub:
+            async def psubscribe(self, pattern):
+                pass
+
+            async def listen(self):
+                await asyncio.sleep(0.05)
+                confirmed.set()
+                yield {"type": "psubscribe"}
+                await asyncio.Event().wait()
+
+            async def reset(self):
+                pass
+
+        class Redis:
+            def pubsub(self):
+                return PubSub()
+
+        monkeypatch.setattr("services.events.get_redis", lambda: Redis())
+        events = CommentEvents(queue_size=2)
+        async with events.subscribe(7):
+            assert confirmed.is_set()
+        await events.close()
+
+    async def test_new_friendly_comments_are_streamed(self, ac: AsyncClient, post_id):
+        stream = comment_stream(async_session_maker, post_id, None, self.connected)
+        assert (await stream.__anext__()).startswith("retry: ")
+        try:
+            await ac.post("/comments/", json={"content": "Fuck streams",
+                                              "post_id": post_id})
+            response = await ac.post("/comments/", json={"content": "Stream hello",
+                                                         "post_id": post_id})
+            assert response.status_code == 201
+            event = await self.next_event(stream)
+            assert event["event"] == "comment"
+            assert event["data"]["content"] == "Stream hello"
+            assert event["data"]["post_id"] == post_id
+            assert int(event["id"]) == event["data"]["id"]
+
+            await ac.post("/comments/reply", json={"content": "Stream reply",
+                                                   "parent_id": event["data"]["id"]})
+            reply = await self.next_event(stream)
+            assert reply["data"]["parent_id"] == event["data"]["id"]
+        finally:
+            await stream.aclose()
+
+    async def test_reconnection_replays_missed_comments(self, post_id):
+        async with async_session_maker() as session:
+            result = await session.execute(insert(Comment).returning(
+                Comment.c.id, sort_by_parameter_order=True,
+            ), [
+                {"content": content, "user_id": 1, "post_id": post_id,
+                 "friendly": friendly}
+                for content, friendly in (("seen", True), ("missed", True),
+                                          ("toxic", False), ("missed too", True))
+            ])
+            seen = result.scalars().first()
+            await session.commit()
+
+        stream = comment_stream(async_session_maker, post_id, seen, self.connected)
+        try:
+            await stream.__anext__()
+            contents = [(await self.next_event(stream))["data"]["content"]
+                        for _ in range(2)]
+        finally:
+            await stream.aclose()
+        assert contents == ["missed", "missed too"]
+
+    async def test_slow_subscriber_is_dropped(self):
+        events = CommentEvents(queue_size=2)
+        async with events.subscribe(7) as queue:
+            for comment_id in range(3):
+                events._deliver(7, json.dumps({"id": comment_id}))
+            assert queue.get_nowait() is None
+        assert events.subscribers == {}
+
+    async def test_stream_ends_on_disconnect(self, post_id):
+        async def disconnected():
+            return True
+
+        stream = comment_stream(async_session_maker, post_id, None, disconnected)
+        chunks = [chunk async for chunk in stream]
+        assert len(chunks) == 1
@@ -0,0 +1,35 @@
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+
+import config
+from config import TEST_DATABASE_URL
+from database import TimedQueuePool, create_engine
+
+
+def test_engine_uses_pool_settings(monkeypatch):
+    monkeypatch.setattr(config, "DB_POOL_SIZE", 3)
+    monkeypatch.setattr(config, "DB_MAX_OVERFLOW", 2)
+    engine = create_engine("settings", TEST_DATABASE_URL)
+    assert isinstance(engine.pool, TimedQueuePool)
+    assert engine.pool.size() == 3
+    assert engine.pool._max_overflow == 2
+
+
+def test_null_pool_can_be_configured(monkeypatch):
+    monkeypatch.setattr(config, "DB_POOL_CLASS", "null")
+    engine = create_engine("null", TEST_DATABASE_URL)
+    assert isinstance(engine.pool, NullPool)
+
+
+async def test_pool_metrics(ac_fake: AsyncClient):
+    engine = create_engine("metrics", TEST_DATABASE_URL)
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            response = await ac_fake.get("/metrics")
+    finally:
+        await engine.dispose()
+    assert response.status_code == 200
+    assert 'db_pool_checked_out{engine="metrics"} 1.0' in response.text
+    assert 'db_pool_wait_seconds_count{engine="metrics"} 1.0' in response.text
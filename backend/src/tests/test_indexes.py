@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event
+
+from services.cache import response_cache
+from services.pagination import encode_cursor
+from tests.conftest import engine_test
+
+TODAY = datetime.utcnow().date()
+DATES = {
+    "date_from": (TODAY - timedelta(days=30)).isoformat(),
+    "date_to": TODAY.isoformat(),
+}
+AFTER = {"cursor": encode_cursor(10)}
+TABLES = ("post", "comment", "comment_daily_stats")
+
+# Endpoints with the indexes the queries they send must use
+ENDPOINTS = {
+    "/posts/all_friendly": (AFTER, ("ix_post_friendly_id",)),
+    "/posts/user": (AFTER, ("ix_post_user_id_id",)),
+    "/posts/user_friendly": (AFTER, ("ix_post_user_id_id",)),
+    "/posts/export": (DATES, ("ix_post_created_at",)),
+    "/comments/all_friendly": (AFTER, ("ix_comment_friendly_id",)),
+    "/comments/user": (AFTER, ("ix_comment_user_id_id",)),
+    "/comments/user_friendly": (AFTER, ("ix_comment_user_id_id",)),
+    "/comments/1": (AFTER, ("ix_comment_post_id_id_friendly",)),
+    "/comments/1/thread": (AFTER, (
+        "ix_comment_post_id_id_friendly", "ix_comment_parent_id_id",
+    )),
+    "/comments/export": (DATES, ("ix_comment_created_at",)),
+    "/management/analysis": (DATES, (
+        "sqlite_autoindex_comment_daily_stats_1", "ix_comment_created_at",
+    )),
+}
+
+
+async def sent_queries(ac: AsyncClient, path: str, params: dict) -> list:
+    """The statements an endpoint sends to the tables above, with parameters."""
+    await response_cache.invalidate(
+        "posts", "comments", "comments:post:1", "comments:user:1"
+    )
+    statements = []
+
+    def record(conn, cursor, statement, parameters, *args):
+        if statement.startswith(("SELECT", "WITH")) and any(
+                f"FROM {table}" in statement or f"JOIN {table}" in statement
+                for table in TABLES
+        ):
+            statements.append((statement, parameters))
+
+    event.listen(engine_test.sync_engine, "before_cursor_execute", record)
+    try:
+        response = await ac.get(path, params=params)
+    finally:
+        event.remove(engine_test.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return statements
+
+
+async def explain(statement: str, parameters) -> str:
+    async with engine_test.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            result = await conn.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            )
+            return "\n".join(row[-1] for row in result)
+        await conn.exec_driver_sql("SET enable_seqscan = off")
+        result = await conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+        return "\n".join(row[0] for row in result)
+
+
+@pytest.mark.parametrize("path", ENDPOINTS)
+async def test_endpoint_queries_use_indexes(ac: AsyncClient, path):
+    params, indexes = ENDPOINTS[path]
+    statements = await sent_queries(ac, path, params)
+    assert statements
+
+    plans = [await explain(*statement) for statement in statements]
+    for plan in plans:
+        assert "Seq Scan" not in plan, plan
+        assert not any(
+            line.startswith(tuple(f"SCAN {table}" for table in TABLES))
+            and "USING" not in line
+            for line in plan.splitlines()
+        ), plan
+    for index in indexes:
+        assert any(index in plan for plan in plans), "\n\n".join(plans)
@@ -0,0 +1,61 @@
+import json
+import logging
+from logging.handlers import QueueHandler
+
+from httpx import AsyncClient
+
+from services.logger import Logger, pipeline, request_id
+
+
+def read_records(path) -> list:
+    with open(path, encoding="utf-8") as log:
+        return [json.loads(line) for line in log if line.startswith("{")]
+
+
+def test_logger_is_created_once(tmp_path):
+    for _ in range(3):
+        logger = Logger("tests.once", log_to_file=True, log_dir=str(tmp_path),
+                        filename="once.log").get_logger()
+    assert len(logger.handlers) == 1
+    assert isinstance(logger.handlers[0], QueueHandler)
+
+
+def test_records_are_json_with_request_id(tmp_path):
+    logger = Logger("tests.json", level=logging.INFO, log_to_file=True,
+                    log_dir=str(tmp_path), filename="json.log").get_logger()
+    token = request_id.set("req-1")
+    try:
+        logger.info("Saved comment %s", 42)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Failed")
+    finally:
+        request_id.reset(token)
+    logger.debug("Dropped")
+    pipeline.stop()
+
+    first, second = read_records(tmp_path / "json.log")
+    assert first["message"] == "Saved comment 42"
+    assert first["level"] == "INFO"
+    assert first["logger"] == "tests.json"
+    assert first["request_id"] == "req-1"
+    assert second["message"] == "Failed"
+    assert "ValueError: boom" in second["exception"]
+
+
+async def test_request_id_header(ac: AsyncClient):
+    response = await ac.get("/comments/999999/status",
+                            headers={"X-Request-ID": "test-request-1"})
+    assert response.headers["X-Request-ID"] == "test-request-1"
+    pipeline.stop()
+    records = read_records(pipeline.routes["comments.router"])
+    assert any(
+        record["request_id"] == "test-request-1" and record["level"] == "ERROR"
+        for record in records
+    )
+
+    response = await ac.get("/comments/999999/status")
+    generated = response.headers["X-Request-ID"]
+    assert len(generated) == 32
+    assert generated != "test-request-1"
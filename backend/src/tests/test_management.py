@@ -0,0 +1,158 @@
+from datetime import datetime, time, timedelta
+
+from httpx import AsyncClient
+from sqlalchemy import event, insert, select
+
+from comments.models import Comment
+from management.models import CommentDailyStats
+from management.utils import refresh_daily_stats
+from tests.conftest import async_session_maker, engine_test
+
+
+async def get_counts(ac: AsyncClient, user_id: int):
+    friendly = await ac.get("/management/count_friendly")
+    unfriendly = await ac.get("/management/count_unfriendly")
+    activity = await ac.get("/management/user_activity", params={"user_id": user_id})
+    return (
+        friendly.json()["count"],
+        unfriendly.json()["count"],
+        activity.json()["data"],
+    )
+
+
+class TestPublicUser:
+
+    async def test_count_friendly(self, ac_fake: AsyncClient):
+        response = await ac_fake.get("/management/count_friendly")
+        assert response.status_code == 401
+
+    async def test_analysis(self, ac_fake: AsyncClient):
+        response = await ac_fake.get("/management/analysis", params={
+            "date_from": "2024-01-01",
+            "date_to": "2024-01-02",
+        })
+        assert response.status_code == 401
+
+
+class TestAuthenticatedUser:
+
+    async def test_counters_follow_comment_changes(self, ac: AsyncClient):
+        user_id = 1  # the user registered in test_auth
+        friendly, unfriendly, activity = await get_counts(ac, user_id)
+
+        await ac.post("/comments/", json={"content": "Counted comment", "post_id": 1})
+        await ac.post("/comments/", json={"content": "Counted shit", "post_id": 1})
+        assert await get_counts(ac, user_id) == (
+            friendly + 1, unfriendly + 1,
+            {"friendly": activity["friendly"] + 1,
+             "unfriendly": activity["unfriendly"] + 1},
+        )
+
+        comments = (await ac.get("/comments/user", params={"limit": 1000})).json()
+        comment_id = [c["id"] for c in comments if c["content"] == "Counted shit"][0]
+        await ac.patch(f"/comments/{comment_id}", json={"content": "Counted again"})
+        assert (await get_counts(ac, user_id))[:2] == (friendly + 2, unfriendly)
+
+        await ac.delete(f"/comments/{comment_id}")
+        assert (await get_counts(ac, user_id))[:2] == (friendly + 1, unfriendly)
+
+    async def test_toxic_user(self, ac: AsyncClient):
+        await ac.post("/comments/", json={"content": "Toxic shit", "post_id": 1})
+        response = await ac.get("/management/toxic_user")
+        assert response.status_code == 200
+        assert response.json()["user_id"] is not None
+
+    async def test_analysis(self, ac: AsyncClient):
+        today = datetime.utcnow().date()
+        response = await ac.get("/management/analysis", params={
+            "date_from": today.isoformat(),
+            "date_to": (today + timedelta(days=1)).isoformat(),
+        })
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert data["friendly"] > 0
+        assert data["unfriendly"] > 0
+
+        assert len(data["daily"]) == 2
+        assert data["daily"][0]["friendly"] == data["friendly"]
+
+    async def test_analysis_daily_breakdown_from_rollup(self, ac: AsyncClient):
+        today = datetime.utcnow().date()
+        yesterday = today - timedelta(days=1)
+        async with async_session_maker() as session:
+            await session.execute(insert(Comment).values(
+                content="Yesterday's comment", user_id=1, post_id=1, friendly=True,
+                created_at=datetime.combine(yesterday, time(12)),
+            ))
+            await refresh_daily_stats(session, yesterday, yesterday)
+            await session.commit()
+
+        response = await ac.get("/management/analysis", params={
+            "date_from": (yesterday - timedelta(days=1)).isoformat(),
+            "date_to": today.isoformat(),
+            "post_id": 1,
+        })
+        daily = response.json()["data"]["daily"]
+        assert [day["date"] for day in daily] == [
+            (yesterday - timedelta(days=1)).isoformat(),
+            yesterday.isoformat(),
+            today.isoformat(),
+        ]
+        assert daily[0] == {"date": daily[0]["date"], "friendly": 0, "unfriendly": 0}
+        assert daily[1]["friendly"] == 1
+        assert daily[2]["friendly"] > 0
+
+    async def test_changes_of_older_comments_reach_the_rollup(self, ac: AsyncClient):
+        day = datetime.utcnow().date() - timedelta(days=10)
+
+        async def analysis():
+            response = await ac.get("/management/analysis", params={
+                "date_from": day.isoformat(), "date_to": day.isoformat(),
+            })
+            data = response.json()["data"]
+            return data["friendly"], data["unfriendly"]
+
+        async with async_session_maker() as session:
+            comment = await session.execute(insert(Comment).values(
+                content="Old comment", user_id=1, post_id=1, friendly=True,
+                created_at=datetime.combine(day, time(12)),
+            ).returning(Comment.c.id))
+            comment_id = comment.scalar()
+            await refresh_daily_stats(session, day, day)
+            await session.commit()
+        friendly, unfriendly = await analysis()
+
+        await ac.patch(f"/comments/{comment_id}", json={"content": "Old shit"})
+        assert await analysis() == (friendly - 1, unfriendly + 1)
+        await ac.delete(f"/comments/{comment_id}")
+        assert await analysis() == (friendly - 1, unfriendly)
+
+    async def test_refresh_survives_concurrent_rollup_upserts(self):
+        day = datetime.utcnow().date() - timedelta(days=20)
+
+        def upsert_meanwhile(conn, cursor, statement, parameters, *args):
+            if statement.startswith("DELETE FROM comment_daily_stats"):
+                cursor.execute(
+                    "INSERT INTO comment_daily_stats "
+                    "(day, post_id, user_id, friendly, unfriendly) "
+                    "VALUES (?, 1, 1, 5, 5)", (day.isoformat(),)
+                )
+
+        async with async_session_maker() as session:
+            await session.execute(insert(Comment).values(
+                content="Racing comment", user_id=1, post_id=1, friendly=True,
+                created_at=datetime.combine(day, time(12)),
+            ))
+            event.listen(engine_test.sync_engine, "after_cursor_execute",
+                         upsert_meanwhile)
+            try:
+                await refresh_daily_stats(session, day, day)
+            finally:
+                event.remove(engine_test.sync_engine, "after_cursor_execute",
+                             upsert_meanwhile)
+            await session.commit()
+            rows = await session.execute(select(CommentDailyStats).where(
+                CommentDailyStats.c.day == day
+            ))
+            rows = rows.fetchall()
+        assert [(row.friendly, row.unfriendly) for row in rows] == [(1, 0)]
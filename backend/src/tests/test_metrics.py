@@ -0,0 +1,91 @@
+import time
+
+from fastapi import APIRouter, FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+import worker
+from services.metrics import route_template
+from services.openai import OpenAI
+from tests.conftest import engine_test
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@worker.celery.task(name="metrics_probe")
+def probe():
+    return "done"
+
+
+async def test_request_latency_by_route(ac: AsyncClient):
+    labels = {"method": "GET", "route": "/comments/{comment_id}/status",
+              "status": "200"}
+    before = sample("http_request_duration_seconds_count", **labels)
+    queries = sample("db_queries_per_request_sum",
+                     route="/comments/{comment_id}/status")
+    await ac.get("/comments/999999/status")
+    assert sample("http_request_duration_seconds_count", **labels) == before + 1
+    assert sample("db_queries_per_request_sum",
+                  route="/comments/{comment_id}/status") > queries
+    assert sample("http_requests_in_progress", method="GET") == 0
+
+
+async def test_unknown_paths_share_one_route(ac: AsyncClient):
+    labels = {"method": "GET", "route": "unmatched", "status": "404"}
+    before = sample("http_request_duration_seconds_count", **labels)
+    await ac.get("/no/such/path/1")
+    await ac.get("/no/such/path/2")
+    assert sample("http_request_duration_seconds_count", **labels) == before + 2
+
+
+def test_route_template_is_the_route_path():
+    app, router = FastAPI(), APIRouter()
+
+    @router.get("/{tag}/tags")
+    async def tag_tags(tag: str):
+        return tag
+
+    app.include_router(router, prefix="/tags")
+    scope = {"app": app, "endpoint": tag_tags, "path": "/tags/tags/tags",
+             "path_params": {"tag": "tags"}}
+    assert route_template(scope) == "/tags/{tag}/tags"
+    assert route_template({"app": app, "path": "/tags"}) == "unmatched"
+
+
+async def test_query_duration_by_operation():
+    before = sample("db_query_duration_seconds_count", engine="test",
+                    operation="SELECT")
+    async with engine_test.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        await conn.execute(text("select 2"))
+    assert sample("db_query_duration_seconds_count", engine="test",
+                  operation="SELECT") == before + 2
+
+
+async def test_llm_call_duration(llm_stub):
+    before = sample("llm_request_duration_seconds_count", operation="check_text",
+                    outcome="ok")
+    await OpenAI().check_text("Have a nice day")
+    assert sample("llm_request_duration_seconds_count", operation="check_text",
+                  outcome="ok") == before + 1
+
+
+def test_celery_task_duration_and_queue_lag():
+    before = sample("celery_tasks_total", task="metrics_probe", state="SUCCESS")
+    probe.apply(headers={"published_at": time.time() - 5})
+    assert sample("celery_tasks_total", task="metrics_probe",
+                  state="SUCCESS") == before + 1
+    assert sample("celery_task_duration_seconds_count", task="metrics_probe",
+                  state="SUCCESS") == before + 1
+    assert sample("celery_task_queue_lag_seconds_sum", task="metrics_probe") >= 5
+
+
+async def test_metrics_endpoint(ac_fake: AsyncClient):
+    response = await ac_fake.get("/metrics")
+    assert response.status_code == 200
+    for name in ("http_request_duration_seconds", "db_query_duration_seconds",
+                 "llm_request_duration_seconds", "celery_task_duration_seconds"):
+        assert f"# TYPE {name} histogram" in response.text
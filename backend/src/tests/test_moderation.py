@@ -0,0 +1,322 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import insert, select, update
+
+import config
+import worker
+from comments.models import Comment
+from services.cache import LocalCache
+from services.moderation import Moderator, VerdictCache, normalize_text
+from services.moderation_backends import (
+    FallbackBackend, LocalModelBackend, ModerationBackend, StubBackend,
+    create_moderation_backend,
+)
+from services.prefilter import (
+    ALLOWED_TEXTS, BLOCKED_WORDS, Prefilter, WordMatcher, load_words,
+)
+from tests.conftest import async_session_maker
+
+
+@pytest.fixture
+def stub(llm_stub):
+    llm_stub.reset()
+    yield llm_stub
+    llm_stub.reset()
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_local_cache_expires_entries(monkeypatch):
+    cache = LocalCache(maxsize=2, ttl=10)
+    cache.set("a", False)
+    assert cache.get("a") is False
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_normalize_text():
+    assert normalize_text("  Great\n  POST ") == normalize_text("great post")
+
+
+async def test_repeated_text_is_checked_once(stub):
+    moderator = Moderator(VerdictCache(maxsize=100, ttl=60))
+    assert await moderator.check_text("Thanks!") is True
+    assert await moderator.check_text("  thanks! ") is True
+    assert await moderator.check_text("Fuck you") is False
+    assert await moderator.check_text("FUCK  you") is False
+    assert stub.requests == 2
+    stats = moderator.cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == 0.5
+
+
+def test_word_matcher_respects_word_boundaries():
+    matcher = WordMatcher(["ass", "he*", "hers", "kill yourself"])
+    assert matcher.search("you ass")
+    assert not matcher.search("first class")
+    assert matcher.search("hello there")
+    assert matcher.search("hers")
+    assert not matcher.search("others")
+    assert matcher.search("just kill yourself!")
+    assert not matcher.search("kill yourselves")
+
+
+@pytest.mark.parametrize("text, verdict", [
+    ("Thanks!", True),
+    ("  great   POST ", True),
+    ("+1", True),
+    ("\U0001F44D\U0001F525", True),
+    ("!!!", True),
+    ("What a bullshit take", False),
+    ("FUCKING great", False),
+    ("Buy now https://spam.example https://spam.example", False),
+    ("a http://a.example b http://b.example c www.c.example", False),
+    ("Docs are at https://docs.example", None),
+    ("Thanks, but I disagree", None),
+    ("Classic assessment", None),
+])
+def test_prefilter_classify(text, verdict):
+    prefilter = Prefilter(BLOCKED_WORDS, ALLOWED_TEXTS, max_links=3)
+    assert prefilter.classify(text) is verdict
+
+
+def test_load_words_from_file(tmp_path):
+    wordlist = tmp_path / "words.txt"
+    wordlist.write_text("darn*\n\nheck\n")
+    words = load_words(str(wordlist))
+    assert words[-2:] == ("darn*", "heck")
+    assert Prefilter(words, (), max_links=3).classify("Darnit") is False
+
+
+async def test_prefilter_saves_llm_calls(stub):
+    moderator = Moderator(
+        VerdictCache(maxsize=100, ttl=60),
+        Prefilter(BLOCKED_WORDS, ALLOWED_TEXTS, max_links=3),
+    )
+    assert await moderator.check_text("Thanks!") is True
+    assert await moderator.check_text("Fuck you") is False
+    assert await moderator.check_texts(
+        ["\U0001F600", "Have a nice day", "Have a nice day", "Shitty"]
+    ) == [True, True, True, False]
+    assert await moderator.check_text("Have a nice day") is True
+    assert stub.requests == 1
+    assert moderator.stats() == {
+        "backend": "openai",
+        "prefilter_friendly": 2,
+        "prefilter_toxic": 2,
+        "cache": 1,
+        "backends": {"openai": 2},
+        "backend_saved_rate": 5 / 7,
+    }
+
+
+class KeywordModel:
+    """Stands in for a fitted scikit-learn pipeline."""
+
+    thread = None
+
+    def predict(self, texts):
+        self.thread = threading.get_ident()
+        return [0 if "awful" in text else 1 for text in texts]
+
+
+class BrokenBackend(ModerationBackend):
+    name = "broken"
+
+    async def check_text(self, text):
+        raise asyncio.TimeoutError
+
+    async def check_texts(self, texts):
+        raise asyncio.TimeoutError
+
+
+async def test_stub_backend_is_deterministic():
+    backend = StubBackend(latency=0.05)
+    started = time.monotonic()
+    assert await backend.check_texts(["Have a nice day", "Fuck you"]) == [True, False]
+    assert time.monotonic() - started >= 0.05
+
+
+async def test_local_model_backend():
+    backend = LocalModelBackend(KeywordModel())
+    assert await backend.check_text("Lovely") is True
+    assert await backend.check_texts(["Lovely", "awful stuff"]) == [True, False]
+    assert backend.model.thread != threading.get_ident()
+    with pytest.raises(RuntimeError):
+        LocalModelBackend.load(None)
+
+
+def test_backends_implement_both_checks():
+    class HalfBackend(ModerationBackend):
+        async def check_text(self, text):
+            return True
+
+    with pytest.raises(TypeError):
+        HalfBackend()
+
+
+async def test_fallback_backend_serves_failed_calls():
+    backend = FallbackBackend(BrokenBackend(), StubBackend())
+    assert await backend.check_text("Have a nice day") is True
+    assert await backend.check_texts(["Hi there", "Shit"]) == [True, False]
+    assert backend.fallbacks == 2
+    assert backend.name == "broken+stub"
+    assert backend.primary_name == "broken"
+
+
+async def test_fallback_verdicts_are_not_cached():
+    moderator = Moderator(
+        VerdictCache(maxsize=100, ttl=60),
+        backend=FallbackBackend(BrokenBackend(), StubBackend()),
+    )
+    assert await moderator.check_texts(["Hi there", "Shit"]) == [True, False]
+    assert await moderator.check_text("Hi there") is True
+    assert moderator.backend.fallbacks == 2
+    assert moderator.stats()["backends"] == {"stub": 3}
+    assert moderator.stats()["cache"] == 0
+
+
+async def test_verdicts_are_cached_per_backend(stub):
+    cache = VerdictCache(maxsize=100, ttl=60)
+    await Moderator(cache, backend=StubBackend()).check_text("Be kind")
+    moderator = Moderator(cache)
+    assert await moderator.check_text("Be kind") is True
+    assert stub.requests == 1
+
+
+def test_create_moderation_backend(monkeypatch):
+    monkeypatch.setattr(config, "MODERATION_BACKEND", "stub")
+    monkeypatch.setattr(config, "MODERATION_FALLBACK", "")
+    assert isinstance(create_moderation_backend(), StubBackend)
+    monkeypatch.setattr(config, "MODERATION_BACKEND", "openai")
+    monkeypatch.setattr(config, "MODERATION_FALLBACK", "stub")
+    assert create_moderation_backend().name == "openai+stub"
+    monkeypatch.setattr(config, "MODERATION_BACKEND", "unknown")
+    with pytest.raises(ValueError):
+        create_moderation_backend()
+
+
+async def test_moderator_uses_its_backend(stub):
+    moderator = Moderator(VerdictCache(maxsize=100, ttl=60), backend=StubBackend())
+    assert await moderator.check_texts(["Be kind", "Bitch"]) == [True, False]
+    assert await moderator.check_text("Be kind") is True
+    assert stub.requests == 0
+    assert moderator.stats()["backend"] == "stub"
+
+
+async def test_moderation_sources(ac: AsyncClient, ac_fake: AsyncClient):
+    response = await ac_fake.get("/management/moderation_sources")
+    assert response.status_code == 401
+    response = await ac.get("/management/moderation_sources")
+    assert response.status_code == 200
+    assert "backend_saved_rate" in response.json()["data"]
+
+
+async def test_moderation_cache_stats(ac: AsyncClient, ac_fake: AsyncClient):
+    response = await ac_fake.get("/management/moderation_cache")
+    assert response.status_code == 401
+    response = await ac.get("/management/moderation_cache")
+    assert response.status_code == 200
+    assert "hit_rate" in response.json()["data"]
+
+
+class TestBackgroundModeration:
+
+    @pytest.fixture
+    def queued(self, monkeypatch):
+        queued = []
+        monkeypatch.setattr(config, "MODERATION_ASYNC", True)
+        monkeypatch.setattr(worker.moderate_comment, "delay",
+                            lambda *args: queued.append(args))
+        monkeypatch.setattr(worker, "async_session_maker", async_session_maker)
+        return queued
+
+    @pytest.fixture
+    async def pending_comment(self, ac: AsyncClient, queued):
+        response = await ac.post("/comments/", json={
+            "content": "Pending content",
+            "post_id": 1,
+        })
+        assert response.status_code == 201
+        return response.json()["id"]
+
+    async def test_comment_is_saved_as_pending(
+            self, ac: AsyncClient, queued, pending_comment
+    ):
+        assert queued == [(pending_comment, True)]
+
+        response = await ac.get(f"/comments/{pending_comment}/status")
+        data = response.json()["data"]
+        assert data["moderation_status"] == "pending"
+        assert not data["friendly"]
+
+        response = await ac.get("/comments/all_friendly")
+        assert pending_comment not in [c["id"] for c in response.json()]
+
+    async def test_stale_pending_comment_is_queued_again(self, queued, pending_comment):
+        queued.clear()
+        await asyncio.to_thread(worker.requeue_pending_moderation)
+        assert queued == []
+
+        async with async_session_maker() as session:
+            await session.execute(update(Comment).where(
+                Comment.c.id == pending_comment
+            ).values(updated_at=datetime.utcnow() - timedelta(
+                seconds=config.MODERATION_REQUEUE_AFTER + 1
+            )))
+            await session.commit()
+        await asyncio.to_thread(worker.requeue_pending_moderation)
+        assert (pending_comment, True) in queued
+
+    async def test_worker_moderates_pending_comment(self, queued, pending_comment):
+        await asyncio.to_thread(worker.moderate_comment, *queued[-1])
+
+        async with async_session_maker() as session:
+            result = await session.execute(select(Comment).where(
+                Comment.c.id == pending_comment
+            ))
+            comment = result.fetchone()
+        assert comment.moderation_status == "done"
+        assert comment.friendly
+
+    def test_worker_moderates_a_batch_with_one_call(self, queued, llm_stub):
+        async def create(content):
+            async with async_session_maker() as session:
+                result = await session.execute(insert(Comment).values(
+                    content=content, user_id=1, post_id=1, friendly=False,
+                    moderation_status="pending",
+                ).returning(Comment.c.id))
+                await session.commit()
+                return result.scalar()
+
+        async def verdicts(ids):
+            async with async_session_maker() as session:
+                result = await session.execute(select(
+                    Comment.c.moderation_status, Comment.c.friendly
+                ).where(Comment.c.id.in_(ids)).order_by(Comment.c.id))
+                return result.all()
+
+        ids = [asyncio.run(create(c)) for c in ("Batch one", "Batch shit", "Batch 3")]
+        llm_stub.reset()
+        asyncio.run(worker._moderate_items([["comment", i, False] for i in ids]))
+        assert llm_stub.batches == 1
+        assert asyncio.run(verdicts(ids)) == [
+            ("done", True), ("done", False), ("done", True)
+        ]
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+import config
+from services.openai import OpenAI
+
+
+@pytest.fixture
+def stub(llm_stub):
+    llm_stub.reset()
+    yield llm_stub
+    llm_stub.reset()
+
+
+async def test_check_text_friendly(stub):
+    assert await OpenAI().check_text("Have a nice day") is True
+    assert stub.requests == 1
+
+
+async def test_check_text_toxic(stub):
+    assert await OpenAI().check_text("Fuck you") is False
+
+
+async def test_reply_to_comment(stub):
+    reply = await OpenAI().reply_to_comment("Post", "Nice post")
+    assert reply == "Thank you for your comment!"
+
+
+async def test_call_does_not_block_event_loop(stub):
+    stub.delay = 0.3
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.ensure_future(ticker())
+    await OpenAI().check_text("Have a nice day")
+    task.cancel()
+    assert ticks > 10
+
+
+async def test_timeout(stub):
+    stub.delay = 0.5
+    with pytest.raises(asyncio.TimeoutError):
+        await OpenAI()._complete("Hello", max_tokens=5, timeout=0.1)
+
+
+async def test_bounded_concurrency(stub, monkeypatch):
+    await OpenAI.close()
+    monkeypatch.setattr(config, "OPENAI_MAX_CONCURRENCY", 2)
+    stub.delay = 0.1
+    try:
+        results = await asyncio.gather(
+            *(OpenAI().check_text("Have a nice day") for _ in range(6))
+        )
+    finally:
+        await OpenAI.close()
+    assert all(results)
+    assert stub.requests == 6
+    assert stub.max_in_flight == 2
+
+
+async def test_session_is_shared(stub):
+    await OpenAI().check_text("Have a nice day")
+    session = OpenAI._session
+    await OpenAI().check_text("Have a nice day")
+    assert OpenAI._session is session
+
+
+async def test_check_texts_in_one_request(stub):
+    verdicts = await OpenAI().check_texts(["Have a nice day", "Fuck you", 'Say "hi"'])
+    assert verdicts == [True, False, True]
+    assert stub.requests == 1
+
+
+async def test_check_texts_falls_back_to_single_checks(stub):
+    stub.batch_reply = "Sorry, I can't help with that"
+    verdicts = await OpenAI().check_texts(["Have a nice day", "Fuck you"])
+    assert verdicts == [True, False]
+    assert stub.requests == 3
+
+
+def test_parse_verdicts():
+    assert OpenAI._parse_verdicts("Result: [1, 0]", 2) == [True, False]
+    assert OpenAI._parse_verdicts('["1","0"]', 2) == [True, False]
+    assert OpenAI._parse_verdicts("[1]", 2) is None
+    assert OpenAI._parse_verdicts("[1, 2]", 2) is None
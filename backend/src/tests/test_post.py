@@ -1,5 +1,8 @@
+import pytest
 from httpx import AsyncClient
 
+from services.pagination import encode_cursor
+
 
 class TestPublicUser:
 
@@ -98,6 +101,23 @@ class TestAuthenticatedUser:
         response = await ac.get("/posts/1")
         assert response.status_code == 200
 
+    async def test_get_unchanged_post_by_id(self, ac: AsyncClient):
+        response = await ac.get("/posts/1")
+        etag = response.headers["ETag"]
+
+        response = await ac.get("/posts/1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+        response = await ac.patch("/posts/1", json={
+            "title": "Title",
+            "content": "Fuck you",
+        })
+        assert response.status_code == 200
+        response = await ac.get("/posts/1", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
     async def test_add_one_more(self, ac: AsyncClient):
         response = await ac.post("/posts/", json={
             "title": "Title",
@@ -107,6 +127,27 @@ class TestAuthenticatedUser:
         response_json = response.json()
         assert response_json["description"] == "Post created successfully"
 
+    async def test_get_all_posts_page_by_page(self, ac: AsyncClient):
+        response = await ac.get("/posts/all", params={"limit": 1})
+        assert response.status_code == 200
+        first_page = response.json()
+        assert len(first_page) == 1
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = await ac.get("/posts/all", params={"limit": 1, "cursor": cursor})
+        second_page = response.json()
+        assert len(second_page) == 1
+        assert second_page[0]["id"] > first_page[0]["id"]
+        assert "X-Next-Cursor" not in response.headers
+
+    @pytest.mark.parametrize("cursor", [
+        "not a cursor", encode_cursor("1"), encode_cursor([1]),
+        encode_cursor({"id": 1}), encode_cursor(True), encode_cursor(-1),
+    ])
+    async def test_get_all_posts_with_invalid_cursor(self, ac: AsyncClient, cursor):
+        response = await ac.get("/posts/all", params={"cursor": cursor})
+        assert response.status_code == 400
+
     async def test_delete_post(self, ac: AsyncClient):
         response = await ac.delete("/posts/1")
         assert response.status_code == 200
@@ -0,0 +1,87 @@
+import json
+import time
+
+import pytest
+from httpx import AsyncClient
+
+import config
+from services import rate_limit
+from services.rate_limit import TokenBucketLimiter
+
+
+def test_parse_rate_limits():
+    assert config._parse_rate_limits("a=10/60, b=1/1,") == {"a": (10, 60), "b": (1, 1)}
+
+
+async def test_bucket_refills_over_time(monkeypatch):
+    limiter = TokenBucketLimiter()
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    assert await limiter.take("user", rate=0.5, burst=2) == (True, 0.0)
+    assert await limiter.take("user", rate=0.5, burst=2) == (True, 0.0)
+    allowed, retry_after = await limiter.take("user", rate=0.5, burst=2)
+    assert not allowed
+    assert retry_after == pytest.approx(2)
+    assert (await limiter.take("other", rate=0.5, burst=2))[0]
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 2)
+    assert (await limiter.take("user", rate=0.5, burst=2))[0]
+
+
+async def test_write_endpoint_answers_429(ac: AsyncClient, monkeypatch):
+    monkeypatch.setattr(rate_limit, "limiter", TokenBucketLimiter())
+    monkeypatch.setitem(config.RATE_LIMITS, "comments:update", (2, 60))
+    for _ in range(2):
+        response = await ac.patch("/comments/100000", json={"content": "Hi"})
+        assert response.status_code != 429
+    response = await ac.patch("/comments/100000", json={"content": "Hi"})
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 30
+
+
+async def test_bulk_items_are_rate_limited(ac: AsyncClient, monkeypatch):
+    monkeypatch.setattr(rate_limit, "limiter", TokenBucketLimiter())
+    monkeypatch.setitem(config.RATE_LIMITS, "comments:bulk", (3, 60))
+    monkeypatch.setattr(config, "BULK_CHUNK_SIZE", 2)
+    lines = [json.dumps({"content": "Bulk", "post_id": 100000})] * 4
+    response = await ac.post(
+        "/comments/bulk",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert [item["status"] for item in response.json()["data"]] == [
+        404, 404, 429, 429
+    ]
+
+    response = await ac.post("/comments/bulk", json=[{"content": "Bulk"}] * 2)
+    assert response.status_code == 429
+
+
+async def test_bulk_requests_may_exceed_the_create_burst(ac: AsyncClient, monkeypatch):
+    monkeypatch.setattr(rate_limit, "limiter", TokenBucketLimiter())
+    monkeypatch.setitem(config.RATE_LIMITS, "comments:bulk", (40, 60))
+    items = [{"content": "Bulk", "post_id": 100000}] * 40
+    assert len(items) > config.RATE_LIMITS["comments:create"][0]
+    response = await ac.post("/comments/bulk", json=items)
+    assert response.status_code == 201
+    assert {item["status"] for item in response.json()["data"]} == {404}
+
+    # Chunks never cost more than the burst, however large BULK_CHUNK_SIZE is
+    monkeypatch.setitem(config.RATE_LIMITS, "comments:bulk", (5, 60))
+    monkeypatch.setattr(rate_limit, "limiter", TokenBucketLimiter())
+    response = await ac.post("/comments/bulk", json=items[:7])
+    assert [item["status"] for item in response.json()["data"]] == [404] * 5 + [429] * 2
+
+
+async def test_bulk_items_are_capped(ac: AsyncClient, monkeypatch):
+    monkeypatch.setattr(rate_limit, "limiter", TokenBucketLimiter())
+    monkeypatch.setattr(config, "BULK_MAX_ITEMS", 2)
+    response = await ac.post("/comments/bulk", json=[{"content": "Bulk"}] * 3)
+    assert response.status_code == 413
+
+    response = await ac.post(
+        "/comments/bulk",
+        content="\n".join(["{}"] * 3),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert [item["status"] for item in response.json()["data"]] == [422, 422, 413]
@@ -0,0 +1,95 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects import postgresql
+
+from comments.models import Comment
+from posts.models import Post
+from search.utils import search_query
+from services.pagination import NEXT_CURSOR_HEADER, encode_cursor
+from tests.conftest import async_session_maker
+
+
+@pytest.fixture(scope="module")
+async def post_id():
+    """A friendly and a toxic post, each with matching comments."""
+    async with async_session_maker() as session:
+        post = await session.execute(insert(Post).values(
+            title="Zephyr gardens", content="Planting in 100% sun", user_id=1,
+            friendly=True,
+        ).returning(Post.c.id))
+        post_id = post.scalar()
+        toxic = await session.execute(insert(Post).values(
+            title="Zephyr rant", content="Toxic", user_id=1, friendly=False,
+        ).returning(Post.c.id))
+        toxic_id = toxic.scalar()
+        await session.execute(insert(Comment), [
+            {"content": f"Zephyr tulip {number}", "user_id": 1, "post_id": post_id,
+             "friendly": True}
+            for number in range(3)
+        ] + [
+            {"content": "Zephyr tulip toxic", "user_id": 1, "post_id": post_id,
+             "friendly": False},
+        ])
+        await session.commit()
+    yield post_id
+    async with async_session_maker() as session:
+        await session.execute(delete(Comment).where(Comment.c.post_id == post_id))
+        await session.execute(delete(Post).where(Post.c.id.in_([post_id, toxic_id])))
+        await session.commit()
+
+
+async def test_search_requires_auth(ac_fake: AsyncClient):
+    response = await ac_fake.get("/search/posts", params={"q": "zephyr"})
+    assert response.status_code == 401
+
+
+async def test_search_posts_friendly_only(ac: AsyncClient, post_id):
+    response = await ac.get("/search/posts", params={"q": "ZEPHYR"})
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json()] == [post_id]
+
+    response = await ac.get("/search/posts", params={"q": "zephyr sun"})
+    assert [post["id"] for post in response.json()] == [post_id]
+    response = await ac.get("/search/posts", params={"q": "zephyr moon"})
+    assert response.json() == []
+
+
+async def test_search_escapes_like_wildcards(ac: AsyncClient, post_id):
+    response = await ac.get("/search/posts", params={"q": "100%"})
+    assert [post["id"] for post in response.json()] == [post_id]
+    response = await ac.get("/search/posts", params={"q": "10_%"})
+    assert response.json() == []
+
+
+async def test_search_comments_page_by_page(ac: AsyncClient, post_id):
+    ids, cursor = [], None
+    while True:
+        params = {"q": "zephyr tulip", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = await ac.get("/search/comments", params=params)
+        assert response.status_code == 200
+        ids += [comment["id"] for comment in response.json()]
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            break
+    assert len(ids) == 3
+    assert ids == sorted(ids, reverse=True)
+
+
+@pytest.mark.parametrize("after", [5, [1], ["a", 1], [0.5, "1"]])
+async def test_search_rejects_invalid_cursor(ac: AsyncClient, after):
+    response = await ac.get("/search/comments", params={
+        "q": "zephyr", "cursor": encode_cursor(after),
+    })
+    assert response.status_code == 400
+
+
+def test_postgresql_search_uses_tsvector():
+    stmt = search_query("postgresql", "post", "green garden", (0.5, 10), 20)
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "post.search_vector @@ websearch_to_tsquery(" in sql
+    assert "ts_rank(post.search_vector, websearch_to_tsquery(" in sql
+    assert "LIKE" not in sql
+    assert "ORDER BY anon_1.rank DESC, anon_1.id DESC" in sql
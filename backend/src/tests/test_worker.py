@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from sqlalchemy import insert, select, update
+
+import worker
+from comments.models import AutoReply, Comment
+from services.openai import OpenAI
+from tests.conftest import async_session_maker
+
+
+async def llm_call():
+    await OpenAI().check_text("Have a nice day")
+    return asyncio.get_running_loop(), OpenAI._session
+
+
+def test_tasks_reuse_the_event_loop_and_llm_session(llm_stub):
+    loop, session = worker.run_async(llm_call())
+    assert worker.run_async(llm_call()) == (loop, session)
+    assert not loop.is_closed()
+
+
+def test_process_shutdown_closes_the_event_loop(llm_stub):
+    loop, session = worker.run_async(llm_call())
+    worker.shutdown_worker_process()
+    assert loop.is_closed()
+    assert session.closed
+
+    new_loop, _ = worker.run_async(llm_call())
+    assert new_loop is not loop
+
+
+async def test_threads_share_the_event_loop_of_the_process(llm_stub):
+    calls = await asyncio.gather(*(
+        asyncio.to_thread(worker.run_async, llm_call()) for _ in range(4)
+    ))
+    assert len(set(calls)) == 1
+
+
+class TestAutoReply:
+    @pytest.fixture
+    def scheduled(self, monkeypatch):
+        scheduled = []
+        monkeypatch.setattr(worker.reply_to_comment, "apply_async",
+                            lambda args, **kwargs: scheduled.append(args))
+        return scheduled
+
+    @pytest.fixture
+    async def comment(self, monkeypatch, create_post):
+        monkeypatch.setattr(worker, "async_session_maker", async_session_maker)
+        post_id = await create_post(auto_answer=True, delay_answer=0)
+        async with async_session_maker() as session:
+            comment = await session.execute(insert(Comment).values(
+                content="Nice post", user_id=1, post_id=post_id, friendly=True,
+            ).returning(Comment.c.id, Comment.c.post_id, Comment.c.content))
+            comment = comment.fetchone()
+            await session.commit()
+        return comment
+
+    async def test_auto_reply_is_scheduled_once(self, comment, scheduled):
+        async with async_session_maker() as session:
+            await worker.schedule_auto_replies(session, [comment])
+            await worker.schedule_auto_replies(session, [comment])
+        assert [args[0] for args in scheduled] == [comment.id]
+
+    async def test_unsent_auto_reply_is_marked_failed(self, comment, monkeypatch):
+        def apply_async(args, **kwargs):
+            raise ConnectionError("Broker is down")
+
+        monkeypatch.setattr(worker.reply_to_comment, "apply_async", apply_async)
+        async with async_session_maker() as session:
+            await worker.schedule_auto_replies(session, [comment])
+            status = await session.execute(select(AutoReply.c.status).where(
+                AutoReply.c.comment_id == comment.id
+            ))
+        assert status.scalar() == "failed"
+
+    async def test_failed_claim_leaves_the_running_one_alone(
+            self, comment, scheduled, monkeypatch
+    ):
+        async with async_session_maker() as session:
+            await worker.schedule_auto_replies(session, [comment])
+            await session.execute(update(AutoReply).where(
+                AutoReply.c.comment_id == comment.id
+            ).values(status="running"))
+            await session.commit()
+
+        async def claim(*args):
+            raise ConnectionError("Database is down")
+
+        monkeypatch.setattr(worker, "_claim_auto_reply", claim)
+        with pytest.raises(ConnectionError):
+            await asyncio.to_thread(worker.reply_to_comment, *scheduled[-1])
+        async with async_session_maker() as session:
+            status = await session.execute(select(AutoReply.c.status).where(
+                AutoReply.c.comment_id == comment.id
+            ))
+        assert status.scalar() == "running"
+
+    async def test_auto_reply_is_created_once(self, comment, scheduled, ac, llm_stub):
+        async with async_session_maker() as session:
+            await worker.schedule_auto_replies(session, [comment])
+        args = scheduled[-1]
+        llm_stub.reset()
+
+        await asyncio.to_thread(worker.reply_to_comment, *args)
+        await asyncio.to_thread(worker.reply_to_comment, *args)
+        assert llm_stub.requests == 1
+
+        async with async_session_maker() as session:
+            replies = await session.execute(select(Comment.c.id).where(
+                Comment.c.parent_id == comment.id
+            ))
+            replies = replies.scalars().all()
+        assert len(replies) == 1
+
+        response = await ac.get(f"/comments/{comment.id}/auto_reply")
+        [auto_reply] = response.json()["data"]
+        assert auto_reply["status"] == "done"
+        assert auto_reply["reply_id"] == replies[0]
+        assert auto_reply["attempts"] == 1
@@ -1,14 +1,56 @@
 import os
 import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta
 from celery import Celery
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+import config
 
-from comments.utils import create_comment
+from database import create_engine, dialect_insert
+from comments.models import (
+    AUTO_REPLY_FAILED,
+    AUTO_REPLY_RUNNING,
+    AUTO_REPLY_SCHEDULED,
+    AutoReply,
+    Comment,
+)
+from comments.utils import bump_comments_version, comment_namespaces, create_comment
+from posts.models import Post
+from management.utils import (
+    count_comment_change,
+    counted_verdict,
+    refresh_daily_stats,
+)
 
+from services.cache import response_cache
+from services.events import comment_events
+from services.moderation import (
+    moderator,
+    MODERATION_DONE,
+    MODERATION_FAILED,
+    MODERATION_PENDING,
+)
+from services.metrics import (
+    CELERY_TASK_DURATION,
+    CELERY_TASK_QUEUE_LAG,
+    CELERY_TASKS,
+    mark_process_dead,
+)
 from services.openai import OpenAI
-from services.logger import Logger
+from services.redis import close_redis, get_redis, get_sync_redis
+from services.logger import Logger, pipeline, request_id
 import logging
 
 logger = Logger(__name__, level=logging.INFO, log_to_file=True, log_dir='logger/',
@@ -18,30 +60,502 @@ celery = Celery(__name__)
 celery.conf.broker_url = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379")
 celery.conf.result_backend = os.environ.get("CELERY_RESULT_BACKEND", "redis://localhost:6379")  # noqa
 
+# Tasks share the event loop of their process, so run them in processes
+celery.conf.worker_pool = "prefork"
+
+celery.conf.beat_schedule = {
+    "refresh-daily-stats": {
+        "task": "refresh_daily_stats",
+        "schedule": config.ROLLUP_INTERVAL,
+    },
+    "requeue-pending-moderation": {
+        "task": "requeue_pending_moderation",
+        "schedule": config.MODERATION_REQUEUE_INTERVAL,
+    },
+}
+
 # Database
-engine = create_async_engine(DATABASE_URL)
+engine = create_engine("worker")
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+MODERATION_MAX_RETRIES = 3
+AUTO_REPLY_MAX_RETRIES = 3
+MODERATION_QUEUE = "navi:moderation:queue"
+MODERATION_FLUSH_KEY = "navi:moderation:flush"
+
+# One event loop per worker process: the engine, the Redis client and the LLM
+# session are process-global and bound to the loop that opened them
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def run_async(coro):
+    """
+    Run a coroutine on the event loop of the worker process.
+
+    The loop lives as long as the process, so the database pool, the Redis
+    client and the LLM session opened on it are reused by every task. Tasks of
+    a threaded pool take turns on the loop instead of each opening their own.
+    """
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop.is_closed() or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+        asyncio.set_event_loop(_loop)
+        return _loop.run_until_complete(coro)
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Drop the connections a forked worker process inherited from its parent."""
+    engine.sync_engine.dispose(close=False)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    """
+    Close the clients and connections opened on the event loop of the process,
+    then write out its metrics and queued log records.
+    """
+    global _loop
+    with _loop_lock:
+        loop, _loop = _loop, None
+        if loop is not None and not loop.is_closed() and _loop_pid == os.getpid():
+            async def close():
+                await OpenAI.close()
+                await close_redis()
+                await engine.dispose()
+
+            try:
+                loop.run_until_complete(close())
+            except Exception as e:
+                logger.error(f"Error closing the worker event loop: {e}")
+            finally:
+                loop.close()
+    mark_process_dead()
+    pipeline.stop()
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    """Record when a task is sent, to measure how long it waits in the queue."""
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+@task_prerun.connect
+def bind_task_id(task_id=None, **kwargs):
+    """Tag the records logged by a task with its id."""
+    request_id.set(task_id)
 
-@celery.task(name="create_task")
+
+@task_postrun.connect
+def unbind_task_id(**kwargs):
+    request_id.set(None)
+
+
+@task_prerun.connect
+def start_task_timer(task=None, **kwargs):
+    task.request.started_at = time.perf_counter()
+    # Custom headers are request attributes on workers, but stay in
+    # request.headers when the task is applied eagerly
+    published_at = getattr(task.request, "published_at", None)
+    if published_at is None:
+        published_at = (task.request.headers or {}).get("published_at")
+    if published_at is None:
+        return
+    # Tasks sent with a countdown are due at their ETA, not when published
+    due = float(published_at)
+    if task.request.eta:
+        eta = task.request.eta
+        if isinstance(eta, str):
+            eta = datetime.fromisoformat(eta)
+        due = max(due, eta.timestamp())
+    CELERY_TASK_QUEUE_LAG.labels(task.name).observe(max(time.time() - due, 0))
+
+
+@task_postrun.connect
+def stop_task_timer(task=None, state=None, **kwargs):
+    started_at = getattr(task.request, "started_at", None)
+    state = state or "UNKNOWN"
+    if started_at is not None:
+        CELERY_TASK_DURATION.labels(task.name, state).observe(
+            time.perf_counter() - started_at
+        )
+    CELERY_TASKS.labels(task.name, state).inc()
+
+
+@celery.task(name="create_task", bind=True, acks_late=True,
+             max_retries=AUTO_REPLY_MAX_RETRIES)
 def reply_to_comment(
+        self,
         comment_id: int,
         post_id: int,
         author_id: int,
         content: str,  # post content
         comment: str  # comment content
 ):
-    """Celery task to reply to a comment with an AI-generated response."""
+    """
+    Celery task to reply to a comment with an AI-generated response.
+
+    The task first claims the auto_reply row of the comment and post author,
+    so retried or redelivered tasks never ask the LLM or reply a second time.
+    """
+    claimed = False
+
     async def get_reply():
+        nonlocal claimed
         async with async_session_maker() as session:
+            claimed = await _claim_auto_reply(session, comment_id, author_id)
+            if not claimed:
+                logger.info(f"Auto-reply to comment {comment_id} is already handled")
+                return
             ai = OpenAI()
             answer = await ai.reply_to_comment(content, comment)
-            try:
-                new_comment_id = await create_comment(
-                    comment_id, post_id, author_id, answer, session
-                )
+            new_comment_id = await create_comment(
+                comment_id, post_id, author_id, answer, session
+            )
+            if new_comment_id is None:
+                logger.info(f"Auto-reply to comment {comment_id} is already done")
+            else:
                 logger.info(f"Successfully created comment with ID: {new_comment_id}")
-            except Exception as e:
-                logger.error(f"Error inserting comment: {e}")
 
-    asyncio.run(get_reply())
+    try:
+        run_async(get_reply())
+    except Exception as e:
+        logger.error(f"Error replying to comment {comment_id}: {e}")
+        failed = self.request.retries >= self.max_retries
+        # Only the task holding the claim may hand it back, others leave it alone
+        if claimed:
+            run_async(_release_auto_reply(comment_id, author_id, failed))
+        if not failed:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+
+
+async def _claim_auto_reply(session: AsyncSession, comment_id: int,
+                            author_id: int) -> bool:
+    """
+    Mark the auto-reply as running, unless another task runs or ran it.
+    Running auto-replies older than AUTO_REPLY_STALE_AFTER are taken over.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=config.AUTO_REPLY_STALE_AFTER)
+    claimed = await session.execute(update(AutoReply).where(
+        AutoReply.c.comment_id == comment_id
+    ).where(
+        AutoReply.c.author_id == author_id
+    ).where(or_(
+        AutoReply.c.status == AUTO_REPLY_SCHEDULED,
+        and_(
+            AutoReply.c.status == AUTO_REPLY_RUNNING,
+            AutoReply.c.updated_at < stale,
+        ),
+    )).values(
+        status=AUTO_REPLY_RUNNING,
+        attempts=AutoReply.c.attempts + 1,
+    ).returning(AutoReply.c.comment_id))
+    if claimed.first() is None:
+        # Tasks queued before their auto_reply row was written have none yet
+        inserted = await session.execute(dialect_insert(session, AutoReply).values(
+            comment_id=comment_id,
+            author_id=author_id,
+            status=AUTO_REPLY_RUNNING,
+            attempts=1,
+        ).on_conflict_do_nothing().returning(AutoReply.c.comment_id))
+        if inserted.first() is None:
+            await session.rollback()
+            return False
+    await session.commit()
+    return True
+
+
+async def _release_auto_reply(comment_id: int, author_id: int, failed: bool) -> None:
+    """Hand a running auto-reply back for a retry, or mark it failed."""
+    async with async_session_maker() as session:
+        await session.execute(update(AutoReply).where(
+            AutoReply.c.comment_id == comment_id
+        ).where(
+            AutoReply.c.author_id == author_id
+        ).where(
+            AutoReply.c.status == AUTO_REPLY_RUNNING
+        ).values(
+            status=AUTO_REPLY_FAILED if failed else AUTO_REPLY_SCHEDULED,
+        ))
+        await session.commit()
+
+
+async def _moderate_rows(table, row_ids, auto_reply_ids=(), failed: bool = False):
+    """
+    Classify pending rows with one moderation call and store the verdicts.
+
+    A verdict only applies while the row still holds the moderated content,
+    so an edit made in the meantime keeps its own pending state. Friendly
+    comments listed in ``auto_reply_ids`` get the post author's auto-reply
+    scheduled. Returns the moderated rows.
+    """
+    async with async_session_maker() as session:
+        result = await session.execute(select(table).where(
+            table.c.id.in_(row_ids)
+        ).where(
+            table.c.moderation_status == MODERATION_PENDING
+        ))
+        rows = result.fetchall()
+        if not rows:
+            return []
+
+        if failed:
+            verdicts, status = [False] * len(rows), MODERATION_FAILED
+        else:
+            verdicts = await moderator.check_texts([row.content for row in rows])
+            status = MODERATION_DONE
+
+        moderated = []
+        for row, friendly in zip(rows, verdicts):
+            updated = await session.execute(update(table).where(
+                table.c.id == row.id
+            ).where(
+                table.c.moderation_status == MODERATION_PENDING
+            ).where(
+                table.c.content == row.content
+            ).values(
+                friendly=friendly,
+                moderation_status=status,
+            ).returning(*table.c))
+            row = updated.fetchone()
+            if row is None:
+                continue
+            moderated.append(row)
+            if table is Comment:
+                await count_comment_change(
+                    session,
+                    row,
+                    None,
+                    counted_verdict(row.friendly, row.moderation_status),
+                )
+        if table is Comment:
+            await bump_comments_version(
+                session, [row.post_id for row in moderated if row.friendly]
+            )
+        await session.commit()
+        if table is Comment:
+            friendly = [row for row in moderated if row.friendly]
+            await response_cache.invalidate(*comment_namespaces(friendly))
+            await comment_events.publish(friendly)
+        elif moderated:
+            await response_cache.invalidate("posts")
+
+        replies = [c for c in moderated if c.friendly and c.id in auto_reply_ids]
+        if table is Comment and replies:
+            await schedule_auto_replies(session, replies)
+        return moderated
+
+
+async def schedule_auto_replies(session: AsyncSession, comments) -> None:
+    """
+    Schedule the post author's auto-reply to freshly moderated comments.
+
+    Every comment and post author pair gets one auto_reply row, so comments
+    moderated again, e.g. after an edit, are never scheduled twice. Rows whose
+    task could not be sent are marked failed.
+    """
+    result = await session.execute(select(Post).where(
+        Post.c.id.in_({comment.post_id for comment in comments})
+    ))
+    posts = {post.id: post for post in result.fetchall()}
+    auto_replies = [
+        {
+            "comment_id": comment.id,
+            "author_id": posts[comment.post_id].user_id,
+            "status": AUTO_REPLY_SCHEDULED,
+        }
+        for comment in comments
+        if comment.post_id in posts and posts[comment.post_id].auto_answer
+    ]
+    if not auto_replies:
+        return
+    scheduled = await session.execute(dialect_insert(session, AutoReply).values(
+        auto_replies
+    ).on_conflict_do_nothing().returning(AutoReply.c.comment_id))
+    scheduled = set(scheduled.scalars())
+    await session.commit()
+
+    unpublished = []
+    for comment in comments:
+        if comment.id not in scheduled:
+            continue
+        post = posts[comment.post_id]
+        try:
+            reply_to_comment.apply_async(
+                (
+                    comment.id,
+                    comment.post_id,
+                    post.user_id,
+                    post.content,
+                    comment.content
+                ),
+                countdown=post.delay_answer)
+        except Exception as e:
+            logger.error(f"Error scheduling auto-reply to comment {comment.id}: {e}")
+            unpublished.append((comment.id, post.user_id))
+
+    # A scheduled row whose task was never sent would wait for it forever
+    for comment_id, author_id in unpublished:
+        await session.execute(update(AutoReply).where(
+            AutoReply.c.comment_id == comment_id
+        ).where(
+            AutoReply.c.author_id == author_id
+        ).where(
+            AutoReply.c.status == AUTO_REPLY_SCHEDULED
+        ).values(status=AUTO_REPLY_FAILED))
+    if unpublished:
+        await session.commit()
+
+
+async def _moderate_items(items) -> None:
+    """Moderate a batch of queued ``(kind, row_id, auto_reply)`` items."""
+    comment_ids = [row_id for kind, row_id, _ in items if kind == "comment"]
+    post_ids = [row_id for kind, row_id, _ in items if kind == "post"]
+    auto_reply_ids = {row_id for kind, row_id, auto in items if auto}
+    if comment_ids:
+        await _moderate_rows(Comment, comment_ids, auto_reply_ids)
+    if post_ids:
+        await _moderate_rows(Post, post_ids)
+
+
+async def enqueue_moderation(kind: str, *row_ids: int, auto_reply: bool = False
+                             ) -> None:
+    """
+    Queue pending posts or comments for background moderation.
+
+    With Redis configured, queued rows are classified in batches of up to
+    MODERATION_BATCH_SIZE items, waiting at most MODERATION_BATCH_WINDOW_MS
+    for a batch to fill up. Otherwise every row gets its own task.
+    """
+    redis = get_redis()
+    if redis is None or config.MODERATION_BATCH_SIZE <= 1:
+        for row_id in row_ids:
+            if kind == "comment":
+                moderate_comment.delay(row_id, auto_reply)
+            else:
+                moderate_post.delay(row_id)
+        return
+
+    length = await redis.rpush(MODERATION_QUEUE, *(
+        json.dumps([kind, row_id, auto_reply]) for row_id in row_ids
+    ))
+    if length >= config.MODERATION_BATCH_SIZE:
+        moderate_batch.delay()
+    elif await redis.set(MODERATION_FLUSH_KEY, 1, nx=True,
+                         px=config.MODERATION_BATCH_WINDOW_MS):
+        moderate_batch.apply_async(countdown=config.MODERATION_BATCH_WINDOW_MS / 1000)
+
+
+@celery.task(name="moderate_batch")
+def moderate_batch():
+    """
+    Celery task to drain the moderation queue batch by batch.
+
+    Items of a batch that fails are handed over to the per-row tasks,
+    which retry them on their own.
+    """
+    redis = get_sync_redis()
+    redis.delete(MODERATION_FLUSH_KEY)
+    while True:
+        items = redis.lpop(MODERATION_QUEUE, config.MODERATION_BATCH_SIZE)
+        if not items:
+            break
+        items = [json.loads(item) for item in items]
+        try:
+            run_async(_moderate_items(items))
+            logger.info(f"Moderated a batch of {len(items)} items")
+        except Exception as e:
+            logger.error(f"Error moderating a batch of {len(items)} items: {e}")
+            for kind, row_id, auto_reply in items:
+                if kind == "comment":
+                    moderate_comment.delay(row_id, auto_reply)
+                else:
+                    moderate_post.delay(row_id)
+
+
+@celery.task(name="moderate_post", bind=True, max_retries=MODERATION_MAX_RETRIES)
+def moderate_post(self, post_id: int):
+    """Celery task to classify a post that was saved as pending."""
+    try:
+        run_async(_moderate_rows(Post, [post_id]))
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        logger.error(f"Error moderating post {post_id}: {e}")
+        run_async(_moderate_rows(Post, [post_id], failed=True))
+
+
+@celery.task(name="moderate_comment", bind=True, max_retries=MODERATION_MAX_RETRIES)
+def moderate_comment(self, comment_id: int, auto_reply: bool = False):
+    """
+    Celery task to classify a comment that was saved as pending.
+
+    When ``auto_reply`` is set, a friendly comment gets the post author's
+    auto-reply scheduled just like a synchronously moderated one.
+    """
+    auto_reply_ids = {comment_id} if auto_reply else ()
+    try:
+        run_async(_moderate_rows(Comment, [comment_id], auto_reply_ids))
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        logger.error(f"Error moderating comment {comment_id}: {e}")
+        run_async(_moderate_rows(Comment, [comment_id], failed=True))
+
+
+@celery.task(name="requeue_pending_moderation")
+def requeue_pending_moderation():
+    """
+    Celery beat task to queue again the posts and comments still pending
+    MODERATION_REQUEUE_AFTER seconds after their last change: their items were
+    lost with a worker that died mid-batch, or never queued because Redis
+    failed after the row was committed. Moderating a row twice is harmless,
+    the first verdict stored wins, and comments get at most one auto-reply.
+    """
+    async def requeue():
+        stale = datetime.utcnow() - timedelta(seconds=config.MODERATION_REQUEUE_AFTER)
+        pending = {}
+        async with async_session_maker() as session:
+            for kind, table in (("post", Post), ("comment", Comment)):
+                result = await session.execute(select(table.c.id).where(
+                    table.c.moderation_status == MODERATION_PENDING
+                ).where(
+                    table.c.updated_at < stale
+                ).order_by(table.c.updated_at).limit(config.MODERATION_REQUEUE_LIMIT))
+                pending[kind] = result.scalars().all()
+        if pending["post"]:
+            await enqueue_moderation("post", *pending["post"])
+        if pending["comment"]:
+            await enqueue_moderation("comment", *pending["comment"], auto_reply=True)
+        return pending
+
+    pending = run_async(requeue())
+    if pending["post"] or pending["comment"]:
+        logger.warning(f"Queued {len(pending['post'])} posts and "
+                       f"{len(pending['comment'])} comments left pending again")
+
+
+@celery.task(name="refresh_daily_stats")
+def refresh_comment_daily_stats():
+    """
+    Celery beat task to rebuild the daily comment rollup of the last
+    ROLLUP_LOOKBACK_DAYS days from the comments themselves. Comment changes
+    update the rollup as they happen, this reconciles the recent days with
+    anything written outside of the application.
+    """
+    async def refresh():
+        today = datetime.utcnow().date()
+        async with async_session_maker() as session:
+            await refresh_daily_stats(
+                session, today - timedelta(days=config.ROLLUP_LOOKBACK_DAYS), today
+            )
+            await session.commit()
+
+    run_async(refresh())
+    logger.info("Daily comment statistics refreshed")